@@ -8,13 +8,11 @@ import base64
 from io import BytesIO
 import PIL
 import json
-from loadModel import loadModel
+from loadModel import loadModel, MODEL_IDS
 from send import send, getTimings, clearSession
 from status import status
 import os
 import numpy as np
-import skimage
-import skimage.measure
 from getScheduler import getScheduler, SCHEDULERS
 from getPipeline import (
     getPipelineClass,
@@ -27,10 +25,17 @@ import requests
 from download import download_model, normalize_model_id
 import traceback
 from precision import MODEL_REVISION, MODEL_PRECISION
-from device import device, device_id, device_name
+from device import (
+    device,
+    device_id,
+    device_name,
+    model_size,
+    model_to_device,
+    model_to_host,
+    free_model,
+)
 from utils import Storage
 from hashlib import sha256
-from threading import Timer
 import extras
 
 from diffusers import (
@@ -41,7 +46,26 @@ from diffusers import (
 )
 
 from lib.textual_inversions import handle_textual_inversions
-from lib.prompts import prepare_prompts
+from lib.prompts import prepare_prompts, encode_prompts, prompt_embeds_cache
+from lib.model_cache import ModelCache
+from lib.batching import Batcher, batch_key, merge_batch, split_batch_result
+from lib.responses import images_result, RESPONSE_FORMATS
+from lib.image_encoders import get_output_options, encode_images
+from lib.artifacts import artifact_cache
+from lib.disk_cache import disk_cache
+from lib.single_flight import single_flight
+from lib.lora_cache import lora_adapters
+from lib.optimize import optimize_model, take_timings, enabled_optimizations
+from lib.shapes import parse_buckets, bucket_inputs, restore_size, warmup
+from lib.progress import ProgressBroadcaster
+from lib.previews import ProgressThrottle, latent_preview, snapshot_latents
+from lib.cancellation import (
+    CancelToken,
+    SharedCancelToken,
+    Cancelled,
+    cancelled_result,
+)
+from lib.result_cache import result_cache, cacheable, fingerprint
 from lib.vars import (
     RUNTIME_DOWNLOADS,
     USE_DREAMBOOTH,
@@ -50,16 +74,23 @@ from lib.vars import (
     HF_AUTH_TOKEN,
     HOME,
     MODELS_DIR,
+    MODEL_CACHE_GPU_BYTES,
+    MODEL_CACHE_CPU_BYTES,
+    MODEL_CACHE_MAX_MODELS,
+    MODEL_CACHE_POLICY,
+    MODEL_CACHE_PIN_MEMORY,
+    BATCH_MAX_SIZE,
+    BATCH_WINDOW_MS,
+    SHAPE_BUCKETS,
+    SHAPE_BUCKET_MODE,
+    SHAPE_WARMUP_STEPS,
+    PROGRESS_INTERVAL_MS,
+    PREVIEW_SIZE,
 )
 
-if USE_DREAMBOOTH:
-    from train_dreambooth import TrainDreamBooth
-print(os.environ.get("USE_PATCHMATCH"))
-if os.environ.get("USE_PATCHMATCH") == "1":
-    from PyPatchMatch import patch_match
-
 torch.set_grad_enabled(False)
 always_normalize_model_id = None
+shape_buckets = parse_buckets()
 
 
 # Init is ran on server startup
@@ -86,6 +117,13 @@ def init():
         last_model_id = None
 
     if not RUNTIME_DOWNLOADS:
+        # Models baked into the image can't be downloaded again, never let
+        # LoRA etc downloads evict them (they're not in the model cache).
+        for model_id in MODEL_IDS if MODEL_ID == "ALL" else [MODEL_ID]:
+            disk_cache.reserve(
+                os.path.join(MODELS_DIR, normalize_model_id(model_id, MODEL_REVISION))
+            )
+
         normalized_model_id = normalize_model_id(MODEL_ID, MODEL_REVISION)
         model_dir = os.path.join(MODELS_DIR, normalized_model_id)
         if os.path.isdir(model_dir):
@@ -99,6 +137,13 @@ def init():
             precision=MODEL_PRECISION,
             revision=MODEL_REVISION,
         )
+        if enabled_optimizations:
+            optimize_model(model)
+        if shape_buckets and SHAPE_WARMUP_STEPS:
+            try:
+                warmup(model, shape_buckets, steps=SHAPE_WARMUP_STEPS)
+            except Exception as error:
+                print("Warmup failed, continuing", error)
     else:
         model = None
 
@@ -118,6 +163,15 @@ def getFromUrl(url: str, name: str) -> PIL.Image:
     return image
 
 
+def createGenerator(seed=None):
+    generator = torch.Generator(device=device)
+    if seed == None:
+        generator.seed()
+    else:
+        generator.manual_seed(seed)
+    return generator
+
+
 def truncateInputs(inputs: dict):
     clone = inputs.copy()
     if "modelInputs" in clone:
@@ -137,10 +191,343 @@ last_attn_procs = None
 last_lora_weights = None
 cross_attention_kwargs = None
 
+model_cache = ModelCache(
+    gpu_bytes=MODEL_CACHE_GPU_BYTES,
+    cpu_bytes=MODEL_CACHE_CPU_BYTES,
+    max_models=MODEL_CACHE_MAX_MODELS,
+    policy=MODEL_CACHE_POLICY,
+    to_gpu=model_to_device,
+    to_cpu=lambda model: model_to_host(model, pin_memory=MODEL_CACHE_PIN_MEMORY),
+    size_of=model_size,
+    on_evict=clearPipelines,
+    free=free_model,
+)
+# Never delete the files of models that are loaded
+disk_cache.in_use = lambda: model_cache.entries.keys()
+
+
+async def activate_model(
+    normalized_model_id, load, result, send_opts={}, startRequestId=None
+):
+    """
+    Makes `normalized_model_id` the active `model`, from the GPU / RAM
+    model cache if it's resident, otherwise by calling `load()`.  LoRA
+    and cross attention state is saved / restored per model.
+    """
+    global model
+    global last_model_id
+    global last_attn_procs
+    global last_lora_weights
+    global cross_attention_kwargs
+
+    previous = model_cache.entries.get(last_model_id)
+    if previous and last_model_id != normalized_model_id:
+        previous.state = {
+            "attn_procs": last_attn_procs,
+            "lora_weights": last_lora_weights,
+            "cross_attention_kwargs": cross_attention_kwargs,
+        }
+
+    if last_model_id != normalized_model_id:
+        # Let go of the previous model, so if it's evicted to make room, its
+        # memory is actually freed (rather than copied to RAM).
+        model = None
+        last_model_id = None
+
+    tier = model_cache.tier(normalized_model_id)
+    if tier == "cpu":
+        await send(
+            "promoteModel", "start", {"startRequestId": startRequestId}, send_opts
+        )
+    entry = await asyncio.to_thread(model_cache.get, normalized_model_id)
+    if tier == "cpu":
+        await send(
+            "promoteModel", "done", {"startRequestId": startRequestId}, send_opts
+        )
+
+    if not entry:
+        await asyncio.to_thread(model_cache.make_room)
+        await send("loadModel", "start", {"startRequestId": startRequestId}, send_opts)
+        loaded = await asyncio.to_thread(load)
+        await send("loadModel", "done", {"startRequestId": startRequestId}, send_opts)
+        if enabled_optimizations:
+            await send("optimize", "start", {}, send_opts)
+            await asyncio.to_thread(optimize_model, loaded)
+            await send("optimize", "done", {}, send_opts)
+        entry = await asyncio.to_thread(model_cache.put, normalized_model_id, loaded)
+
+    if last_model_id != normalized_model_id:
+        model = entry.model
+        last_model_id = normalized_model_id
+        last_attn_procs = entry.state.get("attn_procs", None)
+        last_lora_weights = entry.state.get("lora_weights", None)
+        cross_attention_kwargs = entry.state.get("cross_attention_kwargs", None)
+
+    result["$meta"].update(
+        {
+            "model_cache": {
+                "status": {"gpu": "hit", "cpu": "promoted"}.get(tier, "miss"),
+                **model_cache.counters,
+            }
+        }
+    )
+
+
+def download_size(*urls):
+    """
+    Total size of the files at `urls` (skipping empty ones), as far as
+    their storage knows without downloading them, else 0.
+    """
+    size = 0
+    for url in urls:
+        storage = Storage(url, no_raise=True) if url else None
+        if not storage:
+            continue
+        try:
+            size += storage.get_info().get("size", 0) or 0
+        except Exception as error:
+            print(f"Couldn't get size of {url}: {error}")
+    return size
+
+
+async def fetch_model(model_id, call_inputs, send_opts={}):
+    """
+    With RUNTIME_DOWNLOADS, downloads `model_id` (per `call_inputs`) unless
+    it's already on disk or in the model cache.  Returns its normalized id.
+    """
+    hf_model_id = call_inputs.get("HF_MODEL_ID", None)
+    model_revision = call_inputs.get("MODEL_REVISION", None)
+    model_precision = call_inputs.get("MODEL_PRECISION", None)
+    checkpoint_url = call_inputs.get("CHECKPOINT_URL", None)
+    checkpoint_config_url = call_inputs.get("CHECKPOINT_CONFIG_URL", None)
+    normalized_model_id = normalize_model_id(model_id, model_revision)
+    model_dir = os.path.join(MODELS_DIR, normalized_model_id)
+    pipeline_name = call_inputs.get("PIPELINE", None)
+    pipeline_class = getPipelineClass(pipeline_name) if pipeline_name else None
+
+    if not os.path.isdir(model_dir):
+        model_url = call_inputs.get("MODEL_URL", None)
+        if not model_url:
+            # return {
+            #     "$error": {
+            #         "code": "NO_MODEL_URL",
+            #         "message": "Currently RUNTIME_DOWNOADS requires a MODEL_URL callInput",
+            #     }
+            # }
+            normalized_model_id = hf_model_id or model_id
+        if not model_cache.tier(normalized_model_id):
+            # Concurrent requests for the same model share one download, and
+            # all get its events (marked as shared for those who joined it).
+            key = normalized_model_id
+            size = await asyncio.to_thread(download_size, model_url, checkpoint_url)
+            await asyncio.to_thread(disk_cache.ensure_space, size, model_dir)
+            shared = single_flight.in_flight(key)
+
+            async def forward(type, status, payload):
+                if shared:
+                    payload = {**payload, "shared": True}
+                await send(type, status, payload, send_opts)
+
+            with disk_cache.pinned(model_dir):
+                await single_flight.run(
+                    key,
+                    lambda: download_model(
+                        model_id=model_id,
+                        model_url=model_url,
+                        model_revision=model_revision,
+                        checkpoint_url=checkpoint_url,
+                        checkpoint_config_url=checkpoint_config_url,
+                        hf_model_id=hf_model_id,
+                        model_precision=model_precision,
+                        send_opts=send_opts,
+                        pipeline_class=pipeline_class,
+                        on_event=lambda *args: single_flight.publish(key, *args),
+                    ),
+                    subscriber=forward,
+                )
+        # downloaded_models.update({normalized_model_id: True})
+
+    return normalized_model_id
+
+
+def lora_weights_path(storage, weights: str):
+    storage_query_fname = storage.query.get("fname")
+    if storage_query_fname:
+        fname = storage_query_fname[0]
+    else:
+        # The URL without its #fragment, so any #scale= shares one file
+        hash = sha256(storage.url.encode("utf-8")).hexdigest()
+        fname = "url_" + hash[:7] + "--" + storage.url.split("/").pop()
+    return os.path.join(MODELS_DIR, "lora_weights--" + fname)
+
+
+async def prefetch(call_inputs: dict):
+    """
+    Downloads everything `call_inputs` needs (model, LoRAs) without loading
+    anything, so it's safe to run concurrently with inference.
+    """
+    model_id = call_inputs.get("MODEL_ID", None) or MODEL_ID
+    if RUNTIME_DOWNLOADS:
+        await fetch_model(model_id, call_inputs)
+
+    lora_weights = call_inputs.get("lora_weights", None) or []
+    if type(lora_weights) is not list:
+        lora_weights = [lora_weights]
+    for weights in lora_weights:
+        storage = Storage(weights, no_raise=True, status=status)
+        if storage:
+            await artifact_cache.fetch_async(
+                storage, lora_weights_path(storage, weights)
+            )
+
+
+async def inference_batch(batch: list) -> list:
+    """
+    Runs a batch of `(all_inputs, cancel)`.  Requests cancelled while
+    waiting are left out, and the batch is only cancelled once all the
+    others are too; any cancelled meanwhile get CANCELLED, not an image.
+    """
+    active = [i for i, (all_inputs, cancel) in enumerate(batch) if not cancel.cancelled]
+    results = [cancelled_result(cancel) for all_inputs, cancel in batch]
+
+    if len(active) == 1:
+        all_inputs, cancel = batch[active[0]]
+        results[active[0]] = await run_inference(all_inputs, None, cancel)
+    elif active:
+        shared = SharedCancelToken()
+        for i in active:
+            shared.add(batch[i][1])
+        merged = merge_batch([batch[i][0] for i in active])
+        # Nobody sends the merged request again, cache each one's own images
+        merged["callInputs"].update({"result_cache": False})
+        split = split_batch_result(
+            await run_inference(merged, None, shared), len(active)
+        )
+        for i, result in zip(active, split):
+            results[i] = result
+            await store_batch_result(batch[i][0], result)
+
+    return [
+        cancelled_result(cancel) if cancel.cancelled else result
+        for (all_inputs, cancel), result in zip(batch, results)
+    ]
+
+
+async def store_batch_result(all_inputs: dict, result: dict):
+    """
+    Stores one request's share of a merged batch's result in the result
+    cache, under that request's own fingerprint.
+    """
+    if "$error" in result or not result_cache.enabled:
+        return
+    key = request_fingerprint(all_inputs)
+    if not key:
+        return
+    if "$images" in result:
+        images = result["$images"]
+    else:
+        images = [base64.b64decode(result["image_base64"])]
+    mimetype = get_output_options(all_inputs["callInputs"])["mimetype"]
+    await result_cache.store(key, images, mimetype)
+    result["$meta"].update({"cache": "miss"})
+
+
+batcher = Batcher(inference_batch, max_size=BATCH_MAX_SIZE, window_ms=BATCH_WINDOW_MS)
+
+
+def batch_group(all_inputs: dict, response=None):
+    """
+    Requests with the same (non-None) group can be batched together, see
+    `lib/batching.py`.  Always None unless BATCH_MAX_SIZE > 1.
+    """
+    model_inputs = all_inputs.get("modelInputs", None)
+    call_inputs = all_inputs.get("callInputs", None)
+    if BATCH_MAX_SIZE > 1 and not response and model_inputs and call_inputs:
+        return batch_key(model_inputs, call_inputs)
+
+
+def request_fingerprint(all_inputs: dict):
+    """
+    A hash of everything that determines a seeded request's images (see
+    lib/result_cache.py), or None if its output isn't reproducible.
+    """
+    model_inputs = all_inputs.get("modelInputs", None)
+    call_inputs = all_inputs.get("callInputs", None)
+    if not model_inputs or not call_inputs or not cacheable(model_inputs, call_inputs):
+        return None
+    try:
+        output_options = get_output_options(call_inputs)
+    except ValueError:
+        return None
+    return fingerprint(
+        model_inputs,
+        call_inputs,
+        {
+            "MODEL_ID": MODEL_ID,
+            "PIPELINE": PIPELINE,
+            "MODEL_REVISION": MODEL_REVISION,
+            "MODEL_PRECISION": MODEL_PRECISION,
+            "diffusers": __version__,
+            "output": output_options,
+            # Bucketed sizes generate (slightly) different images
+            "SHAPE_BUCKETS": SHAPE_BUCKETS,
+            "SHAPE_BUCKET_MODE": SHAPE_BUCKET_MODE,
+        },
+    )
+
+
+async def cached_result(all_inputs: dict, key: str, streaming=False):
+    """
+    The result for a request with fingerprint `key` from the result cache,
+    or None.  Checked before queueing, so hits don't wait for the GPU.
+    """
+    call_inputs = all_inputs.get("callInputs", None)
+    response_format = (
+        "json" if streaming else call_inputs.get("response_format", "json")
+    )
+    if not result_cache.enabled or response_format not in RESPONSE_FORMATS:
+        return None
+    cached = await result_cache.lookup(key)
+    if not cached:
+        return None
+    return {
+        "$meta": {"cache": "hit"},
+        **images_result(cached["images"], response_format, cached["mimetype"]),
+        "$timings": {},
+    }
+
 
 # Inference is ran for every server call
 # Reference your preloaded global model variable here.
-async def inference(all_inputs: dict, response) -> dict:
+async def inference(all_inputs: dict, response, cancel=None) -> dict:
+    # Opt-in micro-batching of compatible txt2img requests
+    key = batch_group(all_inputs, response)
+    if key:
+        return await batcher.submit(key, (all_inputs, cancel or CancelToken()))
+
+    return await run_inference(all_inputs, response, cancel)
+
+
+async def run_inference(all_inputs: dict, response, cancel=None) -> dict:
+    # A cancelled request (see lib/cancellation.py, or a closed streaming
+    # response) stops at the next denoising step.
+    cancel = cancel or CancelToken()
+    if cancel.cancelled:  # while queued
+        return cancelled_result(cancel)
+
+    # Sends status (streaming) and pipeline progress events on this loop,
+    # until the request is done.
+    progress = ProgressBroadcaster(
+        send, status, response, on_closed=lambda: cancel.cancel("disconnected")
+    )
+    progress.start()
+    try:
+        return await _run_inference(all_inputs, response, progress, cancel)
+    finally:
+        await progress.stop()
+
+
+async def _run_inference(all_inputs: dict, response, progress, cancel) -> dict:
     global model
     global pipelines
     global last_model_id
@@ -166,18 +553,6 @@ async def inference(all_inputs: dict, response) -> dict:
     if response:
         send_opts.update({"response": response})
 
-        async def sendStatusAsync():
-            await response.send(json.dumps(status.get()) + "\n")
-
-        def sendStatus():
-            try:
-                asyncio.run(sendStatusAsync())
-                Timer(1.0, sendStatus).start()
-            except:
-                pass
-
-        Timer(1.0, sendStatus).start()
-
     if model_inputs == None or call_inputs == None:
         return {
             "$error": {
@@ -189,6 +564,25 @@ async def inference(all_inputs: dict, response) -> dict:
 
     startRequestId = call_inputs.get("startRequestId", None)
 
+    # Raw image bytes can't be sent as NDJSON, streaming is always "json".
+    response_format = call_inputs.get("response_format", "json")
+    if response:
+        response_format = "json"
+    if response_format not in RESPONSE_FORMATS:
+        return {
+            "$error": {
+                "code": "INVALID_RESPONSE_FORMAT",
+                "message": f'Invalid response_format "{response_format}"',
+                "requested": response_format,
+                "available": RESPONSE_FORMATS,
+            }
+        }
+
+    try:
+        output_options = get_output_options(call_inputs)
+    except ValueError as err:
+        return {"$error": {"code": "INVALID_OUTPUT_OPTIONS", "message": str(err)}}
+
     use_extra = call_inputs.get("use_extra", None)
     if use_extra:
         extra = getattr(extras, use_extra, None)
@@ -210,6 +604,14 @@ async def inference(all_inputs: dict, response) -> dict:
             startRequestId=startRequestId,
         )
 
+    # Seeded requests are deterministic, their results are cached (and
+    # hits answered before queueing, see cached_result())
+    result_key = None
+    if result_cache.enabled:
+        result_key = request_fingerprint(all_inputs)
+    if result_key:
+        result["$meta"].update({"cache": "miss"})
+
     model_id = call_inputs.get("MODEL_ID", None)
     if not model_id:
         if not MODEL_ID:
@@ -224,62 +626,31 @@ async def inference(all_inputs: dict, response) -> dict:
     normalized_model_id = model_id
 
     if RUNTIME_DOWNLOADS:
-        hf_model_id = call_inputs.get("HF_MODEL_ID", None)
         model_revision = call_inputs.get("MODEL_REVISION", None)
         model_precision = call_inputs.get("MODEL_PRECISION", None)
-        checkpoint_url = call_inputs.get("CHECKPOINT_URL", None)
-        checkpoint_config_url = call_inputs.get("CHECKPOINT_CONFIG_URL", None)
         normalized_model_id = normalize_model_id(model_id, model_revision)
         model_dir = os.path.join(MODELS_DIR, normalized_model_id)
         pipeline_name = call_inputs.get("PIPELINE", None)
         if pipeline_name:
             pipeline_class = getPipelineClass(pipeline_name)
         if last_model_id != normalized_model_id:
-            # if not downloaded_models.get(normalized_model_id, None):
-            if not os.path.isdir(model_dir):
-                model_url = call_inputs.get("MODEL_URL", None)
-                if not model_url:
-                    # return {
-                    #     "$error": {
-                    #         "code": "NO_MODEL_URL",
-                    #         "message": "Currently RUNTIME_DOWNOADS requires a MODEL_URL callInput",
-                    #     }
-                    # }
-                    normalized_model_id = hf_model_id or model_id
-                await download_model(
-                    model_id=model_id,
-                    model_url=model_url,
-                    model_revision=model_revision,
-                    checkpoint_url=checkpoint_url,
-                    checkpoint_config_url=checkpoint_config_url,
-                    hf_model_id=hf_model_id,
-                    model_precision=model_precision,
-                    send_opts=send_opts,
-                    pipeline_class=pipeline_class if pipeline_name else None,
-                )
-                # downloaded_models.update({normalized_model_id: True})
-            clearPipelines()
-            cross_attention_kwargs = None
-            if model:
-                model.to("cpu")  # Necessary to avoid a memory leak
-            await send(
-                "loadModel", "start", {"startRequestId": startRequestId}, send_opts
-            )
-            model = await asyncio.to_thread(
-                loadModel,
+            normalized_model_id = await fetch_model(model_id, call_inputs, send_opts)
+
+        await activate_model(
+            normalized_model_id,
+            lambda: loadModel(
                 model_id=normalized_model_id,
                 load=True,
                 precision=model_precision,
                 revision=model_revision,
                 send_opts=send_opts,
                 pipeline_class=pipeline_class if pipeline_name else None,
-            )
-            await send(
-                "loadModel", "done", {"startRequestId": startRequestId}, send_opts
-            )
-            last_model_id = normalized_model_id
-            last_attn_procs = None
-            last_lora_weights = None
+            ),
+            result=result,
+            send_opts=send_opts,
+            startRequestId=startRequestId,
+        )
+        disk_cache.touch(model_dir)
     else:
         if always_normalize_model_id:
             normalized_model_id = always_normalize_model_id
@@ -292,10 +663,13 @@ async def inference(all_inputs: dict, response) -> dict:
 
     if MODEL_ID == "ALL":
         if last_model_id != normalized_model_id:
-            clearPipelines()
-            cross_attention_kwargs = None
-            model = loadModel(normalized_model_id, send_opts=send_opts)
-            last_model_id = normalized_model_id
+            await activate_model(
+                normalized_model_id,
+                lambda: loadModel(normalized_model_id, send_opts=send_opts),
+                result=result,
+                send_opts=send_opts,
+                startRequestId=startRequestId,
+            )
     else:
         if model_id != MODEL_ID and not RUNTIME_DOWNLOADS:
             return {
@@ -358,7 +732,9 @@ async def inference(all_inputs: dict, response) -> dict:
     image_decoder = getFromUrl if is_url else decodeBase64Image
 
     textual_inversions = call_inputs.get("textual_inversions", [])
-    await handle_textual_inversions(textual_inversions, model, status=status)
+    await handle_textual_inversions(
+        textual_inversions, model, status=status, model_id=normalized_model_id
+    )
 
     # Better to use new lora_weights in next section
     attn_procs = call_inputs.get("attn_procs", None)
@@ -398,56 +774,57 @@ async def inference(all_inputs: dict, response) -> dict:
     #         print("Clearing attn procs")
     #         pipeline.unet.set_attn_processor(CrossAttnProcessor())
 
-    # Currently we only support a single string, but we should allow
-    # and array too in anticipation of multi-LoRA support in diffusers
-    # tracked at https://github.com/huggingface/diffusers/issues/2613.
+    # A single string or an array of LoRAs, each with an optional #scale=
     lora_weights = call_inputs.get("lora_weights", None)
     lora_weights_joined = json.dumps(lora_weights)
     if last_lora_weights != lora_weights_joined:
-        if last_lora_weights != None and last_lora_weights != "[]":
-            print("Unloading previous LoRA weights")
-            pipeline.unload_lora_weights()
-
         last_lora_weights = lora_weights_joined
-        cross_attention_kwargs = {}
 
         if type(lora_weights) is not list:
             lora_weights = [lora_weights] if lora_weights else []
 
-        if len(lora_weights) > 0:
-            for weights in lora_weights:
-                storage = Storage(weights, no_raise=True, status=status)
-                if storage:
-                    storage_query_fname = storage.query.get("fname")
-                    storage_query_scale = (
-                        float(storage.query.get("scale")[0])
-                        if storage.query.get("scale")
-                        else 1
-                    )
-                    cross_attention_kwargs.update({"scale": storage_query_scale})
-                    # https://github.com/damian0815/compel/issues/42#issuecomment-1656989385
-                    pipeline._lora_scale = storage_query_scale
-                    if storage_query_fname:
-                        fname = storage_query_fname[0]
-                    else:
-                        hash = sha256(weights.encode("utf-8")).hexdigest()
-                        fname = "url_" + hash[:7] + "--" + storage.url.split("/").pop()
-                    cache_fname = "lora_weights--" + fname
-                    path = os.path.join(MODELS_DIR, cache_fname)
-                    if not os.path.exists(path):
-                        await asyncio.to_thread(storage.download_file, path)
-                    print("Load lora_weights `" + weights + "` from `" + path + "`")
-                    pipeline.load_lora_weights(
-                        MODELS_DIR, weight_name=cache_fname, local_files_only=True
-                    )
-                else:
-                    print("Loading from huggingface not supported yet: " + weights)
-                    # maybe something like sayakpaul/civitai-light-shadow-lora#lora=l_a_s.s9s?
-                    # lora_model_id = "sayakpaul/civitai-light-shadow-lora"
-                    # lora_filename = "light_and_shadow.safetensors"
-                    # pipeline.load_lora_weights(lora_model_id, weight_name=lora_filename)
+        loras = []
+        for weights in lora_weights:
+            storage = Storage(weights, no_raise=True, status=status)
+            if storage:
+                storage_query_scale = (
+                    float(storage.query.get("scale")[0])
+                    if storage.query.get("scale")
+                    else 1
+                )
+                path = lora_weights_path(storage, weights)
+                await artifact_cache.fetch_async(storage, path)
+                print("Load lora_weights `" + weights + "` from `" + path + "`")
+                loras.append(
+                    {"url": storage.url, "path": path, "scale": storage_query_scale}
+                )
+            else:
+                print("Loading from huggingface not supported yet: " + weights)
+                # maybe something like sayakpaul/civitai-light-shadow-lora#lora=l_a_s.s9s?
+                # lora_model_id = "sayakpaul/civitai-light-shadow-lora"
+                # lora_filename = "light_and_shadow.safetensors"
+                # pipeline.load_lora_weights(lora_model_id, weight_name=lora_filename)
+
+        # Resident adapters are just switched on / off, see lib/lora_cache.py
+        cross_attention_kwargs = await asyncio.to_thread(
+            lora_adapters(model).activate, pipeline, loras
+        )
+        result["$meta"].update({"lora_cache": lora_adapters(model).stats()})
     else:
         print("No changes to LoRAs since last call")
+        # Counts towards fusing them into the weights, see LORA_FUSE_AFTER
+        await asyncio.to_thread(lora_adapters(model).reuse, pipeline)
+
+    # Model, pipeline, scheduler and LoRAs are ready, see lib/preload.py
+    if call_inputs.get("warmup", False):
+        if shape_buckets and SHAPE_WARMUP_STEPS:
+            try:
+                await asyncio.to_thread(
+                    warmup, pipeline, shape_buckets, steps=SHAPE_WARMUP_STEPS
+                )
+            except Exception as error:
+                print("Warmup failed, continuing", error)
+        return result | {"warmup": True, "$timings": getTimings()}
 
     # TODO, generalize
     mi_cross_attention_kwargs = model_inputs.get("cross_attention_kwargs", None)
@@ -510,6 +887,9 @@ async def inference(all_inputs: dict, response) -> dict:
 
     # Run patchmatch for inpainting
     if call_inputs.get("FILL_MODE", None) == "patchmatch":
+        import skimage.measure
+        from PyPatchMatch import patch_match
+
         sel_buffer = np.array(model_inputs.get("init_image"))
         img = sel_buffer[:, :, 0:3]
         mask = sel_buffer[:, :, -1]
@@ -520,6 +900,20 @@ async def inference(all_inputs: dict, response) -> dict:
         mask = mask.repeat(8, axis=0).repeat(8, axis=1)
         model_inputs["mask_image"] = PIL.Image.fromarray(mask)
 
+    # Generate at a (warmed up) bucket size, restored to the requested size below
+    requested_size = None
+    if call_inputs.get("shape_bucket", True):
+        requested_size = bucket_inputs(model_inputs, shape_buckets)
+        if requested_size:
+            result["$meta"].update(
+                {
+                    "shape_bucket": {
+                        "width": model_inputs["width"],
+                        "height": model_inputs["height"],
+                    }
+                }
+            )
+
     # Turning on takes 3ms and turning off 1ms... don't worry, I've got your back :)
     # x_m_e_a = call_inputs.get("xformers_memory_efficient_attention", True)
     # last_x_m_e_a = last_xformers_memory_efficient_attention.get(pipeline, None)
@@ -558,6 +952,8 @@ async def inference(all_inputs: dict, response) -> dict:
             if os.path.isdir(model_dir):
                 normalized_model_id = model_dir
 
+        from train_dreambooth import TrainDreamBooth
+
         torch.set_grad_enabled(True)
         result = result | await asyncio.to_thread(
             TrainDreamBooth,
@@ -574,34 +970,61 @@ async def inference(all_inputs: dict, response) -> dict:
 
     # Do this after dreambooth as dreambooth accepts a seed int directly.
     seed = model_inputs.get("seed", None)
-    if seed == None:
-        generator = torch.Generator(device=device)
-        generator.seed()
+    if isinstance(seed, list):
+        # Batched request, one generator per image
+        generator = list(map(createGenerator, seed))
+        del model_inputs["seed"]
+    elif seed == None:
+        generator = createGenerator()
     else:
-        generator = torch.Generator(device=device).manual_seed(seed)
+        generator = createGenerator(seed)
         del model_inputs["seed"]
 
     model_inputs.update({"generator": generator})
 
-    callback = None
-    if model_inputs.get("callback_steps", None):
-
-        def callback(step: int, timestep: int, latents: torch.FloatTensor):
-            asyncio.run(
-                send(
-                    "inference",
-                    "progress",
-                    {"startRequestId": startRequestId, "step": step},
-                    send_opts,
-                )
-            )
+    # Progress events (with callback_steps) are throttled, and streaming
+    # requests can ask for a latent preview every `preview_steps` steps.
+    num_inference_steps = model_inputs.get("num_inference_steps", 50)
+    send_progress = bool(model_inputs.get("callback_steps", None))
+    throttle = ProgressThrottle(PROGRESS_INTERVAL_MS)
+    preview_steps = int(call_inputs.get("preview_steps", 0) or 0) if response else 0
+    preview_size = int(call_inputs.get("preview_size", PREVIEW_SIZE))
+
+    def send_step(step):
+        progress.publish(
+            "inference",
+            "progress",
+            {"startRequestId": startRequestId, "step": step},
+            send_opts,
+        )
 
-    else:
+    def callback(step: int, timestep: int, latents: torch.FloatTensor):
+        cancel.check()
+        status.update("inference", step / num_inference_steps)
+        if send_progress and throttle.ready(step):
+            send_step(step)
+        if preview_steps and step % preview_steps == 0:
+            # Only copy the latents here, they're encoded by the broadcaster
+            snapshot = snapshot_latents(latents)
+
+            def preview():
+                try:
+                    image_base64 = latent_preview(snapshot, is_sdxl, preview_size)
+                except Exception as error:
+                    # e.g. a model whose latents aren't the usual 4 channels
+                    print("Latent preview failed", error)
+                    return None
+                return {
+                    "type": "inference",
+                    "status": "preview",
+                    "payload": {
+                        "startRequestId": startRequestId,
+                        "step": step,
+                        "image_base64": image_base64,
+                    },
+                }
 
-        def callback(step: int, timestep: int, latents: torch.FloatTensor):
-            status.update(
-                "inference", step / model_inputs.get("num_inference_steps", 50)
-            )
+            progress.stream(preview)
 
     is_sdxl = (
         isinstance(model, StableDiffusionXLPipeline)
@@ -618,10 +1041,26 @@ async def inference(all_inputs: dict, response) -> dict:
             },
         )
 
-        if call_inputs.get("compel_prompts", False):
-            prepare_prompts(pipeline, model_inputs, is_sdxl)
+        # Everything besides the prompt text that affects its embeddings
+        prompt_cache_key = (
+            normalized_model_id,
+            json.dumps(textual_inversions),
+            last_lora_weights,
+        )
 
         try:
+            # Text encoders run on a thread too, not to block the event loop
+            if call_inputs.get("compel_prompts", False):
+                await asyncio.to_thread(
+                    prepare_prompts, pipeline, model_inputs, is_sdxl, prompt_cache_key
+                )
+            elif not custom_pipeline_method:
+                await asyncio.to_thread(
+                    encode_prompts, pipeline, model_inputs, is_sdxl, prompt_cache_key
+                )
+            result["$meta"].update({"prompt_cache": prompt_embeds_cache.stats()})
+
+            cancel.check()
             async_pipeline = asyncio.to_thread(
                 getattr(pipeline, custom_pipeline_method)
                 if custom_pipeline_method
@@ -636,7 +1075,20 @@ async def inference(all_inputs: dict, response) -> dict:
             #        images = (await async_pipeline).images
             # else:
             images = (await async_pipeline).images
-
+            # The last step, if it was throttled
+            last_step = throttle.flush()
+            if send_progress and last_step is not None:
+                send_step(last_step)
+            await progress.flush()
+
+        except Cancelled as err:
+            print("Inference cancelled:", str(err))
+            return {
+                "$error": {
+                    "code": "CANCELLED",
+                    "message": f"Request {err}",
+                }
+            }
         except Exception as err:
             return {
                 "$error": {
@@ -647,25 +1099,30 @@ async def inference(all_inputs: dict, response) -> dict:
                 }
             }
 
-    images_base64 = []
-    for image in images:
-        buffered = BytesIO()
-        image.save(buffered, format="PNG")
-        images_base64.append(base64.b64encode(buffered.getvalue()).decode("utf-8"))
+    if requested_size:
+        images = [restore_size(image, *requested_size) for image in images]
+
+    await send("encode", "start", {"startRequestId": startRequestId}, send_opts)
+    images_bytes = await encode_images(images, output_options)
+    await send("encode", "done", {"startRequestId": startRequestId}, send_opts)
+    if result_key:
+        await result_cache.store(result_key, images_bytes, output_options["mimetype"])
 
     await send("inference", "done", {"startRequestId": startRequestId}, send_opts)
 
     # Return the results as a dictionary
-    if len(images_base64) > 1:
-        result = result | {"images_base64": images_base64}
-    else:
-        result = result | {"image_base64": images_base64[0]}
+    result = result | images_result(
+        images_bytes, response_format, output_options["mimetype"]
+    )
 
     # TODO, move and generalize in device.py
     mem_usage = 0
     if torch.cuda.is_available():
         mem_usage = torch.cuda.memory_allocated() / torch.cuda.max_memory_allocated()
 
-    result = result | {"$timings": getTimings(), "$mem_usage": mem_usage}
+    result = result | {
+        "$timings": getTimings() | take_timings(model),
+        "$mem_usage": mem_usage,
+    }
 
     return result
@@ -1,3 +1,5 @@
+import gc
+import itertools
 import torch
 
 if torch.cuda.is_available():
@@ -30,3 +32,60 @@ else:
         )
 
 device = torch.device(device_id)
+
+
+def pipeline_modules(pipeline):
+    components = getattr(pipeline, "components", None) or {}
+    return [c for c in components.values() if isinstance(c, torch.nn.Module)]
+
+
+def model_size(pipeline):
+    """Bytes used by all parameters and buffers of a pipeline's modules."""
+    seen = set()
+    size = 0
+    for module in pipeline_modules(pipeline):
+        for tensor in itertools.chain(module.parameters(), module.buffers()):
+            if id(tensor) not in seen:
+                seen.add(id(tensor))
+                size += tensor.numel() * tensor.element_size()
+    return size
+
+
+def model_to_device(pipeline):
+    pipeline.to(device)
+    return pipeline
+
+
+def free_model(pipeline):
+    """Returns an evicted model's device memory, once it's unreferenced."""
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def model_to_host(pipeline, pin_memory=False):
+    pipeline.to("cpu")
+    # Page-locked memory makes the next host-to-device copy much faster.
+    if pin_memory and torch.cuda.is_available():
+        for module in pipeline_modules(pipeline):
+            for tensor in itertools.chain(module.parameters(), module.buffers()):
+                tensor.data = tensor.data.pin_memory()
+    return pipeline
+
+
+def gpu_stats():
+    """GPU memory (bytes) and utilization (%), without spawning nvidia-smi."""
+    if not torch.cuda.is_available():
+        return {}
+    free, total = torch.cuda.mem_get_info()
+    stats = {
+        "memory_free": free,
+        "memory_total": total,
+        "memory_allocated": torch.cuda.memory_allocated(),
+        "memory_reserved": torch.cuda.memory_reserved(),
+    }
+    try:
+        stats.update({"utilization": torch.cuda.utilization()})
+    except Exception:
+        pass  # needs pynvml
+    return stats
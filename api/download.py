@@ -9,7 +9,6 @@ from utils import Storage
 import subprocess
 from pathlib import Path
 import shutil
-from convert_to_diffusers import main as convert_to_diffusers
 from download_checkpoint import main as download_checkpoint
 from status import status
 import asyncio
@@ -31,6 +30,14 @@ async def send(type: str, status: str, payload: dict = {}, send_opts: dict = {})
         await _send(type, status, payload, send_opts)
 
 
+def convert_to_diffusers(**kwargs):
+    # diffusers' checkpoint conversion (omegaconf etc) is only imported when
+    # there's actually a checkpoint to convert.
+    from convert_to_diffusers import main
+
+    return main(**kwargs)
+
+
 def normalize_model_id(model_id: str, model_revision):
     normalized_model_id = "models--" + model_id.replace("/", "--")
     if model_revision:
@@ -48,7 +55,20 @@ async def download_model(
     model_precision=None,
     send_opts={},
     pipeline_class=None,
+    on_event=None,
 ):
+    """
+    Downloads (and if needed converts, compresses and uploads) a model.
+    Events go to `send_opts`, or to `await on_event(type, status, payload)`
+    if given (e.g. to share them with other requests waiting for it).
+    """
+
+    async def notify(type, status):
+        if on_event:
+            await on_event(type, status, {})
+        else:
+            await send(type, status, {}, send_opts)
+
     print(
         "download_model",
         {
@@ -78,7 +98,9 @@ async def download_model(
         if exists:
             model_dir = os.path.join(MODELS_DIR, normalized_model_id)
             print("model_dir", model_dir)
+            await notify("download", "start")
             await asyncio.to_thread(storage.download_and_extract, model_file, model_dir)
+            await notify("download", "done")
         else:
             if checkpoint_url:
                 path = download_checkpoint(checkpoint_url)
@@ -99,7 +121,7 @@ async def download_model(
                 # This would be quicker to just model.to(device) afterwards, but
                 # this conveniently logs all the timings (and doesn't happen often)
                 print("download")
-                await send("download", "start", {}, send_opts)
+                await notify("download", "start")
                 model = loadModel(
                     hf_model_id,
                     False,
@@ -107,7 +129,7 @@ async def download_model(
                     revision=model_revision,
                     pipeline_class=pipeline_class,
                 )  # download
-                await send("download", "done", {}, send_opts)
+                await notify("download", "done")
 
             print("load")
             model = loadModel(
@@ -122,19 +144,19 @@ async def download_model(
             model.save_pretrained(dir, safe_serialization=True)
 
             # This is all duped from train_dreambooth, need to refactor TODO XXX
-            await send("compress", "start", {}, send_opts)
+            await notify("compress", "start")
             subprocess.run(
                 f"tar cvf - -C {dir} . | zstd -o {model_file}",
                 shell=True,
                 check=True,  # TODO, rather don't raise and return an error in JSON
             )
 
-            await send("compress", "done", {}, send_opts)
+            await notify("compress", "done")
             subprocess.run(["ls", "-l", model_file])
 
-            await send("upload", "start", {}, send_opts)
+            await notify("upload", "start")
             upload_result = storage.upload_file(model_file, filename)
-            await send("upload", "done", {}, send_opts)
+            await notify("upload", "done")
             print(upload_result)
             os.remove(model_file)
 
@@ -1,5 +1,6 @@
 import os
 from utils import Storage
+from lib.artifacts import artifact_cache
 
 CHECKPOINT_URL = os.environ.get("CHECKPOINT_URL", None)
 CHECKPOINT_DIR = "/root/.cache/checkpoints"
@@ -17,8 +18,7 @@ def main(checkpoint_url: str):
         fname = checkpoint_url.split("/").pop()
     path = os.path.join(CHECKPOINT_DIR, fname)
 
-    if not os.path.isfile(path):
-        storage.download_file(path)
+    artifact_cache.fetch(storage, path)
 
     return path
 
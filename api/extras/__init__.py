@@ -1 +1,17 @@
-from .upsample import upsample
+import importlib
+
+# Extras are imported on first use (realesrgan, gfpgan, etc are slow to
+# import and most deployments never call them).
+EXTRAS = ["upsample"]
+
+
+def keys():
+    return EXTRAS
+
+
+def __getattr__(name):
+    if name not in EXTRAS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    extra = getattr(importlib.import_module("." + name, __name__), name)
+    globals()[name] = extra
+    return extra
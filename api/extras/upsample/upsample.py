@@ -18,6 +18,8 @@ from gfpgan import GFPGANer
 
 from .models import models_by_type, upsamplers, face_enhancers
 from status import status
+from lib.artifacts import artifact_cache
+from lib.disk_cache import disk_cache
 from utils import Storage
 from send import send
 
@@ -42,8 +44,9 @@ async def assert_model_exists(src, filename, send_opts, opts={}):
         await send("download", "start", {}, send_opts)
         storage = Storage(src, status=status)
         # await storage.download_file(dest)
-        await asyncio.to_thread(storage.download_file, dest)
+        await artifact_cache.fetch_async(storage, dest)
         await send("download", "done", {}, send_opts)
+    disk_cache.touch(dest)
 
 
 async def download_models(send_opts={}):
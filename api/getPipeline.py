@@ -37,15 +37,17 @@ def availableCommunityPipelines():
     return _availableCommunityPipelines
 
 
-def clearPipelines():
+def clearPipelines(model_id=None):
     """
-    Clears the pipeline cache.  Important to call this when changing the
-    loaded model, as pipelines include references to the model and would
-    therefore prevent memory being reclaimed after unloading the previous
-    model.
+    Clears the pipeline cache, for all models or just `model_id`.  Important
+    to call this when unloading a model, as pipelines include references to
+    the model and would therefore prevent memory being reclaimed.
     """
     global _pipelines
-    _pipelines = {}
+    if model_id:
+        _pipelines.pop(model_id, None)
+    else:
+        _pipelines = {}
 
 
 def getPipelineClass(pipeline_name: str):
@@ -62,10 +64,10 @@ def getPipelineForModel(
     Inits a new pipeline, re-using components from a previously loaded
     model.  The pipeline is cached and future calls with the same
     arguments will return the previously initted instance.  Be sure
-    to call `clearPipelines()` if loading a new model, to allow the
-    previous model to be garbage collected.
+    to call `clearPipelines(model_id)` when unloading a model, to allow
+    it to be garbage collected.
     """
-    pipeline = _pipelines.get(pipeline_name)
+    pipeline = _pipelines.get(model_id, {}).get(pipeline_name)
     if pipeline:
         return pipeline
 
@@ -103,7 +105,7 @@ def getPipelineForModel(
         )
 
     if pipeline:
-        _pipelines.update({pipeline_name: pipeline})
+        _pipelines.setdefault(model_id, {}).update({pipeline_name: pipeline})
         diff = round((time.time() - start) * 1000)
         print(f"Initialized {pipeline_name} for {model_id} in {diff}ms")
         return pipeline
@@ -0,0 +1,260 @@
+import os
+import json
+import shutil
+import hashlib
+import asyncio
+import threading
+from .vars import MODELS_DIR
+from .disk_cache import disk_cache as default_disk_cache
+from .single_flight import single_flight
+
+ARTIFACTS_DIR = os.path.join(MODELS_DIR, "artifacts")
+
+
+class IntegrityError(Exception):
+    pass
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ArtifactCache:
+    """
+    Downloads files (LoRAs, textual inversions, checkpoints, etc) safely:
+
+      * Downloads go to a temporary partial file per URL, resumed on retry
+        (unless the remote file's ETag changed).
+      * Size (and sha256, if given as `#sha256=` in the URL) are verified.
+      * Files are stored once by content hash under `blobs/`, and hard linked
+        (or copied) to the requested path, which is replaced atomically.
+
+    So a file at the requested path is always complete, and the same file
+    referenced by different URLs (or paths) is only downloaded and stored
+    once.
+
+    If a `disk_cache` is given, space is reserved in it before downloading,
+    and blobs no longer linked anywhere are pruned after it evicts.
+    """
+
+    def __init__(self, root=ARTIFACTS_DIR, disk_cache=None):
+        self.root = root
+        self.disk_cache = disk_cache
+        if disk_cache:
+            disk_cache.after_evict.append(self.prune)
+        self.blobs_dir = os.path.join(root, "blobs")
+        self.partial_dir = os.path.join(root, "partial")
+        self.index_path = os.path.join(root, "index.json")
+        self.lock = threading.RLock()
+        self.url_locks = {}
+        self._index = None
+
+    def index(self):
+        with self.lock:
+            if self._index is None:
+                self._index = {"urls": {}, "paths": {}}
+                if os.path.isfile(self.index_path):
+                    try:
+                        with open(self.index_path) as file:
+                            self._index.update(json.load(file))
+                    except ValueError as error:
+                        print("Ignoring corrupt artifact index", error)
+            return self._index
+
+    def save_index(self):
+        with self.lock:
+            os.makedirs(self.root, exist_ok=True)
+            tmp = self.index_path + ".tmp"
+            with open(tmp, "w") as file:
+                json.dump(self.index(), file)
+            os.replace(tmp, self.index_path)
+
+    def blob_path(self, sha256):
+        return os.path.join(self.blobs_dir, sha256)
+
+    def lookup(self, path, info=None):
+        """
+        Returns the index entry for `path` if it's present and complete,
+        otherwise None.  Files from before we kept an index are only adopted
+        if they match the size in `info` (from `storage.get_info()`).
+        """
+        with self.lock:
+            entry = self.index()["paths"].get(path, None)
+            if not os.path.isfile(path):
+                return None
+            size = os.path.getsize(path)
+            if entry is None:
+                if not info or not info.get("size", 0) or size != info["size"]:
+                    print(f"Can't verify existing {path}, downloading again")
+                    return None
+                entry = {"size": size, "etag": info.get("etag", None), "adopted": True}
+                self.index()["paths"].update({path: entry})
+                self.save_index()
+                return entry
+            if size != entry["size"]:
+                print(f"Size mismatch for {path}, downloading again")
+                return None
+            return entry
+
+    def url_lock(self, url):
+        with self.lock:
+            return self.url_locks.setdefault(url, threading.Lock())
+
+    def fetch(self, storage, path, sha256=None):
+        """
+        Ensures `path` holds the complete, verified file from `storage`,
+        downloading it only if needed.  Returns `path`.
+        """
+        if self.lookup(path):
+            if self.disk_cache:
+                self.disk_cache.touch(path)
+            return path
+
+        # One download per URL at a time, since they share a partial file.
+        with self.url_lock(storage.url):
+            return self._fetch(storage, path, sha256)
+
+    def _fetch(self, storage, path, sha256):
+        info = storage.get_info()
+        if self.lookup(path, info):
+            if self.disk_cache:
+                self.disk_cache.touch(path)
+            return path
+
+        if not sha256:
+            sha256 = (storage.query.get("sha256", None) or [None])[0]
+        if not sha256:
+            # Fetched this URL before (to another path), and it's unchanged
+            known = self.index()["urls"].get(storage.url, None)
+            if known and known.get("etag", None) == info.get("etag", None):
+                sha256 = known["sha256"]
+
+        if sha256 and os.path.isfile(self.blob_path(sha256)):
+            print(f"Already have {storage.url} by content hash")
+            self._link(self.blob_path(sha256), path)
+            self._record(storage.url, path, sha256, info)
+            return path
+
+        if self.disk_cache:
+            self.disk_cache.ensure_space(info.get("size", 0), keep=path)
+
+        os.makedirs(self.partial_dir, exist_ok=True)
+        url_hash = hashlib.sha256(storage.url.encode("utf-8")).hexdigest()
+        partial = os.path.join(self.partial_dir, url_hash)
+        self._check_partial(partial, info)
+        storage.download_file(partial, resume=True)
+
+        size = os.path.getsize(partial)
+        if info.get("size", 0) and size != info["size"]:
+            self._remove_partial(partial)
+            raise IntegrityError(
+                f"Downloaded {size} bytes from {storage.url}, "
+                f"expected {info['size']}"
+            )
+
+        digest = sha256_file(partial)
+        if sha256 and digest != sha256.lower():
+            self._remove_partial(partial)
+            raise IntegrityError(
+                f"sha256 mismatch for {storage.url}, got {digest}, expected {sha256}"
+            )
+
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        blob = self.blob_path(digest)
+        if os.path.isfile(blob):
+            print(f"Content of {storage.url} already stored, deduplicating")
+            self._remove_partial(partial)
+        else:
+            os.replace(partial, blob)
+            self._remove_partial(partial)
+
+        self._link(blob, path)
+        self._record(storage.url, path, digest, info)
+        return path
+
+    def _check_partial(self, partial, info):
+        """
+        Only resume a partial download of the same version of the file:
+        discards it if the ETag (or size) changed since it was started.
+        """
+        meta_path = partial + ".json"
+        meta = {"etag": info.get("etag", None), "size": info.get("size", 0)}
+        if os.path.isfile(partial):
+            try:
+                with open(meta_path) as file:
+                    previous = json.load(file)
+            except (OSError, ValueError):
+                previous = None
+            if previous != meta:
+                print("Remote file changed, not resuming partial download")
+                os.remove(partial)
+        with open(meta_path, "w") as file:
+            json.dump(meta, file)
+
+    def _remove_partial(self, partial):
+        for name in [partial, partial + ".json"]:
+            if os.path.exists(name):
+                os.remove(name)
+
+    async def fetch_async(self, storage, path, sha256=None):
+        """
+        `fetch()` on a thread.  Concurrent calls for the same URL share a
+        single download.
+        """
+        await single_flight.run(
+            "artifact:" + storage.url,
+            lambda: asyncio.to_thread(self.fetch, storage, path, sha256),
+        )
+        if not self.lookup(path):
+            # Joined a download of the same URL to another path
+            await asyncio.to_thread(self.fetch, storage, path, sha256)
+        return path
+
+    def _link(self, blob, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        try:
+            os.link(blob, tmp)
+        except OSError:
+            # e.g. a different filesystem
+            shutil.copyfile(blob, tmp)
+        os.replace(tmp, path)
+
+    def prune(self):
+        """
+        Removes blobs that are no longer linked from anywhere else, and
+        index entries for paths that no longer exist.
+        """
+        with self.lock:
+            paths = self.index()["paths"]
+            for path in [path for path in paths if not os.path.isfile(path)]:
+                del paths[path]
+            if os.path.isdir(self.blobs_dir):
+                for sha256 in os.listdir(self.blobs_dir):
+                    blob = self.blob_path(sha256)
+                    if os.stat(blob).st_nlink == 1:
+                        print(f"Pruning unused artifact {sha256}")
+                        os.remove(blob)
+            self.save_index()
+
+    def _record(self, url, path, sha256, info):
+        if self.disk_cache:
+            self.disk_cache.touch(path)
+        with self.lock:
+            entry = {
+                "sha256": sha256,
+                "size": os.path.getsize(path),
+                "etag": info.get("etag", None),
+            }
+            self.index()["urls"].update({url: entry})
+            self.index()["paths"].update({path: entry})
+            self.save_index()
+
+
+artifact_cache = ArtifactCache(disk_cache=default_disk_cache)
@@ -0,0 +1,155 @@
+import os
+import json
+import asyncio
+import hashlib
+import tempfile
+import unittest
+from .artifacts import ArtifactCache, IntegrityError
+
+DATA = b"lora weights" * 100
+
+
+class FakeStorage:
+    def __init__(self, url, data=DATA, query={}, etag='"etag"'):
+        self.url = url
+        self.data = data
+        self.query = query
+        self.etag = etag
+        self.downloads = 0
+        self.resumed_from = None
+
+    def get_info(self):
+        return {"size": len(DATA), "etag": self.etag}
+
+    def download_file(self, dest, resume=False):
+        self.downloads += 1
+        self.resumed_from = os.path.getsize(dest) if os.path.exists(dest) else 0
+        with open(dest, "wb") as file:
+            file.write(self.data)
+
+
+class ArtifactCacheTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.cache = ArtifactCache(os.path.join(self.dir, "artifacts"))
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def read(self, path):
+        with open(path, "rb") as file:
+            return file.read()
+
+    def test_fetch_and_reuse(self):
+        storage = FakeStorage("https://host/a.safetensors")
+        self.cache.fetch(storage, self.path("a"))
+        self.cache.fetch(storage, self.path("a"))
+        self.assertEqual(self.read(self.path("a")), DATA)
+        self.assertEqual(storage.downloads, 1)
+        self.assertFalse(os.listdir(self.cache.partial_dir))
+
+    def test_dedupes_by_content(self):
+        self.cache.fetch(FakeStorage("https://host/a"), self.path("a"))
+        self.cache.fetch(FakeStorage("https://mirror/a"), self.path("b"))
+        self.assertEqual(len(os.listdir(self.cache.blobs_dir)), 1)
+        self.assertEqual(self.read(self.path("b")), DATA)
+
+    def test_known_sha256_skips_download(self):
+        sha256 = hashlib.sha256(DATA).hexdigest()
+        self.cache.fetch(FakeStorage("https://host/a"), self.path("a"))
+        storage = FakeStorage("https://mirror/a", query={"sha256": [sha256]})
+        self.cache.fetch(storage, self.path("b"))
+        self.assertEqual(storage.downloads, 0)
+
+    def test_sha256_mismatch(self):
+        storage = FakeStorage("https://host/a", query={"sha256": ["0" * 64]})
+        with self.assertRaises(IntegrityError):
+            self.cache.fetch(storage, self.path("a"))
+        self.assertFalse(os.path.exists(self.path("a")))
+
+    def test_truncated_download(self):
+        storage = FakeStorage("https://host/a", data=DATA[:10])
+        with self.assertRaises(IntegrityError):
+            self.cache.fetch(storage, self.path("a"))
+        self.assertFalse(os.path.exists(self.path("a")))
+
+    def test_redownloads_corrupt_file(self):
+        storage = FakeStorage("https://host/a")
+        self.cache.fetch(storage, self.path("a"))
+        os.remove(self.path("a"))
+        with open(self.path("a"), "wb") as file:
+            file.write(b"trunc")
+        self.cache.fetch(storage, self.path("a"))
+        self.assertEqual(self.read(self.path("a")), DATA)
+        # Restored from the blob of the (unchanged) URL
+        self.assertEqual(storage.downloads, 1)
+
+    def test_redownloads_changed_url(self):
+        self.cache.fetch(FakeStorage("https://host/a"), self.path("a"))
+        storage = FakeStorage("https://host/a", etag='"new"')
+        self.cache.fetch(storage, self.path("b"))
+        self.assertEqual(storage.downloads, 1)
+
+    def test_same_url_to_other_path(self):
+        self.cache.fetch(FakeStorage("https://host/a"), self.path("a"))
+        storage = FakeStorage("https://host/a")
+        self.cache.fetch(storage, self.path("b"))
+        self.assertEqual(storage.downloads, 0)
+        self.assertEqual(self.read(self.path("b")), DATA)
+
+    def test_adopts_existing_files(self):
+        with open(self.path("a"), "wb") as file:
+            file.write(DATA)
+        storage = FakeStorage("https://host/a")
+        self.cache.fetch(storage, self.path("a"))
+        self.assertEqual(storage.downloads, 0)
+
+    def test_redownloads_unverified_existing_files(self):
+        with open(self.path("a"), "wb") as file:
+            file.write(DATA[:10])
+        storage = FakeStorage("https://host/a")
+        self.cache.fetch(storage, self.path("a"))
+        self.assertEqual(storage.downloads, 1)
+        self.assertEqual(self.read(self.path("a")), DATA)
+
+    def write_partial(self, url, etag):
+        url_hash = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        partial = os.path.join(self.cache.partial_dir, url_hash)
+        os.makedirs(self.cache.partial_dir, exist_ok=True)
+        with open(partial, "wb") as file:
+            file.write(DATA[:10])
+        with open(partial + ".json", "w") as file:
+            json.dump({"etag": etag, "size": len(DATA)}, file)
+
+    def test_resumes_partial_of_same_file(self):
+        self.write_partial("https://host/a", '"etag"')
+        storage = FakeStorage("https://host/a")
+        self.cache.fetch(storage, self.path("a"))
+        self.assertEqual(storage.resumed_from, 10)
+
+    def test_discards_partial_of_changed_file(self):
+        self.write_partial("https://host/a", '"old"')
+        storage = FakeStorage("https://host/a")
+        self.cache.fetch(storage, self.path("a"))
+        self.assertEqual(storage.resumed_from, 0)
+        self.assertEqual(self.read(self.path("a")), DATA)
+
+    def test_fetch_async_same_url_different_paths(self):
+        storage = FakeStorage("https://host/a")
+
+        async def both():
+            await asyncio.gather(
+                self.cache.fetch_async(storage, self.path("a")),
+                self.cache.fetch_async(storage, self.path("b")),
+            )
+
+        asyncio.run(both())
+        self.assertEqual(storage.downloads, 1)
+        self.assertEqual(self.read(self.path("a")), DATA)
+        self.assertEqual(self.read(self.path("b")), DATA)
+
+
+if __name__ == "__main__":
+    unittest.main()
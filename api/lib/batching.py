@@ -0,0 +1,187 @@
+import asyncio
+import json
+
+# Any of these mean we're not dealing with a plain txt2img call.
+UNBATCHABLE_MODEL_INPUTS = [
+    "init_image",
+    "image",
+    "mask_image",
+    "instance_images",
+    "prompt_embeds",
+    "negative_prompt_embeds",
+    "callback_steps",
+]
+UNBATCHABLE_CALL_INPUTS = [
+    "use_extra",
+    "train",
+    "custom_pipeline_method",
+    "compel_prompts",
+    "FILL_MODE",
+    "SEND_URL",
+]
+# Differ per request but don't affect compatibility.
+PER_REQUEST_CALL_INPUTS = ["startRequestId", "SIGN_KEY"]
+PER_REQUEST_MODEL_INPUTS = ["prompt", "negative_prompt", "seed"]
+
+
+def batch_key(model_inputs: dict, call_inputs: dict):
+    """
+    Returns a key that's identical for all requests that can share a single
+    batched pipeline call, i.e. same model, pipeline, scheduler, LoRAs,
+    dimensions, steps, etc, differing only by prompt and seed.  Returns
+    None if the request can't be batched at all.
+    """
+    if call_inputs.get("batch", True) is False:
+        return None
+    if call_inputs.get("streamEvents", 0) != 0:
+        return None
+    for key in UNBATCHABLE_CALL_INPUTS:
+        if call_inputs.get(key, None):
+            return None
+    for key in UNBATCHABLE_MODEL_INPUTS:
+        if key in model_inputs:
+            return None
+    if not isinstance(model_inputs.get("prompt", None), str):
+        return None
+    if model_inputs.get("num_images_per_prompt", 1) != 1:
+        return None
+
+    try:
+        return json.dumps(
+            {
+                "callInputs": {
+                    key: value
+                    for key, value in call_inputs.items()
+                    if key not in PER_REQUEST_CALL_INPUTS
+                },
+                "modelInputs": {
+                    key: value
+                    for key, value in model_inputs.items()
+                    if key not in PER_REQUEST_MODEL_INPUTS
+                },
+            },
+            sort_keys=True,
+        )
+    except TypeError:
+        return None
+
+
+def merge_batch(batch: list):
+    """
+    Merges compatible `all_inputs` into a single request with a list of
+    prompts, negative prompts and seeds (one generator per image).
+    """
+    first = batch[0]
+    model_inputs = first["modelInputs"].copy()
+    model_inputs.update(
+        {
+            "prompt": [inputs["modelInputs"]["prompt"] for inputs in batch],
+            "seed": [inputs["modelInputs"].get("seed", None) for inputs in batch],
+        }
+    )
+    negative_prompts = [
+        inputs["modelInputs"].get("negative_prompt", None) for inputs in batch
+    ]
+    if any(negative_prompts):
+        model_inputs.update(
+            {"negative_prompt": [prompt or "" for prompt in negative_prompts]}
+        )
+    else:
+        model_inputs.pop("negative_prompt", None)
+
+    return {"modelInputs": model_inputs, "callInputs": first["callInputs"].copy()}
+
+
+def split_batch_result(result: dict, size: int):
+    """
+    Splits the result of a merged request back into one result per request.
+    """
+    if "$error" in result:
+        return [result] * size
+
+    images = result.get("images_base64", None) or result.get("$images", None)
+    if not images or len(images) != size:
+        error = {
+            "$error": {
+                "code": "BATCH_ERROR",
+                "message": f"Expected {size} images from batch",
+            }
+        }
+        return [error] * size
+
+    results = []
+    for index, image in enumerate(images):
+        split = {
+            key: value
+            for key, value in result.items()
+            if key not in ["images_base64", "$images", "$meta"]
+        }
+        split.update(
+            {
+                "$meta": {
+                    **result.get("$meta", {}),
+                    "batch": {"size": size, "index": index},
+                },
+            }
+        )
+        if "$images" in result:
+            split.update({"$images": [image]})
+        else:
+            split.update({"image_base64": image})
+        results.append(split)
+    return results
+
+
+class Batcher:
+    """
+    Collects compatible requests (same `key`) for up to `window_ms`, or until
+    `max_size` are waiting, and then passes them all together to
+    `run_batch(items)`, which should return a list of results in the same
+    order.  Each `submit()` resolves to its own result.
+    """
+
+    def __init__(self, run_batch, max_size=1, window_ms=50):
+        self.run_batch = run_batch
+        self.max_size = max_size
+        self.window = window_ms / 1000
+        self.pending = {}
+        self.stats = {"batches": 0, "requests": 0}
+
+    async def submit(self, key, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        pending = self.pending.get(key, None)
+        if not pending:
+            pending = {"items": [], "timer": None}
+            pending["timer"] = loop.call_later(self.window, self.flush, key, pending)
+            self.pending.update({key: pending})
+
+        pending["items"].append((item, future))
+        if len(pending["items"]) >= self.max_size:
+            self.flush(key, pending)
+
+        return await future
+
+    def flush(self, key, pending):
+        if self.pending.get(key, None) is not pending:
+            return
+        del self.pending[key]
+        pending["timer"].cancel()
+        asyncio.ensure_future(self._run(pending["items"]))
+
+    async def _run(self, batch):
+        self.stats["batches"] += 1
+        self.stats["requests"] += len(batch)
+        print(f"[Batcher] Running batch of {len(batch)}")
+        try:
+            results = await self.run_batch([item for item, future in batch])
+        except Exception as err:
+            for item, future in batch:
+                if not future.done():
+                    future.set_exception(err)
+            return
+
+        for (item, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,119 @@
+import asyncio
+import unittest
+from .batching import Batcher, batch_key, merge_batch, split_batch_result
+
+
+def txt2img(prompt="dog", seed=None, **modelInputs):
+    inputs = {
+        "modelInputs": {"prompt": prompt, "width": 512, "height": 512, **modelInputs},
+        "callInputs": {"MODEL_ID": "model", "SCHEDULER": "DDIMScheduler"},
+    }
+    if seed != None:
+        inputs["modelInputs"]["seed"] = seed
+    return inputs
+
+
+def key(inputs):
+    return batch_key(inputs["modelInputs"], inputs["callInputs"])
+
+
+class BatchKeyTest(unittest.TestCase):
+    def test_same_key_for_different_prompts_and_seeds(self):
+        self.assertEqual(key(txt2img("dog", 1)), key(txt2img("cat", 2)))
+
+    def test_different_key_for_different_dimensions(self):
+        self.assertNotEqual(key(txt2img()), key(txt2img(width=768)))
+
+    def test_different_key_for_different_call_inputs(self):
+        inputs = txt2img()
+        inputs["callInputs"]["lora_weights"] = ["https://host/lora.safetensors"]
+        self.assertNotEqual(key(txt2img()), key(inputs))
+
+    def test_unbatchable(self):
+        self.assertIsNone(key(txt2img(image="base64")))
+        self.assertIsNone(key(txt2img(num_images_per_prompt=2)))
+        self.assertIsNone(key(txt2img(prompt=["a", "b"])))
+        inputs = txt2img()
+        inputs["callInputs"]["streamEvents"] = 1
+        self.assertIsNone(key(inputs))
+
+
+class MergeAndSplitTest(unittest.TestCase):
+    def test_merge_batch(self):
+        merged = merge_batch(
+            [txt2img("dog", 1), txt2img("cat", negative_prompt="blurry")]
+        )
+        model_inputs = merged["modelInputs"]
+        self.assertEqual(model_inputs["prompt"], ["dog", "cat"])
+        self.assertEqual(model_inputs["negative_prompt"], ["", "blurry"])
+        self.assertEqual(model_inputs["seed"], [1, None])
+
+    def test_split_batch_result(self):
+        result = {"$meta": {}, "images_base64": ["a", "b"], "$timings": {}}
+        results = split_batch_result(result, 2)
+        self.assertEqual(results[1]["image_base64"], "b")
+        self.assertEqual(results[1]["$meta"]["batch"], {"size": 2, "index": 1})
+        self.assertNotIn("images_base64", results[0])
+
+    def test_split_batch_result_raw_images(self):
+        result = {"$meta": {}, "$images": [b"a", b"b"], "$mimetype": "image/png"}
+        results = split_batch_result(result, 2)
+        self.assertEqual(results[1]["$images"], [b"b"])
+        self.assertEqual(results[1]["$mimetype"], "image/png")
+
+    def test_split_batch_error(self):
+        result = {"$error": {"code": "PIPELINE_ERROR"}}
+        self.assertEqual(split_batch_result(result, 2), [result, result])
+
+
+class BatcherTest(unittest.TestCase):
+    def test_batches_within_window(self):
+        batches = []
+
+        async def run_batch(items):
+            batches.append(items)
+            return [item * 10 for item in items]
+
+        async def main():
+            batcher = Batcher(run_batch, max_size=4, window_ms=10)
+            return await asyncio.gather(
+                batcher.submit("a", 1),
+                batcher.submit("a", 2),
+                batcher.submit("b", 3),
+            )
+
+        self.assertEqual(asyncio.run(main()), [10, 20, 30])
+        self.assertEqual(sorted(batches), [[1, 2], [3]])
+
+    def test_flushes_at_max_size(self):
+        batches = []
+
+        async def run_batch(items):
+            batches.append(items)
+            return items
+
+        async def main():
+            batcher = Batcher(run_batch, max_size=2, window_ms=1000)
+            return await asyncio.wait_for(
+                asyncio.gather(batcher.submit("a", 1), batcher.submit("a", 2)), 0.5
+            )
+
+        self.assertEqual(asyncio.run(main()), [1, 2])
+        self.assertEqual(batches, [[1, 2]])
+
+    def test_exception_propagates_to_all(self):
+        async def run_batch(items):
+            raise RuntimeError("boom")
+
+        async def main():
+            batcher = Batcher(run_batch, max_size=2, window_ms=10)
+            return await asyncio.gather(
+                batcher.submit("a", 1), batcher.submit("a", 2), return_exceptions=True
+            )
+
+        results = asyncio.run(main())
+        self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+
+
+if __name__ == "__main__":
+    unittest.main()
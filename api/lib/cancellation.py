@@ -0,0 +1,98 @@
+import threading
+
+
+class Cancelled(Exception):
+    pass
+
+
+class CancelToken:
+    """
+    Set (from any thread) when a request should stop, e.g. its client went
+    away or `/cancel` was called.  Long running work, like the pipeline's
+    step callback, calls `check()` to abort at the next opportunity.
+    """
+
+    def __init__(self, key=None):
+        self.key = key
+        self.reason = None
+        self.event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def cancel(self, reason="cancelled"):
+        if not self.cancelled:
+            self.reason = reason
+            self.event.set()
+
+    def check(self):
+        if self.cancelled:
+            raise Cancelled(self.reason)
+
+
+def cancelled_result(token):
+    """The result for a request cancelled before it got one."""
+    return {"$error": {"code": "CANCELLED", "message": f"Request {token.reason}"}}
+
+
+class SharedCancelToken(CancelToken):
+    """
+    For a job shared by several requests: only cancelled once all of their
+    tokens are (or when cancelled directly).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.tokens = []
+
+    def add(self, token):
+        self.tokens.append(token)
+
+    @property
+    def cancelled(self):
+        tokens = list(self.tokens)
+        if not self.event.is_set() and tokens and all(t.cancelled for t in tokens):
+            self.reason = tokens[-1].reason
+            self.event.set()
+        return self.event.is_set()
+
+
+class CancelRegistry:
+    """CancelTokens of in progress requests, by startRequestId."""
+
+    def __init__(self):
+        self.tokens = {}
+        self.lock = threading.Lock()
+        self.counters = {"cancelled": 0}
+
+    def register(self, key=None):
+        token = CancelToken(key)
+        if key is not None:
+            with self.lock:
+                self.tokens.setdefault(key, []).append(token)
+        return token
+
+    def unregister(self, token):
+        with self.lock:
+            tokens = self.tokens.get(token.key, [])
+            if token in tokens:
+                tokens.remove(token)
+            if not tokens:
+                self.tokens.pop(token.key, None)
+        if token.cancelled:
+            self.counters["cancelled"] += 1
+
+    def cancel(self, key, reason="cancelled"):
+        """Cancels all requests with startRequestId `key`, returns how many."""
+        with self.lock:
+            tokens = list(self.tokens.get(key, []))
+        for token in tokens:
+            token.cancel(reason)
+        return len(tokens)
+
+    def stats(self):
+        return {"active": sum(map(len, self.tokens.values())), **self.counters}
+
+
+cancel_registry = CancelRegistry()
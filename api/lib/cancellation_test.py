@@ -0,0 +1,37 @@
+import threading
+import unittest
+from .cancellation import CancelRegistry, Cancelled
+
+
+class CancellationTest(unittest.TestCase):
+    def test_cancel_by_key(self):
+        registry = CancelRegistry()
+        token = registry.register("abc")
+        other = registry.register("def")
+        anonymous = registry.register()
+        token.check()
+
+        self.assertEqual(registry.stats()["active"], 2)
+        self.assertEqual(registry.cancel("abc"), 1)
+        self.assertEqual(registry.cancel("nope"), 0)
+        self.assertTrue(token.cancelled)
+        self.assertFalse(other.cancelled)
+        with self.assertRaises(Cancelled):
+            token.check()
+
+        for t in [token, other, anonymous]:
+            registry.unregister(t)
+        self.assertEqual(registry.stats(), {"active": 0, "cancelled": 1})
+
+    def test_first_reason_wins_across_threads(self):
+        token = CancelRegistry().register("abc")
+        thread = threading.Thread(target=lambda: token.cancel("disconnected"))
+        thread.start()
+        thread.join()
+        token.cancel("cancelled")
+        with self.assertRaisesRegex(Cancelled, "disconnected"):
+            token.check()
+
+
+if __name__ == "__main__":
+    unittest.main()
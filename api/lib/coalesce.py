@@ -0,0 +1,109 @@
+import asyncio
+from .cancellation import SharedCancelToken, cancelled_result
+
+
+def coalesce_key(fingerprint, call_inputs, streaming=False):
+    """
+    Requests with the same key can share a run: same fingerprint (see
+    lib/result_cache.py), and the same response format and event routing.
+    Events go to the first request's SEND_URL and carry its startRequestId,
+    so requests that get events (streamed or by webhook) only share a run
+    with ones that would get the very same events, e.g. retries.
+    """
+    events = streaming or call_inputs.get("SEND_URL", None)
+    return (
+        fingerprint,
+        bool(streaming),
+        call_inputs.get("response_format", None),
+        call_inputs.get("SEND_URL", None),
+        call_inputs.get("SIGN_KEY", None),
+        call_inputs.get("startRequestId", None) if events else None,
+    )
+
+
+class Broadcast:
+    """
+    Stands in for a streaming response, writing everything sent to it to
+    every attached response.  Responses that fail (client went away) are
+    detached; once none are left, `on_empty()` is called and further sends
+    do nothing.
+    """
+
+    def __init__(self, on_empty=None):
+        self.responses = []
+        self.on_empty = on_empty
+
+    def add(self, response):
+        self.responses.append(response)
+
+    async def send(self, data):
+        if not self.responses:
+            return
+        for response in list(self.responses):
+            try:
+                await response.send(data)
+            except Exception as error:
+                print("Detaching closed response", error)
+                self.responses.remove(response)
+        if not self.responses and self.on_empty:
+            self.on_empty()
+
+
+class Flight:
+    def __init__(self, streaming):
+        self.cancel = SharedCancelToken()
+        self.broadcast = None
+        if streaming:
+            # Nobody left to stream to, stop through the token
+            self.broadcast = Broadcast(lambda: self.cancel.cancel("disconnected"))
+        self.task = None
+
+
+class Coalescer:
+    """
+    Runs identical (same key) in-flight requests once.  Requests arriving
+    while one is running attach to it: they're streamed its events from
+    then on and get the same result.  The shared job is only cancelled
+    once every attached request is, but each cancelled request gets
+    CANCELLED rather than the result.
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.counters = {"calls": 0, "coalesced": 0}
+
+    async def run(self, key, fn, response=None, cancel=None):
+        """
+        Returns `await fn(response, cancel)`, run once for all concurrent
+        callers with the same `key`, with a Broadcast to all their
+        `response`s (if streaming) and a SharedCancelToken of their `cancel`s.
+        """
+        flight = self.flights.get(key, None)
+        if flight:
+            self.counters["coalesced"] += 1
+            print(f"Attaching to in-flight request {key}")
+        else:
+            self.counters["calls"] += 1
+            flight = Flight(streaming=response is not None)
+            self.flights.update({key: flight})
+
+        if response is not None:
+            flight.broadcast.add(response)
+        if cancel is not None:
+            flight.cancel.add(cancel)
+
+        if not flight.task:
+            flight.task = asyncio.ensure_future(fn(flight.broadcast, flight.cancel))
+            flight.task.add_done_callback(lambda _: self.flights.pop(key, None))
+
+        result = await asyncio.shield(flight.task)
+        if cancel is not None and cancel.cancelled:
+            return cancelled_result(cancel)
+        return result
+
+    def in_flight(self, key):
+        """Whether a request with `key` would attach to a running one."""
+        return key in self.flights
+
+    def stats(self):
+        return {"in_flight": len(self.flights), **self.counters}
@@ -0,0 +1,142 @@
+import asyncio
+import unittest
+from .coalesce import Coalescer, coalesce_key
+from .cancellation import CancelToken
+
+
+class FakeResponse:
+    def __init__(self, closed=False):
+        self.lines = []
+        self.closed = closed
+
+    async def send(self, data):
+        if self.closed:
+            raise ConnectionError("closed")
+        self.lines.append(data)
+
+
+class CoalescerTest(unittest.TestCase):
+    def test_identical_requests_run_once(self):
+        calls = []
+
+        async def main():
+            coalescer = Coalescer()
+            started = asyncio.Event()
+
+            async def run(response, cancel):
+                calls.append(1)
+                started.set()
+                await asyncio.sleep(0.01)
+                await response.send("progress")
+                return {"image_base64": "x"}
+
+            a, b = FakeResponse(), FakeResponse()
+            first = asyncio.ensure_future(coalescer.run("k", run, a, CancelToken()))
+            await started.wait()
+            # Attaches rather than queueing a job, see server.py
+            self.assertTrue(coalescer.in_flight("k"))
+            second = asyncio.ensure_future(coalescer.run("k", run, b, CancelToken()))
+            results = await asyncio.gather(first, second)
+            self.assertFalse(coalescer.in_flight("k"))
+            self.assertEqual(
+                coalescer.stats(), {"in_flight": 0, "calls": 1, "coalesced": 1}
+            )
+            # Later requests run again
+            await coalescer.run("k", run, FakeResponse(), CancelToken())
+            return results, a, b
+
+        results, a, b = asyncio.run(main())
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(results, [{"image_base64": "x"}] * 2)
+        self.assertEqual(a.lines, ["progress"])
+        self.assertEqual(b.lines, ["progress"])
+
+    def test_closed_responses_detached(self):
+        async def main():
+            coalescer = Coalescer()
+
+            async def run(response, cancel):
+                await response.send("one")
+                response.responses[0].closed = True
+                self.assertFalse(cancel.cancelled)
+                await response.send("two")
+                # No error, the run is cancelled instead
+                await response.send("three")
+                self.assertTrue(cancel.cancelled)
+                return "cancelled"
+
+            return await coalescer.run("k", run, FakeResponse(), CancelToken())
+
+        self.assertEqual(asyncio.run(main()), "cancelled")
+
+    def test_cancelled_only_when_all_cancelled(self):
+        async def main():
+            coalescer = Coalescer()
+            proceed = asyncio.Event()
+            shared = []
+
+            async def run(response, cancel):
+                shared.append(cancel)
+                await proceed.wait()
+                return "done"
+
+            a, b = CancelToken(), CancelToken()
+            first = asyncio.ensure_future(coalescer.run("k", run, None, a))
+            await asyncio.sleep(0)
+            second = asyncio.ensure_future(coalescer.run("k", run, None, b))
+            await asyncio.sleep(0)
+            a.cancel("disconnected")
+            self.assertFalse(shared[0].cancelled)
+            b.cancel()
+            self.assertTrue(shared[0].cancelled)
+            self.assertEqual(shared[0].reason, "cancelled")
+            proceed.set()
+            return await asyncio.gather(first, second)
+
+        first, second = asyncio.run(main())
+        self.assertEqual(first["$error"]["message"], "Request disconnected")
+        self.assertEqual(second["$error"]["code"], "CANCELLED")
+
+    def test_cancelled_caller_gets_cancelled(self):
+        async def main():
+            coalescer = Coalescer()
+            proceed = asyncio.Event()
+
+            async def run(response, cancel):
+                await proceed.wait()
+                return {"image_base64": "x"}
+
+            mine, other = CancelToken(), CancelToken()
+            first = asyncio.ensure_future(coalescer.run("k", run, None, other))
+            second = asyncio.ensure_future(coalescer.run("k", run, None, mine))
+            await asyncio.sleep(0)
+            mine.cancel()
+            proceed.set()
+            return await asyncio.gather(first, second)
+
+        first, second = asyncio.run(main())
+        self.assertEqual(first, {"image_base64": "x"})
+        self.assertEqual(second["$error"]["code"], "CANCELLED")
+
+    def test_key_separates_event_routing(self):
+        key = lambda call_inputs, streaming=False: coalesce_key(
+            "fp", call_inputs, streaming
+        )
+        # No events: only the result matters
+        self.assertEqual(key({"startRequestId": "a"}), key({"startRequestId": "b"}))
+        self.assertNotEqual(key({"SEND_URL": "https://a"}), key({}))
+        self.assertNotEqual(
+            key({"SEND_URL": "https://a", "SIGN_KEY": "1"}),
+            key({"SEND_URL": "https://a", "SIGN_KEY": "2"}),
+        )
+        self.assertNotEqual(
+            key({"SEND_URL": "https://a", "startRequestId": "a"}),
+            key({"SEND_URL": "https://a", "startRequestId": "b"}),
+        )
+        self.assertNotEqual(
+            key({"startRequestId": "a"}, True), key({"startRequestId": "b"}, True)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import atexit
+import shutil
+import threading
+from contextlib import contextmanager
+from .vars import MODELS_DIR, DISK_CACHE_BYTES
+
+ACCESS_FILE = ".disk_cache.json"
+
+
+def path_size(path, seen=None):
+    """
+    Bytes used by a file or directory tree.  Hard links are only counted
+    once (per `seen` set of inodes).
+    """
+    seen = set() if seen is None else seen
+    paths = [path]
+    if os.path.isdir(path) and not os.path.islink(path):
+        paths = [
+            os.path.join(dir, file) for dir, _, files in os.walk(path) for file in files
+        ]
+    size = 0
+    for file in paths:
+        try:
+            stat = os.lstat(file)
+        except FileNotFoundError:
+            continue
+        if (stat.st_dev, stat.st_ino) in seen:
+            continue
+        seen.add((stat.st_dev, stat.st_ino))
+        size += stat.st_size
+    return size
+
+
+class DiskCache:
+    """
+    Keeps the total size of everything in `root` (MODELS_DIR, i.e. model
+    dirs, LoRAs, textual inversions, upsamplers) under `budget_bytes`,
+    by deleting the least recently used top level entries when space is
+    needed.  A budget of 0 means unlimited (but stats are still kept).
+
+    Entries are never evicted if they're `reserved` (e.g. the artifact
+    store, which prunes itself via `after_evict`), `pinned()` (downloads
+    in progress), returned by `in_use()` (loaded models), or temporary
+    (`*.partial`, `*.tmp`).
+
+    Last access times are recorded by `touch()` and persisted in `root`
+    (at most every `save_interval` seconds, and on exit), falling back to
+    the file's mtime (atime is often disabled).
+    """
+
+    def __init__(
+        self,
+        root=MODELS_DIR,
+        budget_bytes=0,
+        reserved=(),
+        in_use=None,
+        save_interval=60,
+    ):
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self.reserved = set(reserved)
+        self.in_use = in_use or (lambda: ())
+        self.after_evict = []
+        self.pins = {}
+        self.lock = threading.RLock()
+        self._access = None
+        self.save_interval = save_interval
+        self.saved_at = 0
+        self.dirty = False
+        self.used_bytes = None
+        self.counters = {"evictions": 0, "evicted_bytes": 0}
+
+    def name(self, path):
+        """The top level entry in `root` that `path` belongs to, or None."""
+        relpath = os.path.relpath(os.path.abspath(path), os.path.abspath(self.root))
+        if relpath == "." or relpath.startswith(".."):
+            return None
+        return relpath.split(os.sep)[0]
+
+    def access_times(self):
+        with self.lock:
+            if self._access is None:
+                self._access = {}
+                try:
+                    with open(os.path.join(self.root, ACCESS_FILE)) as file:
+                        self._access = json.load(file)
+                except (FileNotFoundError, ValueError):
+                    pass
+            return self._access
+
+    def touch(self, path):
+        name = self.name(path)
+        if not name:
+            return
+        with self.lock:
+            self.access_times().update({name: time.time()})
+            self.dirty = True
+            if time.time() - self.saved_at >= self.save_interval:
+                self.save()
+
+    def save(self):
+        """Persists access times, if any changed since the last save."""
+        with self.lock:
+            if not self.dirty:
+                return
+            os.makedirs(self.root, exist_ok=True)
+            tmp = os.path.join(self.root, ACCESS_FILE + ".tmp")
+            with open(tmp, "w") as file:
+                json.dump(self.access_times(), file)
+            os.replace(tmp, os.path.join(self.root, ACCESS_FILE))
+            self.saved_at = time.time()
+            self.dirty = False
+
+    def reserve(self, path):
+        """Never evicts `path`'s entry, e.g. a model baked into the image."""
+        name = self.name(path)
+        if name:
+            with self.lock:
+                self.reserved.add(name)
+
+    @contextmanager
+    def pinned(self, path):
+        """Protects `path`'s entry from eviction while in the block."""
+        name = self.name(path)
+        with self.lock:
+            self.pins.update({name: self.pins.get(name, 0) + 1})
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.pins[name] -= 1
+                if not self.pins[name]:
+                    del self.pins[name]
+
+    def entries(self):
+        """All top level entries, least recently used first."""
+        if not os.path.isdir(self.root):
+            return []
+        access = self.access_times()
+        entries = []
+        seen = set()
+        # Reserved entries last, so files hard linked from them (i.e. artifact
+        # blobs) count towards the entry that would free them when evicted.
+        names = sorted(os.listdir(self.root), key=lambda name: name in self.reserved)
+        for name in names:
+            if name.startswith(ACCESS_FILE):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                mtime = os.lstat(path).st_mtime
+            except FileNotFoundError:
+                continue
+            entries.append(
+                {
+                    "name": name,
+                    "path": path,
+                    "size": path_size(path, seen),
+                    "last_access": access.get(name, mtime),
+                }
+            )
+        return sorted(entries, key=lambda entry: entry["last_access"])
+
+    def evictable(self, name):
+        return not (
+            name in self.reserved
+            or name in self.pins
+            or name in self.in_use()
+            or name.endswith(".partial")
+            or name.endswith(".tmp")
+        )
+
+    def ensure_space(self, incoming_bytes=0, keep=None):
+        """
+        Evicts least recently used entries until `incoming_bytes` more
+        fit in the budget, never evicting the entry `keep` (the path being
+        downloaded to).  Returns the list of evicted names.
+        """
+        with self.lock:
+            keep_name = self.name(keep) if keep else None
+            entries = self.entries()
+            used = sum(entry["size"] for entry in entries)
+            if not self.budget_bytes:
+                self.used_bytes = used
+                return []
+
+            evicted = []
+            evicted_bytes = 0
+            for entry in entries:
+                if used + incoming_bytes <= self.budget_bytes:
+                    break
+                if entry["name"] == keep_name or not self.evictable(entry["name"]):
+                    continue
+                print(f"Disk cache: evicting {entry['name']} ({entry['size']} bytes)")
+                if os.path.isdir(entry["path"]) and not os.path.islink(entry["path"]):
+                    shutil.rmtree(entry["path"], ignore_errors=True)
+                else:
+                    os.remove(entry["path"])
+                self.access_times().pop(entry["name"], None)
+                self.dirty = True
+                used -= entry["size"]
+                evicted_bytes += entry["size"]
+                evicted.append(entry["name"])
+
+            # Published once per pass, for stats() to read without the lock
+            self.used_bytes = used
+            self.counters = {
+                "evictions": self.counters["evictions"] + len(evicted),
+                "evicted_bytes": self.counters["evicted_bytes"] + evicted_bytes,
+            }
+            if evicted:
+                self.save()
+                for after_evict in self.after_evict:
+                    after_evict()
+            if used + incoming_bytes > self.budget_bytes:
+                print(
+                    f"Disk cache: can't free enough space for {incoming_bytes} bytes, "
+                    "everything else is in use"
+                )
+            return evicted
+
+    def measure(self):
+        """
+        Computes `used_bytes` if it isn't known yet.  Walks all of `root`,
+        so call it off the event loop (e.g. from `Health.run()`).
+        """
+        if self.used_bytes is None:
+            used = sum(entry["size"] for entry in self.entries())
+            with self.lock:
+                if self.used_bytes is None:
+                    self.used_bytes = used
+
+    def stats(self):
+        """
+        The last known usage, without taking the lock (which `ensure_space()`
+        holds while deleting), so it's safe to call from the event loop.
+        `used_bytes` is None until `measure()` or `ensure_space()` ran.
+        """
+        return {
+            "budget_bytes": self.budget_bytes,
+            "used_bytes": self.used_bytes,
+            **self.counters,
+        }
+
+
+disk_cache = DiskCache(MODELS_DIR, DISK_CACHE_BYTES, reserved=("artifacts",))
+atexit.register(disk_cache.save)
@@ -0,0 +1,114 @@
+import os
+import concurrent.futures
+import json
+import time
+import tempfile
+import unittest
+from .disk_cache import DiskCache
+
+
+class DiskCacheTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+
+    def create(self, name, size, age=0):
+        path = os.path.join(self.root, name)
+        with open(path, "wb") as file:
+            file.write(b"\0" * size)
+        mtime = time.time() - 1000 + age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_unlimited(self):
+        self.create("a", 100)
+        cache = DiskCache(self.root, 0)
+        self.assertIsNone(cache.stats()["used_bytes"])
+        cache.measure()
+        self.assertEqual(cache.stats()["used_bytes"], 100)
+        self.assertEqual(cache.ensure_space(1000), [])
+        self.assertEqual(cache.stats()["used_bytes"], 100)
+
+    def test_evicts_least_recently_used(self):
+        a = self.create("a", 100, age=1)
+        self.create("b", 100, age=2)
+        self.create("c", 100, age=3)
+        cache = DiskCache(self.root, 250)
+        cache.touch(a)
+        self.assertEqual(cache.ensure_space(100), ["b", "c"])
+        self.assertTrue(os.path.exists(a))
+        self.assertEqual(cache.stats()["used_bytes"], 100)
+        self.assertEqual(cache.stats()["evictions"], 2)
+
+    def test_access_times_persist(self):
+        a = self.create("a", 100, age=1)
+        self.create("b", 100, age=2)
+        DiskCache(self.root, 150).touch(a)
+        self.assertEqual(DiskCache(self.root, 150).ensure_space(), ["b"])
+
+    def test_batches_access_time_writes(self):
+        a = self.create("a", 100)
+        b = self.create("b", 100)
+        cache = DiskCache(self.root, 0)
+
+        def saved():
+            with open(os.path.join(self.root, ".disk_cache.json")) as file:
+                return json.load(file).keys()
+
+        cache.touch(a)
+        cache.touch(b)
+        self.assertEqual(list(saved()), ["a"])
+        cache.save()
+        self.assertEqual(sorted(saved()), ["a", "b"])
+
+    def test_skips_reserved_pinned_and_in_use(self):
+        self.create("artifacts", 100, age=1)
+        self.create("models--loaded", 100, age=2)
+        pinned = self.create("lora_weights--pinned", 100, age=3)
+        self.create("model.partial", 100, age=4)
+        self.create("lora_weights--old", 100, age=5)
+        cache = DiskCache(
+            self.root, 100, reserved=["artifacts"], in_use=lambda: ["models--loaded"]
+        )
+        with cache.pinned(pinned):
+            self.assertEqual(cache.ensure_space(), ["lora_weights--old"])
+        self.assertEqual(cache.ensure_space(), ["lora_weights--pinned"])
+
+    def test_stats_dont_wait_for_evictions(self):
+        self.create("a", 100)
+        cache = DiskCache(self.root, 50)
+        cache.measure()
+        with cache.lock:
+            # e.g. ensure_space() deleting a big model dir on another thread
+            stats = concurrent.futures.ThreadPoolExecutor(1).submit(cache.stats)
+            self.assertEqual(stats.result(timeout=1)["used_bytes"], 100)
+
+    def test_reserved_baked_model(self):
+        # RUNTIME_DOWNLOADS=0: the model from the image is never in the model
+        # cache, or touched, so it'd otherwise be the first to go.
+        baked = self.create("models--baked", 1000, age=0)
+        self.create("lora_weights--a", 100, age=500)
+        cache = DiskCache(self.root, 1500, in_use=lambda: {}.keys())
+        cache.reserve(baked)
+        self.assertEqual(cache.ensure_space(800), ["lora_weights--a"])
+        self.assertTrue(os.path.exists(baked))
+
+    def test_keep(self):
+        self.create("a", 100, age=1)
+        self.create("b", 100, age=2)
+        cache = DiskCache(self.root, 100)
+        self.assertEqual(cache.ensure_space(keep=os.path.join(self.root, "a")), ["b"])
+
+    def test_hard_links_counted_once(self):
+        blobs = os.path.join(self.root, "artifacts")
+        os.makedirs(blobs)
+        blob = self.create(os.path.join("artifacts", "blob"), 100)
+        os.link(blob, os.path.join(self.root, "lora"))
+        cache = DiskCache(self.root, 1000, reserved=["artifacts"])
+        entries = {entry["name"]: entry["size"] for entry in cache.entries()}
+        self.assertEqual(entries, {"lora": 100, "artifacts": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,177 @@
+import time
+import threading
+import traceback
+from collections import deque
+
+
+class EventSink:
+    """
+    Delivers webhook events (`put(url, event)`) in the background, so
+    callers never wait on the network.  Events are grouped per URL: every
+    `flush_ms`, up to `batch_max` pending events per URL are posted
+    together (a single event as is, more as a JSON array), over pooled
+    keep-alive connections.  Failed posts are retried `retries` times
+    with exponential backoff.  Each URL has its own sender thread (ended
+    after `idle_s` without events), so a slow or failing URL only holds
+    up its own events.
+
+    At most `max_pending` events are queued.  Beyond that, a "progress"
+    event replaces the pending progress event of the same type for that
+    URL (only the latest step matters), or the oldest progress event is
+    dropped to make room, or, failing that, the oldest event.
+    """
+
+    def __init__(
+        self,
+        post=None,
+        batch_max=1,
+        flush_ms=50,
+        max_pending=1000,
+        retries=3,
+        backoff=0.5,
+        idle_s=60,
+    ):
+        self.post = post or self._post
+        self.batch_max = max(batch_max, 1)
+        self.flush_ms = flush_ms
+        self.max_pending = max_pending
+        self.retries = retries
+        self.backoff = backoff
+        self.idle_s = idle_s
+        self.queues = {}
+        self.pending = 0
+        self.posting = 0
+        self.condition = threading.Condition()
+        self.threads = {}
+        self.local = threading.local()
+        self.lag = []
+        self.counters = {
+            "sent": 0,
+            "failed": 0,
+            "retries": 0,
+            "coalesced": 0,
+            "dropped": 0,
+        }
+
+    def put(self, url, event):
+        with self.condition:
+            queue = self.queues.setdefault(url, deque())
+            if (
+                self.max_pending
+                and self.pending >= self.max_pending
+                and not self._make_room(queue, event)
+            ):
+                return
+            queue.append((time.monotonic(), event))
+            self.pending += 1
+            if url not in self.threads:
+                thread = threading.Thread(target=self._run, args=(url,), daemon=True)
+                self.threads.update({url: thread})
+                thread.start()
+            self.condition.notify_all()
+
+    def _make_room(self, queue, event):
+        """Called with the lock held.  False if `event` is to be dropped."""
+        if event.get("status") == "progress":
+            for i, (queued, pending) in enumerate(queue):
+                if pending.get("status") == "progress" and (
+                    pending.get("type") == event.get("type")
+                ):
+                    queue[i] = (queued, event)
+                    self.counters["coalesced"] += 1
+                    return False
+
+        for other in self.queues.values():
+            for item in other:
+                if item[1].get("status") == "progress":
+                    other.remove(item)
+                    self.pending -= 1
+                    self.counters["dropped"] += 1
+                    return True
+
+        if event.get("status") == "progress":
+            self.counters["dropped"] += 1
+            return False
+        oldest = min(
+            (other for other in self.queues.values() if other),
+            key=lambda other: other[0][0],
+        )
+        oldest.popleft()
+        self.pending -= 1
+        self.counters["dropped"] += 1
+        return True
+
+    def _take(self, url):
+        """Called with the lock held.  Up to `batch_max` events for `url`."""
+        queue = self.queues[url]
+        count = min(len(queue), self.batch_max)
+        self.pending -= count
+        self.posting += count
+        return [queue.popleft() for i in range(count)]
+
+    def _run(self, url):
+        while True:
+            with self.condition:
+                if not self.condition.wait_for(lambda: self.queues[url], self.idle_s):
+                    # put() starts a new thread for the next event
+                    self.queues.pop(url)
+                    self.threads.pop(url)
+                    return
+            time.sleep(self.flush_ms / 1000)
+            with self.condition:
+                batch = self._take(url)
+                self.condition.notify_all()
+            if batch:
+                self._deliver(url, batch)
+            with self.condition:
+                self.posting -= len(batch)
+                self.condition.notify_all()
+
+    def _deliver(self, url, batch):
+        events = [event for queued, event in batch]
+        body = events[0] if len(events) == 1 else events
+        for attempt in range(self.retries + 1):
+            try:
+                self.post(url, body)
+                now = time.monotonic()
+                with self.condition:
+                    self.counters["sent"] += len(events)
+                    self.lag = (self.lag + [now - queued for queued, event in batch])[
+                        -100:
+                    ]
+                return
+            except Exception as error:
+                if attempt == self.retries:
+                    print("Failed to send events to " + url, error)
+                    with self.condition:
+                        self.counters["failed"] += len(events)
+                    return
+                with self.condition:
+                    self.counters["retries"] += 1
+                time.sleep(self.backoff * 2**attempt)
+
+    def _post(self, url, body):
+        # Sessions aren't thread-safe, each sender thread has its own
+        session = getattr(self.local, "session", None)
+        if not session:
+            import requests
+
+            session = self.local.session = requests.Session()
+        response = session.post(url, json=body, timeout=10)
+        response.raise_for_status()
+
+    def flush(self, timeout=None):
+        """Waits until all events put so far were delivered (or failed)."""
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: not self.pending and not self.posting, timeout
+            )
+
+    def stats(self):
+        lag = sorted(self.lag)
+        return {
+            **self.counters,
+            "pending": self.pending,
+            "lag_ms": round(lag[len(lag) // 2] * 1000) if lag else 0,
+            "max_lag_ms": round(lag[-1] * 1000) if lag else 0,
+        }
@@ -0,0 +1,119 @@
+import threading
+import unittest
+from .event_sink import EventSink
+
+
+def event(type, status="start", step=None):
+    return {"type": type, "status": status, "payload": {"step": step}}
+
+
+class EventSinkTest(unittest.TestCase):
+    def test_batches_per_url(self):
+        posts = []
+        sink = EventSink(post=lambda url, body: posts.append((url, body)), batch_max=10)
+        sink.put("a", event("init"))
+        sink.put("b", event("inference"))
+        sink.put("a", event("init", "done"))
+        self.assertTrue(sink.flush(timeout=5))
+        self.assertEqual(
+            sorted(posts, key=lambda post: post[0]),
+            [
+                ("a", [event("init"), event("init", "done")]),
+                ("b", event("inference")),
+            ],
+        )
+        self.assertEqual(sink.stats()["sent"], 3)
+
+    def test_single_events_posted_as_is(self):
+        posts = []
+        sink = EventSink(post=lambda url, body: posts.append(body), flush_ms=0)
+        sink.put("a", event("init"))
+        sink.put("a", event("init", "done"))
+        self.assertTrue(sink.flush(timeout=5))
+        self.assertEqual(posts, [event("init"), event("init", "done")])
+
+    def test_retries_with_backoff(self):
+        attempts = []
+
+        def post(url, body):
+            attempts.append(body)
+            if len(attempts) < 3:
+                raise ConnectionError("down")
+
+        sink = EventSink(post=post, flush_ms=0, retries=2, backoff=0.001)
+        sink.put("a", event("init"))
+        self.assertTrue(sink.flush(timeout=5))
+        self.assertEqual(len(attempts), 3)
+        self.assertEqual(sink.stats()["retries"], 2)
+        self.assertEqual(sink.stats()["sent"], 1)
+
+        sink.retries = 0
+        attempts.clear()
+        sink.put("a", event("init"))
+        self.assertTrue(sink.flush(timeout=5))
+        self.assertEqual(len(attempts), 1)
+        self.assertEqual(sink.stats()["failed"], 1)
+
+    def test_slow_url_doesnt_hold_up_others(self):
+        blocked = threading.Event()
+        posts = []
+
+        def post(url, body):
+            if url == "slow":
+                blocked.wait()
+            posts.append(url)
+
+        sink = EventSink(post=post, flush_ms=0)
+        sink.put("slow", event("init"))
+        sink.put("fast", event("init"))
+        sink.put("fast", event("init", "done"))
+        with sink.condition:
+            self.assertTrue(
+                sink.condition.wait_for(lambda: sink.stats()["sent"] == 2, 5)
+            )
+        self.assertEqual(posts, ["fast", "fast"])
+        blocked.set()
+        self.assertTrue(sink.flush(timeout=5))
+        self.assertEqual(posts, ["fast", "fast", "slow"])
+
+    def test_idle_threads_end(self):
+        posts = []
+        sink = EventSink(post=lambda url, body: posts.append(url), flush_ms=0)
+        sink.idle_s = 0.01
+        sink.put("a", event("init"))
+        thread = sink.threads["a"]
+        thread.join(timeout=5)
+        self.assertEqual(sink.threads, {})
+        sink.put("a", event("init", "done"))
+        self.assertTrue(sink.flush(timeout=5))
+        self.assertEqual(posts, ["a", "a"])
+
+    def test_progress_coalesced_under_pressure(self):
+        blocked = threading.Event()
+        posts = []
+
+        def post(url, body):
+            blocked.wait()
+            posts.append(body)
+
+        sink = EventSink(post=post, flush_ms=0, max_pending=2)
+        sink.put("a", event("init"))  # being posted
+        with sink.condition:
+            sink.condition.wait_for(lambda: sink.posting, timeout=5)
+        sink.put("a", event("inference"))
+        sink.put("a", event("inference", "progress", 1))
+        sink.put("a", event("inference", "progress", 2))
+        sink.put("a", event("inference", "progress", 3))
+        self.assertEqual(sink.stats()["coalesced"], 2)
+        sink.put("a", event("inference", "done"))
+        self.assertEqual(sink.stats()["dropped"], 1)
+        blocked.set()
+        self.assertTrue(sink.flush(timeout=5))
+        self.assertEqual(
+            posts,
+            [event("init"), event("inference"), event("inference", "done")],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
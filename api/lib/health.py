@@ -0,0 +1,89 @@
+import time
+import asyncio
+import traceback
+from .vars import HEALTH_INTERVAL
+
+
+class Health:
+    """
+    Answers healthchecks from cached state, so probes never block the
+    event loop.  GPU availability is known once at startup; GPU stats
+    (`gpu_stats()`, which may be slow) are refreshed in the background
+    every `interval` seconds by `run()`.
+
+    Liveness: the server is up and answering.  Readiness: every check
+    added with `add_check(name, fn)` passes, e.g. a model is loaded and
+    the queue isn't full.  Anything added with `add_stats(name, fn)` is
+    included as is (these must be cheap and never block); slow work to
+    keep them up to date goes in `add_refresh(fn)`, ran on a thread by
+    `run()`.
+    """
+
+    def __init__(self, gpu=False, gpu_stats=None, interval=HEALTH_INTERVAL):
+        self.gpu = gpu
+        self.gpu_stats = gpu_stats
+        self.interval = interval
+        self.checks = {}
+        self.stats = {}
+        self.refreshers = []
+        self.cached = {}
+        self.updated = None
+        self.started = time.time()
+
+    def add_check(self, name, check):
+        self.checks.update({name: check})
+
+    def add_stats(self, name, stats):
+        self.stats.update({name: stats})
+
+    def add_refresh(self, refresh):
+        self.refreshers.append(refresh)
+
+    async def refresh(self):
+        for refresh in self.refreshers:
+            try:
+                await asyncio.to_thread(refresh)
+            except Exception:
+                traceback.print_exc()
+        if self.gpu and self.gpu_stats:
+            self.cached = await asyncio.to_thread(self.gpu_stats)
+        self.updated = time.time()
+
+    async def run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                traceback.print_exc()
+            await asyncio.sleep(self.interval)
+
+    def not_ready(self):
+        """Names of the readiness checks that currently fail."""
+        failed = []
+        for name, check in self.checks.items():
+            try:
+                if not check():
+                    failed.append(name)
+            except Exception:
+                failed.append(name)
+        return failed
+
+    def live(self):
+        return {"state": "healthy", "uptime": round(time.time() - self.started)}
+
+    def ready(self):
+        failed = self.not_ready()
+        return {"ready": not failed, "not_ready": failed}
+
+    def report(self):
+        report = {
+            **self.live(),
+            **self.ready(),
+            "gpu": self.gpu,
+            "gpu_stats": self.cached,
+        }
+        if self.updated:
+            report.update({"gpu_stats_age": round(time.time() - self.updated)})
+        for name, stats in self.stats.items():
+            report.update({name: stats()})
+        return report
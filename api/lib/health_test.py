@@ -0,0 +1,55 @@
+import asyncio
+import threading
+import unittest
+from .health import Health
+
+
+class HealthTest(unittest.TestCase):
+    def test_readiness_checks(self):
+        state = {"loaded": False}
+        health = Health()
+        health.add_check("model", lambda: state["loaded"])
+        health.add_check("broken", lambda: 1 / 0)
+        self.assertEqual(
+            health.ready(), {"ready": False, "not_ready": ["model", "broken"]}
+        )
+        state["loaded"] = True
+        health.checks.pop("broken")
+        self.assertEqual(health.ready(), {"ready": True, "not_ready": []})
+        self.assertEqual(health.live()["state"], "healthy")
+
+    def test_gpu_stats_cached(self):
+        calls = []
+
+        def gpu_stats():
+            calls.append(1)
+            return {"memory_free": len(calls)}
+
+        health = Health(gpu=True, gpu_stats=gpu_stats)
+        health.add_stats("queue", lambda: {"depth": 0})
+        self.assertEqual(health.report()["gpu_stats"], {})
+        asyncio.run(health.refresh())
+        for i in range(3):
+            report = health.report()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(report["gpu_stats"], {"memory_free": 1})
+        self.assertEqual(report["queue"], {"depth": 0})
+        self.assertTrue(report["gpu"])
+
+    def test_refresh_off_the_loop(self):
+        threads = []
+        health = Health()
+        health.add_refresh(lambda: 1 / 0)
+        health.add_refresh(lambda: threads.append(threading.get_ident()))
+        asyncio.run(health.refresh())
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], threading.get_ident())
+
+    def test_no_gpu_stats_without_gpu(self):
+        health = Health(gpu=False, gpu_stats=lambda: 1 / 0)
+        asyncio.run(health.refresh())
+        self.assertEqual(health.report()["gpu_stats"], {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from .vars import (
+    OUTPUT_FORMAT,
+    OUTPUT_QUALITY,
+    PNG_COMPRESS_LEVEL,
+    OUTPUT_ENCODER_THREADS,
+)
+
+encoders = {}
+
+
+def register_encoder(name: str, mimetype: str):
+    """
+    Registers an output encoder, a function (image, options) -> bytes,
+    selectable with the `output_format` callInput.
+    """
+
+    def decorator(encode):
+        encoders.update({name: {"encode": encode, "mimetype": mimetype}})
+        return encode
+
+    return decorator
+
+
+@register_encoder("png", "image/png")
+def encode_png(image, options):
+    buffered = BytesIO()
+    image.save(buffered, format="PNG", compress_level=options["compress_level"])
+    return buffered.getvalue()
+
+
+@register_encoder("jpeg", "image/jpeg")
+def encode_jpeg(image, options):
+    if image.mode not in ["RGB", "L"]:
+        image = image.convert("RGB")
+    buffered = BytesIO()
+    image.save(buffered, format="JPEG", quality=options["quality"])
+    return buffered.getvalue()
+
+
+@register_encoder("webp", "image/webp")
+def encode_webp(image, options):
+    buffered = BytesIO()
+    image.save(
+        buffered,
+        format="WEBP",
+        quality=options["quality"],
+        lossless=options.get("lossless", False),
+    )
+    return buffered.getvalue()
+
+
+def _int_option(call_inputs: dict, name: str, default):
+    value = call_inputs.get(name, default)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer, not {value!r}")
+
+
+def get_output_options(call_inputs: dict):
+    """
+    Output encoding options from callInputs `output_format`, `output_quality`
+    `png_compress_level` and `output_lossless`, defaulting to env vars.
+    Raises ValueError on invalid options.
+    """
+    format = call_inputs.get("output_format", None) or OUTPUT_FORMAT
+    if not isinstance(format, str):
+        raise ValueError(f"output_format must be a string, not {format!r}")
+    format = format.lower()
+    if format == "jpg":
+        format = "jpeg"
+    if format not in encoders:
+        raise ValueError(
+            f'Invalid output_format "{format}", available: '
+            + ", ".join(encoders.keys())
+        )
+
+    quality = _int_option(call_inputs, "output_quality", OUTPUT_QUALITY)
+    if quality < 1 or quality > 100:
+        raise ValueError(f"output_quality must be between 1 and 100, not {quality}")
+
+    compress_level = _int_option(call_inputs, "png_compress_level", PNG_COMPRESS_LEVEL)
+    if compress_level < 0 or compress_level > 9:
+        raise ValueError(
+            f"png_compress_level must be between 0 and 9, not {compress_level}"
+        )
+
+    return {
+        "format": format,
+        "mimetype": encoders[format]["mimetype"],
+        "quality": quality,
+        "compress_level": compress_level,
+        "lossless": call_inputs.get("output_lossless", False),
+    }
+
+
+executor = ThreadPoolExecutor(
+    max_workers=OUTPUT_ENCODER_THREADS, thread_name_prefix="encoder"
+)
+
+
+async def encode_images(images: list, options: dict):
+    """
+    Encodes all `images` in parallel on a thread pool, off the event loop
+    (PIL releases the GIL while encoding).  Returns a list of bytes.
+    """
+    encode = encoders[options["format"]]["encode"]
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(
+        *[loop.run_in_executor(executor, encode, image, options) for image in images]
+    )
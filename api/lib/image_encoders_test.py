@@ -0,0 +1,55 @@
+import asyncio
+import unittest
+from PIL import Image
+from .image_encoders import get_output_options, encode_images
+
+
+class GetOutputOptionsTest(unittest.TestCase):
+    def test_defaults(self):
+        options = get_output_options({})
+        self.assertEqual(options["format"], "png")
+        self.assertEqual(options["mimetype"], "image/png")
+
+    def test_jpg_alias(self):
+        options = get_output_options({"output_format": "JPG", "output_quality": 75})
+        self.assertEqual(options["format"], "jpeg")
+        self.assertEqual(options["quality"], 75)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            get_output_options({"output_format": "gif"})
+        with self.assertRaises(ValueError):
+            get_output_options({"output_quality": 0})
+        with self.assertRaises(ValueError):
+            get_output_options({"png_compress_level": 10})
+        for call_inputs in [
+            {"output_quality": None},
+            {"output_quality": "high"},
+            {"png_compress_level": [1]},
+            {"output_format": 5},
+        ]:
+            with self.assertRaises(ValueError):
+                get_output_options(call_inputs)
+
+
+class EncodeImagesTest(unittest.TestCase):
+    def encode(self, call_inputs, count=2):
+        images = [Image.new("RGBA", (16, 16), (255, 0, 0, 255))] * count
+        return asyncio.run(encode_images(images, get_output_options(call_inputs)))
+
+    def test_png(self):
+        encoded = self.encode({"png_compress_level": 1})
+        self.assertEqual(len(encoded), 2)
+        self.assertTrue(encoded[0].startswith(b"\x89PNG"))
+
+    def test_jpeg(self):
+        encoded = self.encode({"output_format": "jpeg"})
+        self.assertTrue(encoded[1].startswith(b"\xff\xd8"))
+
+    def test_webp(self):
+        encoded = self.encode({"output_format": "webp"}, count=1)
+        self.assertEqual(encoded[0][8:12], b"WEBP")
+
+
+if __name__ == "__main__":
+    unittest.main()
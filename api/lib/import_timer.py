@@ -0,0 +1,76 @@
+import builtins
+from contextlib import contextmanager
+import sys
+import time
+
+
+class ImportTimer:
+    """
+    Times the first import of each top level package while installed,
+    like a condensed `python -X importtime`.  Each package is charged its
+    own (exclusive) time; packages it imports are charged separately.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.times = {}
+        self.stack = []
+        self.original = None
+        self.started = None
+        self.elapsed = None
+        self.phases = {}
+
+    def install(self):
+        if self.original:
+            return
+        self.original = builtins.__import__
+        self.started = self.clock()
+        builtins.__import__ = self._import
+
+    def uninstall(self):
+        if not self.original:
+            return
+        builtins.__import__ = self.original
+        self.original = None
+        self.elapsed = self.clock() - self.started
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        root = name.split(".")[0]
+        if level or not root or root in sys.modules:
+            return self.original(name, globals, locals, fromlist, level)
+
+        self.stack.append(0)
+        start = self.clock()
+        try:
+            return self.original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = self.clock() - start
+            children = self.stack.pop()
+            self.times[root] = self.times.get(root, 0) + elapsed - children
+            if self.stack:
+                self.stack[-1] += elapsed
+
+    @contextmanager
+    def phase(self, name):
+        """Times a startup phase (e.g. model loading), reported separately."""
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.clock() - start
+
+    def report(self, top=10):
+        """The `top` slowest packages, {name: ms}, slowest first."""
+        slowest = sorted(self.times.items(), key=lambda item: item[1], reverse=True)
+        return {name: round(seconds * 1000) for name, seconds in slowest[:top]}
+
+    def stats(self):
+        return {
+            "total": round((self.elapsed or 0) * 1000),
+            "imports": round(sum(self.times.values()) * 1000),
+            "slowest": self.report(),
+            **{name: round(seconds * 1000) for name, seconds in self.phases.items()},
+        }
+
+
+import_timer = ImportTimer()
@@ -0,0 +1,56 @@
+import sys
+import unittest
+from .import_timer import ImportTimer
+
+
+class ImportTimerTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.timer = ImportTimer(clock=lambda: self.now)
+        self.imports = {
+            "heavy": lambda: self.fake_import("heavy", 5, ["light"]),
+            "light": lambda: self.fake_import("light", 1),
+        }
+        self.timer.original = lambda name, *args: self.imports.get(name, str)()
+        self.loaded = []
+
+    def tearDown(self):
+        for name in self.loaded:
+            sys.modules.pop(name, None)
+
+    def fake_import(self, name, seconds, children=[]):
+        for child in children:
+            self.timer._import(child)
+        self.now += seconds
+        sys.modules[name] = name
+        self.loaded.append(name)
+        return name
+
+    def test_exclusive_times(self):
+        self.timer._import("heavy")
+        self.assertEqual(self.timer.times, {"heavy": 5, "light": 1})
+        self.assertEqual(self.timer.report(), {"heavy": 5000, "light": 1000})
+        self.assertEqual(self.timer.report(top=1), {"heavy": 5000})
+
+    def test_already_imported_not_timed(self):
+        self.timer._import("light")
+        self.timer._import("light")
+        self.timer._import("light.sub")
+        self.assertEqual(self.timer.times, {"light": 1})
+
+    def test_relative_imports_not_timed(self):
+        self.timer._import("light", None, None, (), 1)
+        self.assertEqual(self.timer.times, {})
+
+    def test_phases_reported_apart(self):
+        self.timer._import("heavy")
+        self.timer.elapsed = self.now
+        with self.timer.phase("init"):
+            self.now += 30
+        stats = self.timer.stats()
+        self.assertEqual(stats["total"], 6000)
+        self.assertEqual(stats["init"], 30000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+import asyncio
+import time
+from collections import deque
+
+
+def get_now():
+    return round(time.time() * 1000)
+
+
+class QueueFull(Exception):
+    pass
+
+
+class QueueTimeout(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, run, group=None, deadline=None, on_update=None):
+        self.run = run
+        self.group = group
+        self.deadline = deadline
+        self.on_update = on_update
+        self.future = asyncio.get_running_loop().create_future()
+        self.queued_at = get_now()
+        self.started_at = None
+
+
+class JobQueue:
+    """
+    An in-process job queue.  Only `concurrency` jobs run at once (by default
+    one, since jobs share global model state), at most `max_depth` jobs may
+    wait (0 for no limit), and jobs that haven't started by their deadline
+    are dropped.
+
+    Jobs with the same (non-None) `group` that are waiting together are
+    started together, up to `group_max` at a time, so that they can be
+    batched further down the line.
+
+    `on_update(position, eta)` is called for waiting jobs whenever their
+    position changes, with eta an estimate in ms based on recent durations.
+    """
+
+    def __init__(self, max_depth=0, concurrency=1, group_max=1):
+        self.max_depth = max_depth
+        self.concurrency = concurrency
+        self.group_max = group_max
+        self.waiting = deque()
+        self.running = 0
+        self.workers = []
+        self.condition = None
+        self.avg_duration = None
+        self.counters = {"completed": 0, "rejected": 0, "timeouts": 0}
+
+    def _start_workers(self):
+        if not self.workers:
+            self.condition = asyncio.Condition()
+            for i in range(self.concurrency):
+                self.workers.append(asyncio.ensure_future(self._worker()))
+
+    def full(self):
+        return self.max_depth > 0 and len(self.waiting) >= self.max_depth
+
+    def eta(self, position=None):
+        """Estimated ms until a job at `position` (default: a new job) starts."""
+        if position is None:
+            position = len(self.waiting) + 1
+        if self.avg_duration is None:
+            return None
+        ahead = position - 1 + self.running
+        return round(ahead * self.avg_duration / self.concurrency)
+
+    async def submit(self, run, group=None, timeout=None, on_update=None):
+        """
+        Queues `run()` (a coroutine function) and returns its result.  Raises
+        QueueFull if there's no room, and QueueTimeout if the job doesn't start
+        within `timeout` seconds.
+        """
+        self._start_workers()
+
+        if self.full():
+            self.counters["rejected"] += 1
+            raise QueueFull(f"Queue is full ({self.max_depth} waiting)")
+
+        deadline = time.monotonic() + timeout if timeout else None
+        job = Job(run, group=group, deadline=deadline, on_update=on_update)
+        self.waiting.append(job)
+        self._notify_positions()
+        async with self.condition:
+            self.condition.notify()
+
+        while True:
+            remaining = deadline - time.monotonic() if deadline else None
+            try:
+                return await asyncio.wait_for(asyncio.shield(job.future), remaining)
+            except asyncio.CancelledError:
+                # e.g. the client went away, don't start it anymore.
+                if job.started_at is None:
+                    self._remove(job)
+                raise
+            except asyncio.TimeoutError:
+                if job.started_at is None:
+                    self._remove(job)
+                    self.counters["timeouts"] += 1
+                    raise QueueTimeout(
+                        f"Job didn't start within {timeout}s (queue timeout)"
+                    )
+                # Already running, deadline only applies to waiting.
+                deadline = None
+
+    def _remove(self, job):
+        try:
+            self.waiting.remove(job)
+        except ValueError:
+            pass
+        self._notify_positions()
+
+    def _notify_positions(self):
+        for index, job in enumerate(self.waiting):
+            if job.on_update:
+                job.on_update(index + 1, self.eta(index + 1))
+
+    def _take(self):
+        job = self.waiting.popleft()
+        jobs = [job]
+        if job.group is not None and self.group_max > 1:
+            for other in list(self.waiting):
+                if len(jobs) >= self.group_max:
+                    break
+                if other.group == job.group:
+                    self.waiting.remove(other)
+                    jobs.append(other)
+        return jobs
+
+    async def _worker(self):
+        while True:
+            async with self.condition:
+                await self.condition.wait_for(lambda: len(self.waiting) > 0)
+                jobs = self._take()
+
+            self._notify_positions()
+            self.running += 1
+            started = time.monotonic()
+            try:
+                await asyncio.gather(*[self._run(job) for job in jobs])
+            finally:
+                self.running -= 1
+                duration = (time.monotonic() - started) * 1000
+                if self.avg_duration is None:
+                    self.avg_duration = duration
+                else:
+                    self.avg_duration = 0.8 * self.avg_duration + 0.2 * duration
+
+    async def _run(self, job):
+        job.started_at = get_now()
+        try:
+            result = await job.run()
+        except Exception as err:
+            if not job.future.done():
+                job.future.set_exception(err)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        self.counters["completed"] += 1
+
+    def stats(self):
+        return {
+            **self.counters,
+            "depth": len(self.waiting),
+            "running": self.running,
+            "max_depth": self.max_depth,
+            "eta": self.eta(),
+        }
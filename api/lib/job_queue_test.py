@@ -0,0 +1,136 @@
+import asyncio
+import unittest
+from .job_queue import JobQueue, QueueFull, QueueTimeout
+
+
+class JobQueueTest(unittest.TestCase):
+    def test_runs_jobs_one_at_a_time_in_order(self):
+        order = []
+
+        async def main():
+            queue = JobQueue()
+
+            def job(name):
+                async def run():
+                    order.append(name + ":start")
+                    await asyncio.sleep(0.01)
+                    order.append(name + ":end")
+                    return name
+
+                return run
+
+            return await asyncio.gather(queue.submit(job("a")), queue.submit(job("b")))
+
+        self.assertEqual(asyncio.run(main()), ["a", "b"])
+        self.assertEqual(order, ["a:start", "a:end", "b:start", "b:end"])
+
+    def test_rejects_when_full(self):
+        async def main():
+            queue = JobQueue(max_depth=1)
+            blocker = asyncio.Event()
+
+            async def run():
+                await blocker.wait()
+
+            first = asyncio.ensure_future(queue.submit(run))
+            await asyncio.sleep(0)  # first is now running
+            second = asyncio.ensure_future(queue.submit(run))
+            await asyncio.sleep(0)  # second is waiting
+            self.assertTrue(queue.full())
+            with self.assertRaises(QueueFull):
+                await queue.submit(run)
+            blocker.set()
+            await asyncio.gather(first, second)
+            return queue.stats()
+
+        stats = asyncio.run(main())
+        self.assertEqual(stats["rejected"], 1)
+        self.assertEqual(stats["completed"], 2)
+
+    def test_timeout_while_waiting(self):
+        async def main():
+            queue = JobQueue()
+
+            async def slow():
+                await asyncio.sleep(0.1)
+
+            first = asyncio.ensure_future(queue.submit(slow))
+            await asyncio.sleep(0)  # first is now running
+            with self.assertRaises(QueueTimeout):
+                await queue.submit(slow, timeout=0.01)
+            await first
+            return queue.stats()
+
+        stats = asyncio.run(main())
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertEqual(stats["depth"], 0)
+
+    def test_cancelled_while_waiting_never_runs(self):
+        ran = []
+
+        async def main():
+            queue = JobQueue()
+
+            async def slow():
+                await asyncio.sleep(0.05)
+
+            async def other():
+                ran.append("other")
+
+            first = asyncio.ensure_future(queue.submit(slow))
+            await asyncio.sleep(0)  # first is now running
+            second = asyncio.ensure_future(queue.submit(other))
+            await asyncio.sleep(0)  # second is waiting
+            second.cancel()
+            await first
+            await asyncio.sleep(0.01)
+            return queue.stats()
+
+        stats = asyncio.run(main())
+        self.assertEqual(ran, [])
+        self.assertEqual(stats["depth"], 0)
+
+    def test_position_updates(self):
+        updates = []
+
+        async def main():
+            queue = JobQueue()
+
+            async def run():
+                await asyncio.sleep(0.01)
+
+            await asyncio.gather(
+                queue.submit(run),
+                queue.submit(run, on_update=lambda pos, eta: updates.append(pos)),
+            )
+
+        asyncio.run(main())
+        self.assertEqual(updates[0], 2)
+        self.assertEqual(updates[-1], 1)
+
+    def test_groups_start_together(self):
+        running = []
+        concurrent = []
+
+        async def main():
+            queue = JobQueue(group_max=2)
+
+            async def run():
+                running.append(1)
+                concurrent.append(len(running))
+                await asyncio.sleep(0.01)
+                running.pop()
+
+            await asyncio.gather(
+                queue.submit(run),
+                queue.submit(run, group="a"),
+                queue.submit(run, group="b"),
+                queue.submit(run, group="a"),
+            )
+
+        asyncio.run(main())
+        self.assertEqual(concurrent, [1, 1, 2, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,270 @@
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+from .vars import LORA_CACHE_BYTES, LORA_MAX_ADAPTERS, LORA_FUSE_AFTER
+
+
+def load_state_dict(path):
+    if path.endswith(".safetensors"):
+        from safetensors.torch import load_file
+
+        return load_file(path, device="cpu")
+
+    import torch
+
+    return torch.load(path, map_location="cpu")
+
+
+def state_dict_size(state_dict):
+    return sum(
+        tensor.numel() * tensor.element_size()
+        for tensor in state_dict.values()
+        if hasattr(tensor, "numel")
+    )
+
+
+class LoraStateDicts:
+    """
+    Parsed LoRA state dicts kept in CPU RAM, so (re)loading an adapter
+    doesn't need to read and parse its file again.  Least recently used
+    entries are dropped when over `budget_bytes` (0 disables caching).
+    """
+
+    def __init__(self, budget_bytes=0, load=load_state_dict, size_of=state_dict_size):
+        self.budget_bytes = budget_bytes
+        self.load = load
+        self.size_of = size_of
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, path):
+        with self.lock:
+            entry = self.entries.get(path, None)
+            if entry:
+                self.entries.move_to_end(path)
+                self.counters["hits"] += 1
+                return entry["state_dict"]
+            self.counters["misses"] += 1
+
+        state_dict = self.load(path)
+        size = self.size_of(state_dict)
+        if size > self.budget_bytes:
+            return state_dict
+
+        with self.lock:
+            self.entries.update({path: {"state_dict": state_dict, "size": size}})
+            while self.used() > self.budget_bytes:
+                self.entries.popitem(last=False)
+                self.counters["evictions"] += 1
+        return state_dict
+
+    def used(self):
+        return sum(entry["size"] for entry in self.entries.values())
+
+
+def adapter_name(url):
+    return "lora_" + hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+
+
+def peft_backend():
+    """
+    Whether diffusers manages LoRAs through PEFT, which named, switchable
+    adapters (`set_adapters()` etc) need.  Needs diffusers >= 0.22 and
+    `peft` installed.
+    """
+    try:
+        from diffusers.utils import USE_PEFT_BACKEND
+    except ImportError:
+        return False
+    return USE_PEFT_BACKEND
+
+
+def lora_base_weights(pipeline):
+    """
+    The weights of the layers PEFT wraps with LoRAs, i.e. those fusing
+    changes, by (component, parameter name).
+    """
+    weights = {}
+    for component in ["unet", "text_encoder", "text_encoder_2"]:
+        module = getattr(pipeline, component, None)
+        if module is None:
+            continue
+        for name, param in module.named_parameters():
+            if ".base_layer." in name:
+                weights.update({(component, name): param})
+    return weights
+
+
+class LoraAdapters:
+    """
+    The LoRA adapters resident in one model (its unet / text encoder, which
+    are shared by all pipelines created from it).  Activating a set of LoRAs
+    only loads those that aren't resident yet, and otherwise just switches
+    which adapters are active and at what scale, via diffusers'
+    `set_adapters()`.  Up to `max_adapters` stay resident, least recently
+    used first out.
+
+    Once the same set has been used for `fuse_after` requests in a row,
+    it's fused into the base weights, so inference no longer pays for the
+    extra low-rank matmuls at every step.  A CPU copy of the affected base
+    weights is kept while fused, and restored as soon as a different set is
+    requested (rather than trusting PEFT's unfuse, which subtracts the delta
+    again and drifts in fp16).  0 disables fusing.
+
+    Without diffusers' PEFT backend (including the diffusers version in our
+    Dockerfile), it falls back to unloading and loading (from the state dict
+    cache) on change.
+    """
+
+    def __init__(
+        self,
+        state_dicts,
+        max_adapters=LORA_MAX_ADAPTERS,
+        fuse_after=LORA_FUSE_AFTER,
+        use_peft=peft_backend,
+    ):
+        self.state_dicts = state_dicts
+        self.use_peft = use_peft
+        self.max_adapters = max_adapters
+        self.fuse_after = fuse_after
+        self.resident = OrderedDict()
+        self.active = []
+        self.active_weights = []
+        self.streak = 0
+        self.fused = False
+        self.pristine = None
+        self.counters = {"loads": 0, "switches": 0, "fuses": 0, "unfuses": 0}
+
+    def activate(self, pipeline, loras):
+        """
+        Makes exactly `loras`, a list of `{"url": str, "path": str, "scale":
+        float}`, active on `pipeline`.  Adapters are keyed by `url` (without
+        its `#scale=`), so changing just the scale doesn't load it again.
+        Returns the cross_attention_kwargs to use.
+        """
+        if not self.multi_adapter(pipeline):
+            return self._activate_legacy(pipeline, loras)
+
+        names = [adapter_name(lora["url"]) for lora in loras]
+        weights = [lora["scale"] for lora in loras]
+        if names == self.active and weights == self.active_weights:
+            return self.reuse(pipeline)
+
+        if self.fused:
+            self._unfuse(pipeline)
+
+        for name, lora in zip(names, loras):
+            if name in self.resident:
+                self.resident.move_to_end(name)
+                continue
+            self._make_room(pipeline, keep=names)
+            print(f"Loading LoRA adapter {name} from {lora['path']}")
+            pipeline.load_lora_weights(
+                dict(self.state_dicts.get(lora["path"])), adapter_name=name
+            )
+            self.resident.update({name: lora["url"]})
+            self.counters["loads"] += 1
+
+        if names:
+            pipeline.enable_lora()
+            pipeline.set_adapters(names, adapter_weights=weights)
+        elif self.active:
+            pipeline.disable_lora()
+        self.active = names
+        self.active_weights = weights
+        self.streak = 1
+        self.counters["switches"] += 1
+        return self._maybe_fuse(pipeline)
+
+    def reuse(self, pipeline):
+        """
+        Call when a request uses the same LoRAs as the last one, to count
+        towards fusing them.  Returns the cross_attention_kwargs to use.
+        """
+        self.streak += 1
+        if not self.multi_adapter(pipeline):
+            return {"scale": self.active_weights[-1]} if self.active_weights else {}
+        return self._maybe_fuse(pipeline)
+
+    def multi_adapter(self, pipeline):
+        return hasattr(pipeline, "set_adapters") and self.use_peft()
+
+    def _maybe_fuse(self, pipeline):
+        if (
+            self.active
+            and not self.fused
+            and self.fuse_after
+            and self.streak >= self.fuse_after
+            and hasattr(pipeline, "fuse_lora")
+        ):
+            print(f"Fusing LoRA adapters {self.active} after {self.streak} uses")
+            self.pristine = {
+                key: param.detach().to("cpu", copy=True)
+                for key, param in lora_base_weights(pipeline).items()
+            }
+            pipeline.fuse_lora(adapter_names=self.active)
+            self.fused = True
+            self.counters["fuses"] += 1
+        return {}
+
+    def _unfuse(self, pipeline):
+        print(f"Unfusing LoRA adapters {self.active}")
+        pipeline.unfuse_lora()
+        # Undo any rounding error from unfusing with the exact originals
+        for key, param in lora_base_weights(pipeline).items():
+            if key in self.pristine:
+                param.data.copy_(self.pristine[key])
+        self.pristine = None
+        self.fused = False
+        self.counters["unfuses"] += 1
+
+    def _make_room(self, pipeline, keep):
+        for name in list(self.resident.keys()):
+            if len(self.resident) < self.max_adapters:
+                break
+            if name in keep:
+                continue
+            print(f"Deleting least recently used LoRA adapter {name}")
+            pipeline.delete_adapters(name)
+            del self.resident[name]
+
+    def _activate_legacy(self, pipeline, loras):
+        if self.active:
+            print("Unloading previous LoRA weights")
+            pipeline.unload_lora_weights()
+        cross_attention_kwargs = {}
+        for lora in loras:
+            pipeline.load_lora_weights(dict(self.state_dicts.get(lora["path"])))
+            # https://github.com/damian0815/compel/issues/42#issuecomment-1656989385
+            pipeline._lora_scale = lora["scale"]
+            cross_attention_kwargs.update({"scale": lora["scale"]})
+            self.counters["loads"] += 1
+        self.active = [lora["url"] for lora in loras]
+        self.active_weights = [lora["scale"] for lora in loras]
+        self.streak = 1
+        self.counters["switches"] += 1
+        return cross_attention_kwargs
+
+    def stats(self):
+        return {
+            "resident": len(self.resident),
+            "active": len(self.active),
+            "fused": self.fused,
+            **self.counters,
+            "state_dicts": self.state_dicts.counters,
+        }
+
+
+lora_state_dicts = LoraStateDicts(LORA_CACHE_BYTES)
+_adapters = weakref.WeakKeyDictionary()
+
+
+def lora_adapters(model):
+    """The `LoraAdapters` for `model`, created on first use."""
+    adapters = _adapters.get(model, None)
+    if adapters is None:
+        adapters = LoraAdapters(lora_state_dicts)
+        _adapters[model] = adapters
+    return adapters
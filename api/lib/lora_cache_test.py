@@ -0,0 +1,189 @@
+import unittest
+from .lora_cache import LoraStateDicts, LoraAdapters, adapter_name
+
+
+class FakeTensor:
+    def __init__(self, value):
+        self.value = value
+
+    @property
+    def data(self):
+        return self
+
+    def detach(self):
+        return self
+
+    def to(self, device, copy=False):
+        return FakeTensor(self.value)
+
+    def copy_(self, other):
+        self.value = other.value
+
+
+class FakeUnet:
+    def __init__(self):
+        self.lora_weight = FakeTensor(1.0)
+        self.other_weight = FakeTensor(2.0)
+
+    def named_parameters(self):
+        yield "attn.to_q.base_layer.weight", self.lora_weight
+        yield "conv.weight", self.other_weight
+
+
+class FakePipeline:
+    def __init__(self):
+        self.unet = FakeUnet()
+        self.loaded = []
+        self.deleted = []
+        self.adapters = None
+        self.enabled = True
+        self.fused = None
+
+    def load_lora_weights(self, state_dict, adapter_name=None):
+        self.loaded.append(adapter_name or state_dict["path"])
+
+    def set_adapters(self, names, adapter_weights=None):
+        self.adapters = dict(zip(names, adapter_weights))
+
+    def delete_adapters(self, name):
+        self.deleted.append(name)
+
+    def enable_lora(self):
+        self.enabled = True
+
+    def disable_lora(self):
+        self.enabled = False
+
+    def fuse_lora(self, adapter_names=None):
+        self.fused = adapter_names
+        self.unet.lora_weight.value += 0.1
+
+    def unfuse_lora(self):
+        self.fused = None
+        # Like fp16, doesn't get back exactly where it started
+        self.unet.lora_weight.value -= 0.1001
+
+
+class LegacyPipeline:
+    def __init__(self):
+        self.loaded = []
+        self.unloads = 0
+
+    def load_lora_weights(self, state_dict):
+        self.loaded.append(state_dict["path"])
+
+    def unload_lora_weights(self):
+        self.unloads += 1
+
+
+def state_dicts(budget=1000):
+    return LoraStateDicts(
+        budget, load=lambda path: {"path": path}, size_of=lambda sd: 100
+    )
+
+
+def lora(url, scale=1):
+    return {"url": url, "path": url, "scale": scale}
+
+
+def peft_adapters(**kwargs):
+    return LoraAdapters(state_dicts(), use_peft=lambda: True, **kwargs)
+
+
+class LoraStateDictsTest(unittest.TestCase):
+    def test_lru_budget(self):
+        cache = state_dicts(budget=200)
+        cache.get("a")
+        cache.get("b")
+        cache.get("a")
+        cache.get("c")
+        self.assertEqual(list(cache.entries.keys()), ["a", "c"])
+        self.assertEqual(cache.counters, {"hits": 1, "misses": 3, "evictions": 1})
+
+
+class LoraAdaptersTest(unittest.TestCase):
+    def test_switching_reuses_resident_adapters(self):
+        pipeline = FakePipeline()
+        adapters = peft_adapters(fuse_after=0)
+        self.assertEqual(adapters.activate(pipeline, [lora("a", 0.5)]), {})
+        adapters.activate(pipeline, [lora("b")])
+        adapters.activate(pipeline, [lora("a"), lora("b", 0.7)])
+        self.assertEqual(pipeline.loaded, [adapter_name("a"), adapter_name("b")])
+        self.assertEqual(
+            pipeline.adapters, {adapter_name("a"): 1, adapter_name("b"): 0.7}
+        )
+
+    def test_disable_when_none(self):
+        pipeline = FakePipeline()
+        adapters = peft_adapters(fuse_after=0)
+        adapters.activate(pipeline, [lora("a")])
+        adapters.activate(pipeline, [])
+        self.assertFalse(pipeline.enabled)
+        adapters.activate(pipeline, [lora("a")])
+        self.assertTrue(pipeline.enabled)
+        self.assertEqual(len(pipeline.loaded), 1)
+
+    def test_max_adapters(self):
+        pipeline = FakePipeline()
+        adapters = peft_adapters(max_adapters=2, fuse_after=0)
+        for path in ["a", "b", "a", "c"]:
+            adapters.activate(pipeline, [lora(path)])
+        self.assertEqual(pipeline.deleted, [adapter_name("b")])
+        self.assertEqual(
+            list(adapters.resident.keys()), [adapter_name("a"), adapter_name("c")]
+        )
+
+    def test_fuses_sticky_sets(self):
+        pipeline = FakePipeline()
+        adapters = peft_adapters(fuse_after=3)
+        adapters.activate(pipeline, [lora("a")])
+        adapters.reuse(pipeline)
+        self.assertIsNone(pipeline.fused)
+        adapters.activate(pipeline, [lora("a")])
+        self.assertEqual(pipeline.fused, [adapter_name("a")])
+        self.assertTrue(adapters.stats()["fused"])
+        adapters.activate(pipeline, [lora("a", 0.5)])
+        self.assertIsNone(pipeline.fused)
+        self.assertEqual(adapters.counters["unfuses"], 1)
+        self.assertEqual(pipeline.unet.lora_weight.value, 1.0)
+        self.assertIsNone(adapters.pristine)
+
+    def test_fuse_disabled(self):
+        pipeline = FakePipeline()
+        adapters = peft_adapters(fuse_after=0)
+        adapters.activate(pipeline, [lora("a")])
+        for i in range(5):
+            adapters.reuse(pipeline)
+        self.assertIsNone(pipeline.fused)
+
+    def test_scale_change_keeps_adapter(self):
+        pipeline = FakePipeline()
+        adapters = peft_adapters(fuse_after=0)
+        url = "https://host/a.safetensors"
+        # As app.py passes them for "#scale=0.5" and "#scale=0.9"
+        adapters.activate(pipeline, [{"url": url, "path": "a1", "scale": 0.5}])
+        adapters.activate(pipeline, [{"url": url, "path": "a2", "scale": 0.9}])
+        self.assertEqual(pipeline.loaded, [adapter_name(url)])
+        self.assertEqual(pipeline.adapters, {adapter_name(url): 0.9})
+
+    def test_legacy_without_peft_backend(self):
+        pipeline = FakePipeline()
+        adapters = LoraAdapters(state_dicts(), fuse_after=0, use_peft=lambda: False)
+        kwargs = adapters.activate(pipeline, [lora("a", 0.5)])
+        self.assertEqual(kwargs, {"scale": 0.5})
+        self.assertEqual(pipeline.loaded, ["a"])
+        self.assertIsNone(pipeline.adapters)
+
+    def test_legacy_pipeline(self):
+        pipeline = LegacyPipeline()
+        adapters = peft_adapters(fuse_after=0)
+        self.assertEqual(adapters.activate(pipeline, []), {})
+        kwargs = adapters.activate(pipeline, [lora("a", 0.5)])
+        self.assertEqual(kwargs, {"scale": 0.5})
+        adapters.activate(pipeline, [lora("b")])
+        self.assertEqual(pipeline.loaded, ["a", "b"])
+        self.assertEqual(pipeline.unloads, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,193 @@
+import time
+import threading
+
+GPU = "gpu"
+CPU = "cpu"
+
+
+class ModelCacheEntry:
+    def __init__(self, key, model, size):
+        self.key = key
+        self.model = model
+        self.size = size
+        self.tier = GPU
+        self.uses = 0
+        self.last_used = 0
+        # Per-model app state (loaded LoRAs, etc) to restore on re-activation
+        self.state = {}
+
+    def touch(self):
+        self.uses += 1
+        self.last_used = time.monotonic()
+
+
+class ModelCache:
+    """
+    Keeps multiple loaded models resident across requests, in tiers:
+    GPU (ready to use) -> CPU RAM (a host-to-device copy away) -> disk
+    (i.e. not in the cache, needs a full `loadModel()`).  Each in-memory
+    tier has its own byte budget, and victims are chosen by `policy`,
+    either "lru" (least recently used) or "lfu" (least frequently used).
+
+    A gpu_bytes budget of 0 keeps only the most recently activated model
+    on the GPU; a cpu_bytes budget of 0 drops demoted models entirely.
+
+    The functions to move, measure and free models are passed in, so the
+    cache itself stays agnostic of torch / diffusers.  Evicted models are
+    dropped (and `free(model)` called) without a copy to RAM, so callers
+    should release their own references to a model before switching.
+    """
+
+    def __init__(
+        self,
+        gpu_bytes=0,
+        cpu_bytes=0,
+        max_models=0,
+        policy="lru",
+        to_gpu=None,
+        to_cpu=None,
+        size_of=None,
+        on_evict=None,
+        free=None,
+    ):
+        if policy not in ["lru", "lfu"]:
+            raise ValueError(f'Invalid policy "{policy}", expected "lru" or "lfu"')
+        self.gpu_bytes = gpu_bytes
+        self.cpu_bytes = cpu_bytes
+        self.max_models = max_models
+        self.policy = policy
+        self.to_gpu = to_gpu or (lambda model: model)
+        self.to_cpu = to_cpu or (lambda model: model)
+        self.size_of = size_of or (lambda model: 0)
+        self.on_evict = on_evict
+        self.free = free or (lambda model: None)
+        self.entries = {}
+        self.lock = threading.RLock()
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "promotions": 0,
+            "demotions": 0,
+            "evictions": 0,
+        }
+
+    def tier(self, key):
+        entry = self.entries.get(key)
+        return entry.tier if entry else None
+
+    def get(self, key):
+        """
+        Returns the entry for `key`, promoting it to the GPU if needed,
+        or None on a miss (in which case, load the model and `put()` it).
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if not entry:
+                self.counters["misses"] += 1
+                return None
+
+            entry.touch()
+            if entry.tier == GPU:
+                self.counters["hits"] += 1
+            else:
+                # Make space first, so we never hold both at once.
+                self._enforce(active=entry, incoming=entry.size)
+                self.to_gpu(entry.model)
+                entry.tier = GPU
+                self.counters["promotions"] += 1
+
+            self._enforce(active=entry)
+            return entry
+
+    def make_room(self, incoming=None):
+        """
+        Call before loading a new model from disk.  Without a size, assumes
+        it will be as big as the largest model we've seen so far.
+        """
+        with self.lock:
+            if incoming is None:
+                incoming = max([e.size for e in self.entries.values()] or [0])
+            self._enforce(active=None, incoming=incoming)
+
+    def put(self, key, model):
+        with self.lock:
+            entry = ModelCacheEntry(key, model, self.size_of(model))
+            entry.touch()
+            self.entries.update({key: entry})
+            self._enforce(active=entry)
+            return entry
+
+    def evict(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                self._evict(entry)
+
+    def _victims(self, tier, active):
+        entries = [
+            entry
+            for entry in self.entries.values()
+            if entry is not active and (tier is None or entry.tier == tier)
+        ]
+        if self.policy == "lfu":
+            return sorted(entries, key=lambda entry: (entry.uses, entry.last_used))
+        return sorted(entries, key=lambda entry: entry.last_used)
+
+    def _used(self, tier):
+        return sum(
+            [entry.size for entry in self.entries.values() if entry.tier == tier]
+        )
+
+    def _enforce(self, active, incoming=0):
+        for victim in self._victims(GPU, active):
+            if self._used(GPU) + incoming <= self.gpu_bytes:
+                break
+            self._demote(victim)
+
+        for victim in self._victims(CPU, active):
+            if self._used(CPU) <= self.cpu_bytes:
+                break
+            self._evict(victim)
+
+        if self.max_models:
+            # Prefer evicting models that are already off the GPU.
+            victims = self._victims(CPU, active) + self._victims(GPU, active)
+            for victim in victims:
+                if len(self.entries) + (1 if incoming else 0) <= self.max_models:
+                    break
+                self._evict(victim)
+
+    def _demote(self, entry):
+        # Only copy (and pin) to RAM what the CPU tier will actually keep.
+        if entry.size > self.cpu_bytes:
+            self._evict(entry)
+            return
+        self.to_cpu(entry.model)
+        entry.tier = CPU
+        self.counters["demotions"] += 1
+
+    def _evict(self, entry):
+        model = entry.model
+        self.entries.pop(entry.key, None)
+        entry.model = None
+        self.counters["evictions"] += 1
+        if self.on_evict:
+            self.on_evict(entry.key)
+        self.free(model)
+
+    def stats(self):
+        with self.lock:
+            return {
+                **self.counters,
+                "policy": self.policy,
+                "gpu": {
+                    "models": [e.key for e in self.entries.values() if e.tier == GPU],
+                    "used": self._used(GPU),
+                    "budget": self.gpu_bytes,
+                },
+                "cpu": {
+                    "models": [e.key for e in self.entries.values() if e.tier == CPU],
+                    "used": self._used(CPU),
+                    "budget": self.cpu_bytes,
+                },
+            }
@@ -0,0 +1,102 @@
+import unittest
+from .model_cache import ModelCache
+
+
+class FakeModel:
+    def __init__(self, size):
+        self.size = size
+        self.device = "gpu"
+
+
+def createCache(**kwargs):
+    def to_gpu(model):
+        model.device = "gpu"
+
+    def to_cpu(model):
+        model.device = "cpu"
+
+    def free(model):
+        model.device = "freed"
+
+    evicted = []
+    cache = ModelCache(
+        to_gpu=to_gpu,
+        to_cpu=to_cpu,
+        free=free,
+        size_of=lambda model: model.size,
+        on_evict=evicted.append,
+        **kwargs
+    )
+    return cache, evicted
+
+
+class ModelCacheTest(unittest.TestCase):
+    def test_miss_then_hit(self):
+        cache, evicted = createCache(gpu_bytes=100)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", FakeModel(10))
+        self.assertEqual(cache.get("a").model.device, "gpu")
+        self.assertEqual(cache.counters["misses"], 1)
+        self.assertEqual(cache.counters["hits"], 1)
+
+    def test_default_budget_keeps_only_active_model(self):
+        cache, evicted = createCache()
+        a = FakeModel(10)
+        cache.put("a", a)
+        cache.make_room()
+        cache.put("b", FakeModel(10))
+        # Not kept in RAM, so never copied there
+        self.assertEqual(a.device, "freed")
+        self.assertEqual(evicted, ["a"])
+        self.assertEqual(list(cache.entries.keys()), ["b"])
+
+    def test_demote_and_promote(self):
+        cache, evicted = createCache(gpu_bytes=10, cpu_bytes=100)
+        a = FakeModel(10)
+        cache.put("a", a)
+        cache.make_room()
+        cache.put("b", FakeModel(10))
+        self.assertEqual(cache.tier("a"), "cpu")
+        self.assertEqual(a.device, "cpu")
+        self.assertEqual(evicted, [])
+
+        entry = cache.get("a")
+        self.assertIs(entry.model, a)
+        self.assertEqual(a.device, "gpu")
+        self.assertEqual(cache.tier("b"), "cpu")
+        self.assertEqual(cache.counters["promotions"], 1)
+        self.assertEqual(cache.counters["demotions"], 2)
+
+    def test_lru_eviction_from_cpu(self):
+        cache, evicted = createCache(gpu_bytes=10, cpu_bytes=20)
+        for key in ["a", "b", "c", "d"]:
+            cache.make_room()
+            cache.put(key, FakeModel(10))
+        self.assertEqual(evicted, ["a"])
+        self.assertEqual(cache.tier("d"), "gpu")
+
+    def test_lfu_eviction_from_cpu(self):
+        cache, evicted = createCache(gpu_bytes=10, cpu_bytes=20, policy="lfu")
+        cache.put("a", FakeModel(10))
+        cache.get("a")
+        cache.get("a")
+        for key in ["b", "c", "d"]:
+            cache.make_room()
+            cache.put(key, FakeModel(10))
+        self.assertEqual(evicted, ["b"])
+
+    def test_max_models(self):
+        cache, evicted = createCache(gpu_bytes=100, cpu_bytes=100, max_models=2)
+        for key in ["a", "b", "c"]:
+            cache.make_room()
+            cache.put(key, FakeModel(10))
+        self.assertEqual(evicted, ["a"])
+        self.assertEqual(len(cache.entries), 2)
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            ModelCache(policy="fifo")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+import os
+import time
+import statistics
+import weakref
+from .vars import MODELS_DIR, OPTIMIZE, COMPILE_MODE, COMPILE_TIMINGS
+
+OPTIMIZATIONS = ["channels_last", "sdpa", "compile"]
+COMPILE_CACHE_DIR = os.path.join(MODELS_DIR, "torch_compile")
+
+
+def get_optimizations(value=OPTIMIZE):
+    """
+    Parses a comma separated list like "channels_last,sdpa,compile" (or
+    "all").  Raises ValueError on unknown optimizations.
+    """
+    if not value:
+        return []
+    names = [name.strip().lower() for name in value.split(",") if name.strip()]
+    if names == ["all"]:
+        return OPTIMIZATIONS
+    for name in names:
+        if name not in OPTIMIZATIONS:
+            raise ValueError(
+                f'Unknown optimization "{name}", available: ' + ", ".join(OPTIMIZATIONS)
+            )
+    return names
+
+
+# Validated once, at startup
+enabled_optimizations = get_optimizations()
+
+
+class CallTimer:
+    """
+    Times each call of a (compiled) module.  The first call with a new
+    input shape is when torch.compile traces and compiles, so those are
+    reported separately from steady state calls (i.e. denoising steps).
+    """
+
+    def __init__(self, sync=None):
+        self.sync = sync or (lambda: None)
+        self.shapes = set()
+        self.calls = []
+        self.start = None
+
+    def before(self, shape):
+        self.sync()
+        self.start = (shape, time.perf_counter())
+
+    def after(self):
+        self.sync()
+        shape, start = self.start
+        self.record(shape, time.perf_counter() - start)
+
+    def record(self, shape, seconds):
+        first = shape not in self.shapes
+        self.shapes.add(shape)
+        self.calls.append((first, seconds))
+
+    def take(self, name):
+        """Timings (in ms) since the last call, for `$timings`."""
+        calls, self.calls = self.calls, []
+        steady = [seconds for first, seconds in calls if not first]
+        compiles = [seconds for first, seconds in calls if first]
+        timings = {}
+        step = statistics.median(steady) if steady else 0
+        if steady:
+            timings.update({name + "_step": round(step * 1000)})
+        if compiles:
+            timings.update(
+                {name + "_compile": round(sum(s - step for s in compiles) * 1000)}
+            )
+        return timings
+
+
+def _shape(args, kwargs):
+    sample = args[0] if args else next(iter(kwargs.values()), None)
+    return tuple(getattr(sample, "shape", ())) + (str(getattr(sample, "dtype", "")),)
+
+
+def _attach_timer(module):
+    import torch
+
+    timer = CallTimer(torch.cuda.synchronize if torch.cuda.is_available() else None)
+    module.register_forward_pre_hook(
+        lambda module, args, kwargs: timer.before(_shape(args, kwargs)),
+        with_kwargs=True,
+    )
+    module.register_forward_hook(lambda module, args, output: timer.after())
+    return timer
+
+
+def optimize_model(model, optimizations=None, timings=None):
+    """
+    Applies `optimizations` (default: the OPTIMIZE env var) to a loaded
+    pipeline's unet and vae decoder, in place.  With `timings` (default:
+    COMPILE_TIMINGS), compiled modules are timed, see `take_timings()`.
+
+    Compilation itself happens lazily, on the first call per input shape.
+    Inductor's kernel cache (in MODELS_DIR/torch_compile) is persisted, and
+    on torch >= 2.1 its FX graph cache too, so warm restarts skip some (or
+    most) of it.
+    """
+    import torch
+
+    if optimizations is None:
+        optimizations = enabled_optimizations
+    if timings is None:
+        timings = COMPILE_TIMINGS
+    timers = {}
+    unet = getattr(model, "unet", None)
+    vae = getattr(model, "vae", None)
+
+    if "channels_last" in optimizations:
+        for module in [unet, vae]:
+            if module is not None:
+                module.to(memory_format=torch.channels_last)
+
+    if "sdpa" in optimizations and hasattr(
+        torch.nn.functional, "scaled_dot_product_attention"
+    ):
+        from diffusers.models.attention_processor import AttnProcessor2_0
+
+        for module in [unet, vae]:
+            if module is not None and hasattr(module, "set_attn_processor"):
+                module.set_attn_processor(AttnProcessor2_0())
+
+    if "compile" in optimizations and hasattr(torch, "compile"):
+        os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", COMPILE_CACHE_DIR)
+        try:
+            import torch._inductor.config
+
+            torch._inductor.config.fx_graph_cache = True
+        except (ImportError, AttributeError):
+            pass  # older torch, only the kernel cache is persisted
+        if unet is not None:
+            model.unet = torch.compile(unet, mode=COMPILE_MODE)
+            if timings:
+                timers.update({"unet": _attach_timer(model.unet)})
+        if vae is not None:
+            vae.decoder = torch.compile(vae.decoder, mode=COMPILE_MODE)
+            if timings:
+                timers.update({"vae_decoder": _attach_timer(vae.decoder)})
+
+    print("Optimized model", {"optimizations": optimizations, "timed": list(timers)})
+    _timers[model] = timers
+    return model
+
+
+_timers = weakref.WeakKeyDictionary()
+
+
+def take_timings(model):
+    """Compile and steady state step times (ms) of `model` since last call."""
+    timings = {}
+    for name, timer in _timers.get(model, {}).items():
+        timings.update(timer.take(name))
+    return timings
@@ -0,0 +1,31 @@
+import unittest
+from .optimize import get_optimizations, CallTimer, OPTIMIZATIONS
+
+
+class GetOptimizationsTest(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(get_optimizations(""), [])
+        self.assertEqual(get_optimizations("all"), OPTIMIZATIONS)
+        self.assertEqual(get_optimizations("SDPA, compile"), ["sdpa", "compile"])
+        with self.assertRaises(ValueError):
+            get_optimizations("tensorrt")
+
+
+class CallTimerTest(unittest.TestCase):
+    def test_compile_vs_steady_state(self):
+        timer = CallTimer()
+        timer.record((1, 64, 64), 10.0)
+        for seconds in [0.1, 0.2, 0.1]:
+            timer.record((1, 64, 64), seconds)
+        self.assertEqual(timer.take("unet"), {"unet_step": 100, "unet_compile": 9900})
+
+        # Same shape is already compiled, a new one compiles again
+        timer.record((1, 64, 64), 0.1)
+        timer.record((1, 96, 96), 5.1)
+        timer.record((1, 96, 96), 0.1)
+        self.assertEqual(timer.take("unet"), {"unet_step": 100, "unet_compile": 5000})
+        self.assertEqual(timer.take("unet"), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+import json
+import time
+import asyncio
+import traceback
+from .vars import (
+    PRELOAD,
+    MODEL_CACHE_GPU_BYTES,
+    MODEL_CACHE_CPU_BYTES,
+    MODEL_CACHE_MAX_MODELS,
+)
+
+
+def parse_preload(value=PRELOAD):
+    """
+    Parses the PRELOAD env var: a JSON array of callInputs (MODEL_ID,
+    MODEL_URL, PIPELINE, SCHEDULER, lora_weights, etc), or of plain model
+    ids.  Raises ValueError if invalid.
+    """
+    if not value:
+        return []
+    entries = json.loads(value)
+    if not isinstance(entries, list):
+        raise ValueError("PRELOAD should be a JSON array")
+    for i, entry in enumerate(entries):
+        if isinstance(entry, str):
+            entries[i] = {"MODEL_ID": entry}
+        elif not isinstance(entry, dict):
+            raise ValueError(f"Invalid PRELOAD entry: {json.dumps(entry)}")
+    return entries
+
+
+def residency_warning(
+    entries,
+    gpu_bytes=MODEL_CACHE_GPU_BYTES,
+    cpu_bytes=MODEL_CACHE_CPU_BYTES,
+    max_models=MODEL_CACHE_MAX_MODELS,
+):
+    """
+    A warning if the model cache can't keep all the models in `entries`
+    loaded, i.e. all but the last are only downloaded, else None.  (Whether
+    they fit in nonzero budgets is only known once they're loaded.)
+    """
+    count = len(set(entry.get("MODEL_ID", None) for entry in entries))
+    if count < 2:
+        return None
+    if not gpu_bytes and not cpu_bytes:
+        return (
+            f"PRELOAD has {count} models, but with MODEL_CACHE_GPU_BYTES and "
+            "MODEL_CACHE_CPU_BYTES unset only the last stays loaded"
+        )
+    if max_models and max_models < count:
+        return (
+            f"PRELOAD has {count} models, but MODEL_CACHE_MAX_MODELS only "
+            f"keeps {max_models} loaded"
+        )
+    return None
+
+
+class Preloader:
+    """
+    Warms up a list of models in the background at startup: first all
+    downloads run concurrently (`prefetch(call_inputs)`), then each model
+    is loaded and its pipeline, scheduler and LoRAs set up in turn
+    (`warm(call_inputs)`, through the request queue).  Progress is
+    available from `stats()` throughout.  Ends "done", or "failed" if no
+    model could be warmed.
+    """
+
+    def __init__(self, entries, prefetch, warm):
+        self.entries = entries
+        self.prefetch = prefetch
+        self.warm = warm
+        self.state = "pending" if entries else "done"
+        self.models = [
+            {"MODEL_ID": entry.get("MODEL_ID", None), "status": "pending"}
+            for entry in entries
+        ]
+        self.start_time = None
+        self.end_time = None
+
+    async def _step(self, i, fn, status):
+        try:
+            await fn(self.entries[i])
+            self.models[i].update({"status": status})
+        except Exception as error:
+            traceback.print_exc()
+            self.models[i].update({"status": "failed", "error": str(error)})
+
+    async def run(self):
+        if not self.entries:
+            return
+        self.start_time = time.time()
+
+        self.state = "downloading"
+        await asyncio.gather(
+            *[
+                self._step(i, self.prefetch, "downloaded")
+                for i in range(len(self.entries))
+            ]
+        )
+
+        self.state = "warming"
+        for i in range(len(self.entries)):
+            if self.models[i]["status"] != "failed":
+                self.models[i].update({"status": "warming"})
+                await self._step(i, self.warm, "ready")
+
+        failed = all(model["status"] == "failed" for model in self.models)
+        self.state = "failed" if failed else "done"
+        self.end_time = time.time()
+        print("Preload done", self.stats())
+
+    def stats(self):
+        stats = {
+            "state": self.state,
+            "total": len(self.models),
+            "ready": len([m for m in self.models if m["status"] == "ready"]),
+            "failed": len([m for m in self.models if m["status"] == "failed"]),
+            "models": self.models,
+        }
+        if self.end_time:
+            stats.update({"time": round((self.end_time - self.start_time) * 1000)})
+        return stats
@@ -0,0 +1,65 @@
+import asyncio
+import unittest
+from .preload import parse_preload, Preloader, residency_warning
+
+
+class ParsePreloadTest(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(parse_preload(""), [])
+        self.assertEqual(
+            parse_preload('["model-a", {"MODEL_ID": "model-b", "PIPELINE": "x"}]'),
+            [{"MODEL_ID": "model-a"}, {"MODEL_ID": "model-b", "PIPELINE": "x"}],
+        )
+        with self.assertRaises(ValueError):
+            parse_preload('{"MODEL_ID": "a"}')
+        with self.assertRaises(ValueError):
+            parse_preload("[1]")
+
+
+class PreloaderTest(unittest.TestCase):
+    def test_downloads_concurrently_then_warms_in_order(self):
+        events = []
+
+        async def prefetch(entry):
+            events.append(("start", entry["MODEL_ID"]))
+            await asyncio.sleep(0.01)
+            if entry["MODEL_ID"] == "bad":
+                raise Exception("404")
+            events.append(("downloaded", entry["MODEL_ID"]))
+
+        async def warm(entry):
+            events.append(("warm", entry["MODEL_ID"]))
+
+        entries = parse_preload('["a", "bad", "b"]')
+        preloader = Preloader(entries, prefetch, warm)
+        self.assertEqual(preloader.stats()["state"], "pending")
+        asyncio.run(preloader.run())
+
+        self.assertEqual(events[:3], [("start", "a"), ("start", "bad"), ("start", "b")])
+        self.assertEqual(events[-2:], [("warm", "a"), ("warm", "b")])
+        stats = preloader.stats()
+        self.assertEqual(stats["state"], "done")
+        self.assertEqual((stats["ready"], stats["failed"]), (2, 1))
+        self.assertEqual(stats["models"][1]["error"], "404")
+
+    def test_all_failed(self):
+        async def prefetch(entry):
+            raise Exception("404")
+
+        preloader = Preloader(parse_preload('["a", "b"]'), prefetch, None)
+        asyncio.run(preloader.run())
+        self.assertEqual(preloader.stats()["state"], "failed")
+
+    def test_residency_warning(self):
+        entries = parse_preload('["a", "b", "c"]')
+        self.assertIsNone(residency_warning(entries[:1], 0, 0, 0))
+        self.assertIn("only the last", residency_warning(entries, 0, 0, 0))
+        self.assertIn("keeps 2", residency_warning(entries, 10**10, 0, 2))
+        self.assertIsNone(residency_warning(entries, 10**10, 0, 0))
+
+    def test_nothing_to_preload(self):
+        self.assertEqual(Preloader([], None, None).stats()["state"], "done")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import time
+import base64
+import numpy as np
+from io import BytesIO
+
+# Linear approximations of the VAE decoder, latent channels -> RGB, that
+# are good enough for a preview at a tiny fraction of the cost.
+LATENT_RGB_FACTORS = [
+    [0.3512, 0.2297, 0.3227],
+    [0.3250, 0.4974, 0.2350],
+    [-0.2829, 0.1762, 0.2721],
+    [-0.2120, -0.2616, -0.7177],
+]
+LATENT_RGB_FACTORS_SDXL = [
+    [0.3651, 0.4232, 0.4341],
+    [-0.2533, -0.0042, 0.1068],
+    [0.1076, 0.1111, -0.0362],
+    [-0.3165, -0.2492, -0.2188],
+]
+LATENT_RGB_BIAS_SDXL = [0.1084, -0.0175, -0.0011]
+
+
+class ProgressThrottle:
+    """
+    Allows one progress event per `interval_ms`.  The last step held back
+    is returned by `flush()`, to send once the pipeline is done (its real
+    last step isn't always `num_inference_steps - 1`, e.g. with img2img's
+    `strength`).
+    """
+
+    def __init__(self, interval_ms, clock=time.monotonic):
+        self.interval = interval_ms / 1000
+        self.clock = clock
+        self.last = None
+        self.pending = None
+
+    def ready(self, step):
+        now = self.clock()
+        if self.last is not None and now - self.last < self.interval:
+            self.pending = step
+            return False
+        self.last = now
+        self.pending = None
+        return True
+
+    def flush(self):
+        """The last step held back since the last one allowed, or None."""
+        step, self.pending = self.pending, None
+        return step
+
+
+def snapshot_latents(latents):
+    """
+    A CPU copy of the first image's latents, to preview later (on another
+    thread) while denoising carries on.
+    """
+    import torch
+
+    return latents[:1].detach().to("cpu", torch.float32, copy=True)
+
+
+def latents_to_rgb(latents, is_sdxl=False):
+    """The first image of a (batch, 4, h, w) latents array as h x w x 3 uint8."""
+    if hasattr(latents, "detach"):
+        latents = latents[0].detach().float().cpu().numpy()
+    else:
+        latents = np.asarray(latents[0], dtype=np.float32)
+    if is_sdxl:
+        factors, bias = LATENT_RGB_FACTORS_SDXL, LATENT_RGB_BIAS_SDXL
+    else:
+        factors, bias = LATENT_RGB_FACTORS, [0, 0, 0]
+    rgb = latents.transpose(1, 2, 0) @ np.array(factors) + np.array(bias)
+    return ((rgb.clip(-1, 1) + 1) * 127.5).astype(np.uint8)
+
+
+def latent_preview(latents, is_sdxl=False, size=128, quality=60):
+    """A base64 encoded JPEG preview of in-progress latents, `size` px wide/high."""
+    from PIL import Image
+
+    image = Image.fromarray(latents_to_rgb(latents, is_sdxl))
+    scale = size / max(image.size)
+    image = image.resize(
+        (round(image.width * scale), round(image.height * scale)), Image.BILINEAR
+    )
+    buffered = BytesIO()
+    image.save(buffered, format="JPEG", quality=quality)
+    return base64.b64encode(buffered.getvalue()).decode("utf-8")
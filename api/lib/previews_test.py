@@ -0,0 +1,43 @@
+import base64
+import unittest
+import numpy as np
+from io import BytesIO
+from PIL import Image
+from .previews import ProgressThrottle, latents_to_rgb, latent_preview
+
+
+class ProgressThrottleTest(unittest.TestCase):
+    def test_max_rate_and_last_step(self):
+        now = [0]
+        throttle = ProgressThrottle(100, clock=lambda: now[0])
+        ready = []
+        # e.g. img2img with strength=0.7 runs 7 of num_inference_steps=10
+        for step in range(7):
+            ready.append(throttle.ready(step))
+            now[0] += 0.04
+        # t=0, 0.12, 0.24, and the last step when flushed
+        self.assertEqual([i for i, r in enumerate(ready) if r], [0, 3, 6])
+        self.assertIsNone(throttle.flush())
+        throttle.ready(7)
+        self.assertEqual(throttle.flush(), 7)
+        self.assertIsNone(throttle.flush())
+
+
+class LatentPreviewTest(unittest.TestCase):
+    def test_latents_to_rgb(self):
+        latents = np.zeros((2, 4, 8, 6))
+        rgb = latents_to_rgb(latents)
+        self.assertEqual(rgb.shape, (8, 6, 3))
+        self.assertEqual(rgb.dtype, np.uint8)
+        self.assertTrue((rgb == 127).all())
+        self.assertFalse((latents_to_rgb(latents, is_sdxl=True) == 127).all())
+
+    def test_latent_preview_jpeg(self):
+        latents = np.random.default_rng(0).normal(size=(1, 4, 64, 96))
+        image = Image.open(BytesIO(base64.b64decode(latent_preview(latents, size=120))))
+        self.assertEqual(image.format, "JPEG")
+        self.assertEqual(image.size, (120, 80))
+
+
+if __name__ == "__main__":
+    unittest.main()
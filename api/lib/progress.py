@@ -0,0 +1,105 @@
+import json
+import asyncio
+import traceback
+from .vars import STATUS_INTERVAL
+
+
+class ProgressBroadcaster:
+    """
+    One asyncio task per request, on the server's own loop, that:
+
+      * sends events `publish()`ed from other threads (i.e. the pipeline
+        callback) through `send(type, status, payload, opts)`, in order.
+      * writes data `stream()`ed from other threads to the streaming
+        `response` only (e.g. previews, too big for webhooks).  Data can be
+        a function returning it, called on a worker thread only if there's
+        still a response to write to (e.g. to encode previews away from
+        both the pipeline's thread and the loop).
+      * writes a `status` snapshot to the streaming `response` (if any)
+        every `interval` seconds.
+
+    `on_closed()` is called if writing to the response fails (i.e. the
+    client went away).  `publish()` and `stream()` are thread-safe;
+    everything else must be called from the loop.  `stop()` flushes
+    pending events and cancels the task.
+    """
+
+    def __init__(
+        self, send, status, response=None, interval=STATUS_INTERVAL, on_closed=None
+    ):
+        self.send = send
+        self.status = status
+        self.response = response
+        self.interval = interval
+        self.on_closed = on_closed
+        self.loop = None
+        self.queue = None
+        self.task = None
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.task = asyncio.ensure_future(self._run())
+
+    def publish(self, type, status, payload={}, opts={}):
+        self.loop.call_soon_threadsafe(
+            self.queue.put_nowait, (self.send, (type, status, payload, opts))
+        )
+
+    def stream(self, data):
+        self.loop.call_soon_threadsafe(
+            self.queue.put_nowait, (self._send_response, (data,))
+        )
+
+    async def _run(self):
+        next_status = self.loop.time() + self.interval
+        while True:
+            timeout = next_status - self.loop.time()
+            if not self.response:
+                timeout = None
+            try:
+                event = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                await self._send_status()
+                next_status = self.loop.time() + self.interval
+                continue
+            send, args = event
+            try:
+                await send(*args)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self.queue.task_done()
+
+    async def _send_response(self, data):
+        if not self.response:
+            return
+        if callable(data):
+            data = await asyncio.to_thread(data)
+        if data is not None:
+            await self.response.send(json.dumps(data) + "\n")
+
+    async def _send_status(self):
+        try:
+            await self._send_response(self.status.get())
+        except Exception as error:
+            print("Stopped sending status", error)
+            self.response = None
+            if self.on_closed:
+                self.on_closed()
+
+    async def flush(self):
+        """Waits until all events published so far have been sent."""
+        if self.task and not self.task.done():
+            await self.queue.join()
+
+    async def stop(self):
+        if not self.task:
+            return
+        await self.flush()
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
@@ -0,0 +1,119 @@
+import json
+import asyncio
+import threading
+import unittest
+from .progress import ProgressBroadcaster
+
+
+class FakeStatus:
+    def get(self):
+        return {"type": "inference", "progress": 0.5}
+
+
+class FakeResponse:
+    def __init__(self):
+        self.lines = []
+
+    async def send(self, data):
+        self.lines.append(json.loads(data))
+
+
+class ProgressBroadcasterTest(unittest.TestCase):
+    def test_events_from_threads_sent_in_order(self):
+        sent = []
+
+        async def send(type, status, payload={}, opts={}):
+            sent.append((type, status, payload["step"]))
+
+        async def main():
+            progress = ProgressBroadcaster(send, FakeStatus())
+            progress.start()
+
+            def pipeline():
+                for step in range(5):
+                    progress.publish("inference", "progress", {"step": step})
+
+            await asyncio.to_thread(pipeline)
+            await progress.flush()
+            self.assertEqual(len(sent), 5)
+            await progress.stop()
+            self.assertIsNone(progress.task)
+
+        asyncio.run(main())
+        self.assertEqual(sent, [("inference", "progress", i) for i in range(5)])
+
+    def test_status_sent_every_interval_until_stopped(self):
+        response = FakeResponse()
+
+        async def main():
+            progress = ProgressBroadcaster(None, FakeStatus(), response, interval=0.01)
+            progress.start()
+            await asyncio.sleep(0.055)
+            await progress.stop()
+            count = len(response.lines)
+            await asyncio.sleep(0.03)
+            return count
+
+        count = asyncio.run(main())
+        self.assertGreaterEqual(count, 3)
+        self.assertEqual(len(response.lines), count)
+        self.assertEqual(response.lines[0], {"type": "inference", "progress": 0.5})
+
+    def test_stream_writes_to_response_only(self):
+        response = FakeResponse()
+        sent = []
+
+        async def send(*args):
+            sent.append(args)
+
+        async def main():
+            progress = ProgressBroadcaster(send, FakeStatus(), response, interval=10)
+            progress.start()
+            await asyncio.to_thread(progress.stream, {"status": "preview"})
+            await progress.stop()
+
+        asyncio.run(main())
+        self.assertEqual(response.lines, [{"status": "preview"}])
+        self.assertEqual(sent, [])
+
+    def test_stream_prepares_data_off_the_loop(self):
+        response = FakeResponse()
+        threads = []
+
+        def preview():
+            threads.append(threading.get_ident())
+            return {"status": "preview"}
+
+        async def main():
+            progress = ProgressBroadcaster(None, FakeStatus(), response, interval=10)
+            progress.start()
+            await asyncio.to_thread(progress.stream, preview)
+            await asyncio.to_thread(progress.stream, lambda: None)
+            await progress.stop()
+
+        asyncio.run(main())
+        self.assertEqual(response.lines, [{"status": "preview"}])
+        self.assertNotEqual(threads, [threading.get_ident()])
+
+    def test_closed_response_stops_status(self):
+        class ClosedResponse:
+            calls = 0
+
+            async def send(self, data):
+                self.calls += 1
+                raise ConnectionError("closed")
+
+        response = ClosedResponse()
+
+        async def main():
+            progress = ProgressBroadcaster(None, FakeStatus(), response, interval=0.01)
+            progress.start()
+            await asyncio.sleep(0.05)
+            await progress.stop()
+
+        asyncio.run(main())
+        self.assertEqual(response.calls, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import threading
+from collections import OrderedDict
+
+
+def tensors_size(value):
+    if isinstance(value, (list, tuple)):
+        return sum(tensors_size(item) for item in value)
+    if hasattr(value, "numel"):
+        return value.numel() * value.element_size()
+    return 0
+
+
+class PromptEmbedsCache:
+    """
+    Text encoder outputs (prompt embeds, pooled embeds), kept on the device
+    and keyed by everything that affects them (model, textual inversions,
+    LoRAs, prompt text, etc), so repeated prompts and negative prompts skip
+    the text encoder(s).  Least recently used entries are dropped when over
+    `budget_bytes` (0 disables the cache).
+    """
+
+    def __init__(self, budget_bytes=0, size_of=tensors_size):
+        self.budget_bytes = budget_bytes
+        self.size_of = size_of
+        self.entries = OrderedDict()
+        self.used_bytes = 0
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get_or_compute(self, key, compute):
+        if not self.budget_bytes:
+            return compute()
+
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry:
+                self.entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return entry["value"]
+            self.counters["misses"] += 1
+
+        value = compute()
+        size = self.size_of(value)
+        if size > self.budget_bytes:
+            return value
+
+        with self.lock:
+            if key not in self.entries:
+                self.entries.update({key: {"value": value, "size": size}})
+                self.used_bytes += size
+            while self.used_bytes > self.budget_bytes:
+                key, entry = self.entries.popitem(last=False)
+                self.used_bytes -= entry["size"]
+                self.counters["evictions"] += 1
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.used_bytes = 0
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "used_bytes": self.used_bytes,
+            **self.counters,
+        }
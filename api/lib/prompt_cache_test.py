@@ -0,0 +1,45 @@
+import unittest
+from .prompt_cache import PromptEmbedsCache
+
+
+class PromptEmbedsCacheTest(unittest.TestCase):
+    def cache(self, budget):
+        computed = []
+
+        def compute(key):
+            def fn():
+                computed.append(key)
+                return key
+
+            return fn
+
+        cache = PromptEmbedsCache(budget, size_of=lambda value: 10)
+        return cache, computed, lambda key: cache.get_or_compute(key, compute(key))
+
+    def test_hits_skip_compute(self):
+        cache, computed, get = self.cache(100)
+        self.assertEqual(get("dog"), "dog")
+        self.assertEqual(get("dog"), "dog")
+        self.assertEqual(computed, ["dog"])
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["used_bytes"], 10)
+
+    def test_lru_eviction(self):
+        cache, computed, get = self.cache(20)
+        get("a")
+        get("b")
+        get("a")
+        get("c")
+        get("b")
+        self.assertEqual(computed, ["a", "b", "c", "b"])
+        self.assertEqual(cache.counters["evictions"], 2)
+
+    def test_disabled(self):
+        cache, computed, get = self.cache(0)
+        get("a")
+        get("a")
+        self.assertEqual(computed, ["a", "a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,33 @@
-from compel import Compel, DiffusersTextualInversionManager, ReturnedEmbeddingsType
+import inspect
+import torch
+from .prompt_cache import PromptEmbedsCache
+from .vars import PROMPT_CACHE_BYTES
 
+prompt_embeds_cache = PromptEmbedsCache(PROMPT_CACHE_BYTES)
+
+
+def as_lists(model_inputs):
+    prompts = model_inputs.get("prompt")
+    prompts = prompts if isinstance(prompts, list) else [prompts]
+    negative_prompts = model_inputs.get("negative_prompt") or None
+    negative_prompts = (
+        negative_prompts if isinstance(negative_prompts, list) else [negative_prompts]
+    )
+    if len(negative_prompts) == 1:
+        negative_prompts = negative_prompts * len(prompts)
+    return prompts, negative_prompts
+
+
+@torch.inference_mode()
+def prepare_prompts(pipeline, model_inputs, is_sdxl, cache_key=None):
+    """
+    Replaces the prompts in `model_inputs` with compel embeddings.  Each
+    prompt's embeddings come from the prompt cache where possible;
+    `cache_key` must identify everything else that affects them.  Runs
+    the text encoder(s), so call it off the event loop.
+    """
+    from compel import Compel, DiffusersTextualInversionManager, ReturnedEmbeddingsType
 
-def prepare_prompts(pipeline, model_inputs, is_sdxl):
     textual_inversion_manager = DiffusersTextualInversionManager(pipeline)
     if is_sdxl:
         compel = Compel(
@@ -14,27 +40,6 @@ def prepare_prompts(pipeline, model_inputs, is_sdxl):
             returned_embeddings_type=ReturnedEmbeddingsType.PENULTIMATE_HIDDEN_STATES_NON_NORMALIZED,
             requires_pooled=[False, True],
         )
-        conditioning, pooled = compel(model_inputs.get("prompt"))
-        negative_conditioning, negative_pooled = compel(
-            model_inputs.get("negative_prompt")
-        )
-        [
-            conditioning,
-            negative_conditioning,
-        ] = compel.pad_conditioning_tensors_to_same_length(
-            [conditioning, negative_conditioning]
-        )
-        model_inputs.update(
-            {
-                "prompt": None,
-                "negative_prompt": None,
-                "prompt_embeds": conditioning,
-                "negative_prompt_embeds": negative_conditioning,
-                "pooled_prompt_embeds": pooled,
-                "negative_pooled_prompt_embeds": negative_pooled,
-            }
-        )
-
     else:
         compel = Compel(
             tokenizer=pipeline.tokenizer,
@@ -42,19 +47,129 @@ def prepare_prompts(pipeline, model_inputs, is_sdxl):
             textual_inversion_manager=textual_inversion_manager,
             truncate_long_prompts=False,
         )
-        conditioning = compel(model_inputs.get("prompt"))
-        negative_conditioning = compel(model_inputs.get("negative_prompt"))
-        [
-            conditioning,
-            negative_conditioning,
-        ] = compel.pad_conditioning_tensors_to_same_length(
-            [conditioning, negative_conditioning]
+
+    def encode(text):
+        text = text or ""
+        return prompt_embeds_cache.get_or_compute(
+            (cache_key, "compel", is_sdxl, text),
+            lambda: compel(text) if is_sdxl else (compel(text), None),
         )
+
+    prompts, negative_prompts = as_lists(model_inputs)
+    embeds = [encode(text) for text in prompts + negative_prompts]
+    conditionings = compel.pad_conditioning_tensors_to_same_length(
+        [conditioning for conditioning, pooled in embeds]
+    )
+    count = len(prompts)
+    model_inputs.update(
+        {
+            "prompt": None,
+            "negative_prompt": None,
+            "prompt_embeds": torch.cat(conditionings[:count]),
+            "negative_prompt_embeds": torch.cat(conditionings[count:]),
+        }
+    )
+    if is_sdxl:
+        model_inputs.update(
+            {
+                "pooled_prompt_embeds": torch.cat(
+                    [pooled for conditioning, pooled in embeds[:count]]
+                ),
+                "negative_pooled_prompt_embeds": torch.cat(
+                    [pooled for conditioning, pooled in embeds[count:]]
+                ),
+            }
+        )
+
+
+# What encode_prompts() passes to (and needs from) StableDiffusion(XL)
+# pipelines' encode_prompt(), which other pipelines don't all share.
+ENCODE_PROMPT_ARGS = [
+    "prompt",
+    "device",
+    "num_images_per_prompt",
+    "do_classifier_free_guidance",
+    "lora_scale",
+]
+
+
+@torch.inference_mode()
+def encode_prompts(pipeline, model_inputs, is_sdxl, cache_key=None):
+    """
+    The non-compel equivalent of `prepare_prompts()`: precomputes
+    `prompt_embeds` with the pipeline's own `encode_prompt()` through the
+    prompt cache.  Leaves `model_inputs` untouched for pipelines (or
+    inputs) it doesn't know how to handle.  Like `prepare_prompts()`,
+    call it off the event loop.
+    """
+    if not prompt_embeds_cache.budget_bytes or not hasattr(pipeline, "encode_prompt"):
+        return
+    parameters = inspect.signature(pipeline.__call__).parameters
+    if "prompt_embeds" not in parameters or "negative_prompt_embeds" not in parameters:
+        return
+    parameters = inspect.signature(pipeline.encode_prompt).parameters
+    if not all(name in parameters for name in ENCODE_PROMPT_ARGS):
+        return
+    for name in ["prompt_embeds", "prompt_2", "negative_prompt_2", "ip_adapter_image"]:
+        if model_inputs.get(name, None) is not None:
+            return
+    prompts, negative_prompts = as_lists(model_inputs)
+    if not all(isinstance(text, str) for text in prompts):
+        return
+
+    device = pipeline._execution_device
+    lora_scale = (model_inputs.get("cross_attention_kwargs") or {}).get("scale", None)
+
+    def encode(text):
+        def compute():
+            embeds = pipeline.encode_prompt(
+                prompt=text,
+                device=device,
+                num_images_per_prompt=1,
+                do_classifier_free_guidance=False,
+                lora_scale=lora_scale,
+            )
+            if len(embeds) != (4 if is_sdxl else 2):
+                raise TypeError(f"Unexpected encode_prompt() result: {len(embeds)}")
+            return (embeds[0], embeds[2] if is_sdxl else None)
+
+        return prompt_embeds_cache.get_or_compute(
+            (cache_key, "plain", is_sdxl, lora_scale, text), compute
+        )
+
+    try:
+        embeds = [encode(text) for text in prompts]
+    except TypeError as error:
+        # An encode_prompt() we don't know, let the pipeline do it
+        print("Not caching prompt embeds:", error)
+        return
+    # SDXL uses zeros, not the embedding of "", for an empty negative prompt
+    zero_negative = is_sdxl and getattr(
+        pipeline.config, "force_zeros_for_empty_prompt", False
+    )
+    negative_embeds = [
+        tuple(torch.zeros_like(tensor) for tensor in positive)
+        if zero_negative and not text
+        else encode(text or "")
+        for text, positive in zip(negative_prompts, embeds)
+    ]
+
+    model_inputs.update(
+        {
+            "prompt": None,
+            "negative_prompt": None,
+            "prompt_embeds": torch.cat([embed[0] for embed in embeds]),
+            "negative_prompt_embeds": torch.cat(
+                [embed[0] for embed in negative_embeds]
+            ),
+        }
+    )
+    if is_sdxl:
         model_inputs.update(
             {
-                "prompt": None,
-                "negative_prompt": None,
-                "prompt_embeds": conditioning,
-                "negative_prompt_embeds": negative_conditioning,
+                "pooled_prompt_embeds": torch.cat([embed[1] for embed in embeds]),
+                "negative_pooled_prompt_embeds": torch.cat(
+                    [embed[1] for embed in negative_embeds]
+                ),
             }
         )
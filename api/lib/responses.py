@@ -0,0 +1,96 @@
+import base64
+import json
+import struct
+import uuid
+
+RESPONSE_FORMATS = ["json", "multipart", "binary"]
+BINARY_CONTENT_TYPE = "application/x-diffusers-api-binary"
+
+
+def images_result(images: list, response_format="json", mimetype="image/png"):
+    """
+    Returns the part of the result dict holding the encoded `images` (bytes).
+    For "json", the classic `image_base64` / `images_base64`.  Otherwise the
+    raw bytes are kept in `$images` for `encode_response()` to send as is.
+    """
+    if response_format == "json":
+        images_base64 = [base64.b64encode(image).decode("utf-8") for image in images]
+        if len(images_base64) > 1:
+            return {"images_base64": images_base64}
+        return {"image_base64": images_base64[0]}
+
+    return {"$images": images, "$mimetype": mimetype}
+
+
+def _split(result: dict):
+    images = result.get("$images")
+    mimetype = result.get("$mimetype", "image/png")
+    meta = {
+        key: value
+        for key, value in result.items()
+        if key not in ["$images", "$mimetype"]
+    }
+    meta.update({"$images": {"count": len(images), "mimetype": mimetype}})
+    return meta, images, mimetype
+
+
+def encode_multipart(result: dict):
+    """
+    multipart/mixed body: first a JSON part with everything but the images
+    (`$meta`, `$timings`, etc), then one part per image.
+    """
+    meta, images, mimetype = _split(result)
+    boundary = uuid.uuid4().hex
+    extension = mimetype.split("/").pop()
+
+    parts = [
+        b"Content-Type: application/json\r\n\r\n" + json.dumps(meta).encode("utf-8")
+    ]
+    for index, image in enumerate(images):
+        headers = (
+            f"Content-Type: {mimetype}\r\n"
+            f'Content-Disposition: inline; name="image"; filename="{index}.{extension}"'
+            f"\r\nContent-Length: {len(image)}\r\n\r\n"
+        )
+        parts.append(headers.encode("utf-8") + image)
+
+    delimiter = b"--" + boundary.encode("utf-8")
+    body = b"".join([delimiter + b"\r\n" + part + b"\r\n" for part in parts])
+    body += delimiter + b"--\r\n"
+    return body, f"multipart/mixed; boundary={boundary}"
+
+
+def encode_binary(result: dict):
+    """
+    Length-prefixed stream: each frame is a 4-byte big-endian length followed
+    by that many bytes.  The first frame is the JSON metadata, the rest are
+    the images, in order.
+    """
+    meta, images, mimetype = _split(result)
+    frames = [json.dumps(meta).encode("utf-8")] + list(images)
+    body = b"".join([struct.pack(">I", len(frame)) + frame for frame in frames])
+    return body, BINARY_CONTENT_TYPE
+
+
+def decode_binary(body: bytes):
+    """Inverse of `encode_binary()`, returns (meta, images)."""
+    frames = []
+    offset = 0
+    while offset < len(body):
+        (length,) = struct.unpack_from(">I", body, offset)
+        offset += 4
+        frames.append(body[offset : offset + length])
+        offset += length
+    return json.loads(frames[0]), frames[1:]
+
+
+def encode_response(result: dict, response_format: str):
+    """
+    Returns (body, content_type) for results with raw `$images`, otherwise
+    None, i.e. send the result as regular JSON (e.g. for errors).
+    """
+    if "$images" not in result:
+        return None
+    if response_format == "multipart":
+        return encode_multipart(result)
+    return encode_binary(result)
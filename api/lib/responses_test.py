@@ -0,0 +1,57 @@
+import email
+import json
+import unittest
+from .responses import (
+    images_result,
+    encode_response,
+    decode_binary,
+    BINARY_CONTENT_TYPE,
+)
+
+IMAGES = [b"\x89PNG first", b"\x89PNG second"]
+
+
+class ImagesResultTest(unittest.TestCase):
+    def test_json_single(self):
+        self.assertEqual(images_result([b"abc"]), {"image_base64": "YWJj"})
+
+    def test_json_multiple(self):
+        result = images_result([b"abc", b"abc"])
+        self.assertEqual(result, {"images_base64": ["YWJj", "YWJj"]})
+
+    def test_raw(self):
+        result = images_result(IMAGES, "binary")
+        self.assertEqual(result["$images"], IMAGES)
+
+
+class EncodeResponseTest(unittest.TestCase):
+    def result(self, response_format):
+        return {"$meta": {"a": 1}, "$timings": {"inference": 10}} | images_result(
+            IMAGES, response_format
+        )
+
+    def test_json_is_not_encoded(self):
+        self.assertIsNone(encode_response(self.result("json"), "json"))
+
+    def test_binary(self):
+        body, content_type = encode_response(self.result("binary"), "binary")
+        self.assertEqual(content_type, BINARY_CONTENT_TYPE)
+        meta, images = decode_binary(body)
+        self.assertEqual(images, IMAGES)
+        self.assertEqual(meta["$timings"], {"inference": 10})
+        self.assertEqual(meta["$images"], {"count": 2, "mimetype": "image/png"})
+
+    def test_multipart(self):
+        body, content_type = encode_response(self.result("multipart"), "multipart")
+        message = email.message_from_bytes(
+            b"Content-Type: " + content_type.encode("utf-8") + b"\r\n\r\n" + body
+        )
+        parts = message.get_payload()
+        self.assertEqual(parts[0].get_content_type(), "application/json")
+        self.assertEqual(json.loads(parts[0].get_payload())["$meta"], {"a": 1})
+        self.assertEqual(parts[1].get_content_type(), "image/png")
+        self.assertEqual(parts[2].get_payload(decode=True), IMAGES[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
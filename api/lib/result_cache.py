@@ -0,0 +1,178 @@
+import os
+import json
+import base64
+import hashlib
+import asyncio
+import tempfile
+import threading
+import traceback
+from collections import OrderedDict
+from .vars import RESULT_CACHE_BYTES, RESULT_CACHE_URL
+
+# callInputs that don't affect the generated images.
+IGNORED_CALL_INPUTS = [
+    "SEND_URL",
+    "SIGN_KEY",
+    "startRequestId",
+    "streamEvents",
+    "QUEUE_TIMEOUT",
+    "response_format",
+    "preview_steps",
+    "preview_size",
+    "batch",
+    "result_cache",
+]
+
+
+def cacheable(model_inputs, call_inputs):
+    """
+    Only seeded (i.e. reproducible) inference is worth caching, and for a
+    list of seeds (one per image), every image must have one.
+    """
+    seeds = model_inputs.get("seed", None)
+    seeds = seeds if isinstance(seeds, list) else [seeds]
+    return (
+        len(seeds) > 0
+        and all(seed is not None for seed in seeds)
+        and call_inputs.get("result_cache", True)
+        and not call_inputs.get("train", None)
+        and not call_inputs.get("use_extra", None)
+        and not call_inputs.get("warmup", False)
+    )
+
+
+def fingerprint(model_inputs, call_inputs, extra={}):
+    """
+    A canonical hash of everything that determines the output images:
+    modelInputs (prompts, seed, image inputs, etc), relevant callInputs
+    (model, pipeline, scheduler, LoRAs, textual inversions, etc) and
+    `extra` (env defaults, versions, resolved output options).
+
+    Inputs are hashed as given, so image URLs (with `is_url`) are hashed as
+    URLs, not by the content they point to.
+    """
+    call_inputs = {
+        key: value
+        for key, value in call_inputs.items()
+        if key not in IGNORED_CALL_INPUTS
+    }
+    canonical = json.dumps(
+        [model_inputs, call_inputs, extra],
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Encoded output images by request fingerprint: an in-memory LRU of up
+    to `budget_bytes`, backed by an optional persistent tier at `url`
+    (e.g. "s3:///bucket/results"), read and written through the Storage
+    classes, one JSON file per result.  Disabled if neither is set.
+    """
+
+    def __init__(self, budget_bytes=RESULT_CACHE_BYTES, url=RESULT_CACHE_URL):
+        self.budget_bytes = budget_bytes
+        self.url = url.rstrip("/") if url else url
+        self.entries = OrderedDict()
+        self.used_bytes = 0
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "storage_hits": 0, "misses": 0, "evictions": 0}
+        self.uploads = set()
+
+    @property
+    def enabled(self):
+        return bool(self.budget_bytes or self.url)
+
+    def storage(self, key):
+        from utils import Storage
+
+        return Storage(f"{self.url}/{key}.json")
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        size = sum(len(image) for image in entry["images"])
+        if size > self.budget_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries.update({key: entry})
+            self.used_bytes += size
+            while self.used_bytes > self.budget_bytes:
+                key, evicted = self.entries.popitem(last=False)
+                self.used_bytes -= sum(len(image) for image in evicted["images"])
+                self.counters["evictions"] += 1
+
+    def _download(self, key):
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, "result.json")
+            try:
+                self.storage(key).download_file(path)
+                with open(path) as file:
+                    data = json.load(file)
+            except Exception as error:
+                print("Result cache miss", key, error)
+                return None
+        return {
+            "images": [base64.b64decode(image) for image in data["images"]],
+            "mimetype": data["mimetype"],
+        }
+
+    def _upload(self, key, entry):
+        data = {
+            "images": [
+                base64.b64encode(image).decode("utf-8") for image in entry["images"]
+            ],
+            "mimetype": entry["mimetype"],
+        }
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, "result.json")
+            with open(path, "w") as file:
+                json.dump(data, file)
+            try:
+                self.storage(key).upload_file(path, None)
+            except Exception:
+                traceback.print_exc()
+
+    async def lookup(self, key):
+        """{ images, mimetype } from memory, then storage, or None."""
+        entry = self.get(key)
+        if entry:
+            self.counters["hits"] += 1
+            return entry
+        if self.url:
+            entry = await asyncio.to_thread(self._download, key)
+            if entry:
+                self.counters["storage_hits"] += 1
+                self.put(key, entry)
+                return entry
+        self.counters["misses"] += 1
+        return None
+
+    async def store(self, key, images, mimetype):
+        entry = {"images": images, "mimetype": mimetype}
+        self.put(key, entry)
+        if self.url:
+            # Don't hold up the response for the upload
+            upload = asyncio.ensure_future(asyncio.to_thread(self._upload, key, entry))
+            self.uploads.add(upload)
+            upload.add_done_callback(self.uploads.discard)
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "used_bytes": self.used_bytes,
+            **self.counters,
+        }
+
+
+result_cache = ResultCache()
@@ -0,0 +1,91 @@
+import asyncio
+import unittest
+from .result_cache import ResultCache, cacheable, fingerprint
+
+
+class FakeStorage:
+    files = {}
+
+    def __init__(self, url):
+        self.url = url
+
+    def download_file(self, dest):
+        if self.url not in self.files:
+            raise FileNotFoundError(self.url)
+        with open(dest, "w") as file:
+            file.write(self.files[self.url])
+
+    def upload_file(self, source, dest):
+        with open(source) as file:
+            self.files[self.url] = file.read()
+
+
+class FingerprintTest(unittest.TestCase):
+    def test_only_seeded_requests(self):
+        self.assertTrue(cacheable({"seed": 0}, {}))
+        self.assertFalse(cacheable({}, {}))
+        self.assertFalse(cacheable({"seed": 1}, {"result_cache": False}))
+        self.assertFalse(cacheable({"seed": 1}, {"train": "dreambooth"}))
+        self.assertTrue(cacheable({"seed": [1, 2]}, {}))
+        self.assertFalse(cacheable({"seed": [1, None]}, {}))
+        self.assertFalse(cacheable({"seed": []}, {}))
+
+    def test_canonical(self):
+        a = fingerprint(
+            {"prompt": "cat", "seed": 1}, {"MODEL_ID": "a", "startRequestId": "1"}
+        )
+        b = fingerprint(
+            {"seed": 1, "prompt": "cat"}, {"startRequestId": "2", "MODEL_ID": "a"}
+        )
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, fingerprint({"prompt": "cat", "seed": 2}, {}))
+        self.assertNotEqual(
+            a,
+            fingerprint({"prompt": "cat", "seed": 1}, {"MODEL_ID": "a"}, {"v": 2}),
+        )
+
+
+class ResultCacheTest(unittest.TestCase):
+    def test_memory_lru(self):
+        cache = ResultCache(budget_bytes=10, url="")
+        self.assertTrue(cache.enabled)
+
+        async def main():
+            self.assertIsNone(await cache.lookup("a"))
+            await cache.store("a", [b"12345"], "image/png")
+            await cache.store("b", [b"12345"], "image/png")
+            self.assertEqual((await cache.lookup("a"))["images"], [b"12345"])
+            await cache.store("c", [b"123"], "image/png")  # evicts b
+            return [await cache.lookup(key) for key in ["a", "b", "c"]]
+
+        a, b, c = asyncio.run(main())
+        self.assertIsNotNone(a)
+        self.assertIsNone(b)
+        self.assertEqual(c, {"images": [b"123"], "mimetype": "image/png"})
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertFalse(ResultCache(budget_bytes=0, url="").enabled)
+
+    def test_storage_tier(self):
+        writer = ResultCache(budget_bytes=0, url="s3:///bucket/results/")
+        reader = ResultCache(budget_bytes=100, url="s3:///bucket/results")
+        writer.storage = reader.storage = lambda key: FakeStorage(
+            f"{reader.url}/{key}.json"
+        )
+
+        async def main():
+            await writer.store("a", [b"\x89PNG"], "image/png")
+            await asyncio.gather(*writer.uploads)
+            first = await reader.lookup("a")
+            second = await reader.lookup("a")
+            return first, second
+
+        first, second = asyncio.run(main())
+        self.assertEqual(first, {"images": [b"\x89PNG"], "mimetype": "image/png"})
+        self.assertEqual(second, first)
+        self.assertEqual(FakeStorage.files.keys(), {"s3:///bucket/results/a.json"})
+        self.assertEqual(reader.stats()["storage_hits"], 1)
+        self.assertEqual(reader.stats()["hits"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import math
+from .vars import SHAPE_BUCKETS, SHAPE_BUCKET_MODE
+
+SHAPE_BUCKET_MODES = ["pad", "snap"]
+
+
+def parse_buckets(value=SHAPE_BUCKETS):
+    """
+    Parses "512x512,768x768,512x768" into [(512, 512), (768, 768), ...].
+    Raises ValueError on an invalid bucket.
+    """
+    buckets = []
+    for bucket in (value or "").split(","):
+        if not bucket.strip():
+            continue
+        try:
+            width, height = [int(size) for size in bucket.lower().split("x")]
+        except ValueError:
+            raise ValueError(f'Invalid shape bucket "{bucket}", expected WxH')
+        if width % 8 or height % 8:
+            raise ValueError(f'Shape bucket "{bucket}" must be a multiple of 8')
+        buckets.append((width, height))
+    return buckets
+
+
+def check_bucket_mode(mode=SHAPE_BUCKET_MODE):
+    """Returns `mode`, or raises ValueError if it isn't a known mode."""
+    if mode not in SHAPE_BUCKET_MODES:
+        raise ValueError(
+            f'Invalid shape bucket mode "{mode}", expected one of '
+            + ", ".join(SHAPE_BUCKET_MODES)
+        )
+    return mode
+
+
+# Validated once, at startup
+check_bucket_mode()
+
+
+def choose_bucket(width, height, buckets, mode=SHAPE_BUCKET_MODE):
+    """
+    The bucket to generate a `width` x `height` image at, or None to use
+    the requested size.  "pad": the smallest bucket that fits it (later
+    cropped back).  "snap": the bucket closest in aspect ratio and area
+    (later resized back).
+    """
+    if not buckets or (width, height) in buckets:
+        return None
+    if check_bucket_mode(mode) == "pad":
+        fits = [
+            bucket for bucket in buckets if bucket[0] >= width and bucket[1] >= height
+        ]
+        return min(fits, key=lambda bucket: bucket[0] * bucket[1]) if fits else None
+
+    def distance(bucket):
+        aspect = math.log((bucket[0] / bucket[1]) / (width / height))
+        area = math.log((bucket[0] * bucket[1]) / (width * height))
+        return abs(aspect) * 4 + abs(area)
+
+    return min(buckets, key=distance)
+
+
+def restore_size(image, width, height, mode=SHAPE_BUCKET_MODE):
+    """Crops ("pad") or resizes ("snap") a bucket sized PIL image back."""
+    if image.size == (width, height):
+        return image
+    if mode == "pad":
+        left = (image.width - width) // 2
+        top = (image.height - height) // 2
+        return image.crop((left, top, left + width, top + height))
+    from PIL import Image
+
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def bucket_inputs(model_inputs, buckets, mode=SHAPE_BUCKET_MODE):
+    """
+    Moves a txt2img request's width / height to its bucket.  Returns the
+    originally requested (width, height) to restore afterwards, or None if
+    nothing changed.
+    """
+    if not buckets or "image" in model_inputs or "init_image" in model_inputs:
+        return None
+    width, height = model_inputs.get("width", None), model_inputs.get("height", None)
+    if not width or not height:
+        return None
+    bucket = choose_bucket(int(width), int(height), buckets, mode)
+    if not bucket:
+        return None
+    model_inputs.update({"width": bucket[0], "height": bucket[1]})
+    return (int(width), int(height))
+
+
+def warmup(pipeline, buckets, steps=2):
+    """
+    Runs a tiny inference at each bucket, so cuDNN autotuning, allocator
+    growth and any torch.compile work happen at startup, not on the first
+    request at that size.
+    """
+    import time
+
+    for width, height in buckets:
+        start = time.time()
+        pipeline(
+            prompt="",
+            width=width,
+            height=height,
+            num_inference_steps=steps,
+        )
+        print(f"Warmed up {width}x{height} in {round((time.time() - start) * 1000)} ms")
@@ -0,0 +1,53 @@
+import unittest
+from PIL import Image
+from .shapes import (
+    parse_buckets,
+    check_bucket_mode,
+    choose_bucket,
+    restore_size,
+    bucket_inputs,
+)
+
+BUCKETS = [(512, 512), (768, 768), (512, 768), (768, 512)]
+
+
+class ShapesTest(unittest.TestCase):
+    def test_parse_buckets(self):
+        self.assertEqual(parse_buckets("512x512, 512X768"), [(512, 512), (512, 768)])
+        self.assertEqual(parse_buckets(""), [])
+        with self.assertRaises(ValueError):
+            parse_buckets("512")
+        with self.assertRaises(ValueError):
+            parse_buckets("500x500")
+
+    def test_check_bucket_mode(self):
+        self.assertEqual(check_bucket_mode("snap"), "snap")
+        with self.assertRaises(ValueError):
+            check_bucket_mode("crop")
+
+    def test_pad(self):
+        self.assertEqual(choose_bucket(500, 700, BUCKETS, "pad"), (512, 768))
+        self.assertEqual(choose_bucket(600, 600, BUCKETS, "pad"), (768, 768))
+        self.assertIsNone(choose_bucket(1024, 1024, BUCKETS, "pad"))
+        self.assertIsNone(choose_bucket(512, 512, BUCKETS, "pad"))
+
+    def test_snap(self):
+        self.assertEqual(choose_bucket(1024, 1024, BUCKETS, "snap"), (768, 768))
+        self.assertEqual(choose_bucket(600, 880, BUCKETS, "snap"), (512, 768))
+
+    def test_restore_size(self):
+        image = Image.new("RGB", (512, 768))
+        self.assertEqual(restore_size(image, 500, 700, "pad").size, (500, 700))
+        self.assertEqual(restore_size(image, 600, 880, "snap").size, (600, 880))
+
+    def test_bucket_inputs(self):
+        model_inputs = {"width": 500, "height": 700}
+        self.assertEqual(bucket_inputs(model_inputs, BUCKETS, "pad"), (500, 700))
+        self.assertEqual(model_inputs, {"width": 512, "height": 768})
+        self.assertIsNone(bucket_inputs({"prompt": "dog"}, BUCKETS, "pad"))
+        img2img = {"width": 500, "height": 700, "image": "..."}
+        self.assertIsNone(bucket_inputs(img2img, BUCKETS, "pad"))
+
+
+if __name__ == "__main__":
+    unittest.main()
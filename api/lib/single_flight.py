@@ -0,0 +1,80 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time.  Callers arriving while a call
+    for the same key is in flight await its result (or exception) instead of
+    starting their own, e.g. so concurrent requests for the same uncached
+    model only download it once.
+
+    The shared call is shielded, so a caller being cancelled doesn't cancel
+    it for everyone else.
+
+    Events the call `publish()`es (e.g. download progress) go to every
+    caller's `subscriber`, and callers joining late get the earlier ones
+    first.
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.events = {}
+        self.subscribers = {}
+        self.counters = {"calls": 0, "shared": 0}
+
+    def in_flight(self, key):
+        return key in self.flights
+
+    async def run(self, key, fn, subscriber=None):
+        """
+        Returns the result of `await fn()`, sharing it with (or joining) any
+        concurrent call for the same `key`.  `subscriber` is awaited with
+        the args of each event published for `key` until then.
+        """
+        flight = self.flights.get(key, None)
+        if flight:
+            self.counters["shared"] += 1
+            print(f"Waiting for in-flight {key}")
+        else:
+            self.counters["calls"] += 1
+            flight = asyncio.ensure_future(fn())
+            self.flights.update({key: flight})
+            self.events.update({key: []})
+            flight.add_done_callback(lambda _: self.done(key))
+
+        if subscriber:
+            # Replay what was missed, then subscribe without awaiting in
+            # between, so no event is missed or sent twice.
+            events = self.events.get(key, [])
+            seen = 0
+            while seen < len(events):
+                await self.notify(subscriber, events[seen])
+                seen += 1
+            self.subscribers.setdefault(key, []).append(subscriber)
+        try:
+            return await asyncio.shield(flight)
+        finally:
+            if subscriber:
+                self.subscribers[key].remove(subscriber)
+                if not self.subscribers[key]:
+                    del self.subscribers[key]
+
+    def done(self, key):
+        self.flights.pop(key, None)
+        self.events.pop(key, None)
+
+    async def publish(self, key, *args):
+        """Sends an event to everyone waiting for `key`."""
+        if key in self.events:
+            self.events[key].append(args)
+        for subscriber in list(self.subscribers.get(key, [])):
+            await self.notify(subscriber, args)
+
+    async def notify(self, subscriber, args):
+        try:
+            await subscriber(*args)
+        except Exception as error:
+            print(f"Error notifying single flight subscriber: {error}")
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,93 @@
+import asyncio
+import unittest
+from .single_flight import SingleFlight
+
+
+class SingleFlightTest(unittest.TestCase):
+    def test_concurrent_calls_share_result(self):
+        calls = []
+
+        async def download(name):
+            calls.append(name)
+            await asyncio.sleep(0.01)
+            return name + " done"
+
+        async def main():
+            flight = SingleFlight()
+            results = await asyncio.gather(
+                flight.run("a", lambda: download("a")),
+                flight.run("a", lambda: download("a")),
+                flight.run("b", lambda: download("b")),
+            )
+            self.assertFalse(flight.in_flight("a"))
+            self.assertEqual(flight.counters, {"calls": 2, "shared": 1})
+            # Later calls run again
+            await flight.run("a", lambda: download("a"))
+            return results
+
+        results = asyncio.run(main())
+        self.assertEqual(results, ["a done", "a done", "b done"])
+        self.assertEqual(calls, ["a", "b", "a"])
+
+    def test_exception_shared(self):
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("404")
+
+        async def main():
+            flight = SingleFlight()
+            return await asyncio.gather(
+                flight.run("a", fail), flight.run("a", fail), return_exceptions=True
+            )
+
+        results = asyncio.run(main())
+        self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+
+    def test_cancelled_caller_does_not_cancel_others(self):
+        async def download():
+            await asyncio.sleep(0.02)
+            return "done"
+
+        async def main():
+            flight = SingleFlight()
+            first = asyncio.ensure_future(flight.run("a", download))
+            second = asyncio.ensure_future(flight.run("a", download))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+
+        self.assertEqual(asyncio.run(main()), "done")
+
+    def test_events_reach_every_caller(self):
+        received = {"first": [], "second": []}
+
+        def subscriber(name):
+            async def receive(*args):
+                received[name].append(args)
+
+            return receive
+
+        async def main():
+            flight = SingleFlight()
+
+            async def download():
+                await flight.publish("a", "download", "start")
+                await asyncio.sleep(0.01)
+                await flight.publish("a", "download", "done")
+
+            first = asyncio.ensure_future(
+                flight.run("a", download, subscriber("first"))
+            )
+            await asyncio.sleep(0.005)
+            # Joins after "start", still gets it
+            await flight.run("a", download, subscriber("second"))
+            await first
+            self.assertEqual(flight.subscribers, {})
+
+        asyncio.run(main())
+        events = [("download", "start"), ("download", "done")]
+        self.assertEqual(received, {"first": events, "second": events})
+
+
+if __name__ == "__main__":
+    unittest.main()
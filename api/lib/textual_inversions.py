@@ -1,13 +1,14 @@
 import json
 import re
 import os
-import asyncio
+import copy
+import weakref
 from utils import Storage
 from .vars import MODELS_DIR
+from .artifacts import artifact_cache
 
 last_textual_inversions = None
 last_textual_inversion_model = None
-loaded_textual_inversion_tokens = []
 
 tokenRe = re.compile(
     r"[#&]{1}fname=(?P<fname>[^\.]+)\.(?:pt|safetensors)(&token=(?P<token>[^&]+))?$"
@@ -25,54 +26,132 @@ def extract_tokens_from_list(textual_inversions: list):
     return list(map(strMap, textual_inversions))
 
 
-async def handle_textual_inversions(textual_inversions: list, model, status):
+class TextualInversionRegistry:
+    """
+    Keeps the embeddings of every textual inversion loaded so far in RAM,
+    per model id, and tracks which are applied to each (resident) model.
+
+    Embeddings are only read from disk the first time.  After that they're
+    applied by adding their tokens and copying in their vectors.  Tokens no
+    longer wanted are removed by restoring the tokenizer and embedding
+    matrix to the model's original vocab and re-applying the rest, so
+    neither grows without bound.
+    """
+
+    def __init__(self):
+        self.embeddings = {}
+        self.applied = weakref.WeakKeyDictionary()
+        self.base = weakref.WeakKeyDictionary()
+        self.counters = {"loads": 0, "applies": 0, "resets": 0}
+
+    def update(self, model, model_id, wanted):
+        """
+        Makes exactly `wanted`, a list of (key, load) tuples, applied to
+        `model`, in order.  `load(model)` loads the embedding from disk.
+        """
+        keys = [key for key, load in wanted]
+        applied = self.applied.get(model, [])
+        if applied != keys[: len(applied)]:
+            self.reset(model)
+            applied = []
+
+        registry = self.embeddings.setdefault(model_id, {})
+        for key, load in wanted[len(applied) :]:
+            if key in registry:
+                print("Apply textual inversion " + key)
+                self.apply(model, registry[key])
+            else:
+                registry[key] = self.capture(model, load)
+            applied.append(key)
+        self.applied[model] = applied
+
+    def capture(self, model, load):
+        """Loads an embedding, returning its new tokens and vectors."""
+        self._ensure_base(model)
+        start = len(model.tokenizer)
+        load(model)
+        end = len(model.tokenizer)
+        weight = model.text_encoder.get_input_embeddings().weight
+        self.counters["loads"] += 1
+        return {
+            "tokens": model.tokenizer.convert_ids_to_tokens(list(range(start, end))),
+            "embeddings": weight[start:end].detach().to("cpu").clone(),
+        }
+
+    def apply(self, model, entry):
+        self._ensure_base(model)
+        model.tokenizer.add_tokens(entry["tokens"])
+        model.text_encoder.resize_token_embeddings(len(model.tokenizer))
+        ids = model.tokenizer.convert_tokens_to_ids(entry["tokens"])
+        weight = model.text_encoder.get_input_embeddings().weight
+        weight.data[ids] = entry["embeddings"].to(weight.device, weight.dtype)
+        self.counters["applies"] += 1
+
+    def reset(self, model):
+        """Restores the model's original vocab, removing all added tokens."""
+        base = self.base.get(model, None)
+        if not base:
+            return
+        print("Removing all textual inversion tokens")
+        model.tokenizer.__dict__.update(copy.deepcopy(base["tokenizer"]))
+        model.text_encoder.resize_token_embeddings(base["size"])
+        self.applied[model] = []
+        self.counters["resets"] += 1
+
+    def _ensure_base(self, model):
+        if model not in self.base:
+            self.base[model] = {
+                "tokenizer": copy.deepcopy(model.tokenizer.__dict__),
+                "size": len(model.tokenizer),
+            }
+
+
+registry = TextualInversionRegistry()
+
+
+async def handle_textual_inversions(
+    textual_inversions: list, model, status, model_id=None
+):
     global last_textual_inversions
     global last_textual_inversion_model
-    global loaded_textual_inversion_tokens
 
     textual_inversions_str = json.dumps(textual_inversions)
     if (
-        textual_inversions_str != last_textual_inversions
-        or model is not last_textual_inversion_model
+        textual_inversions_str == last_textual_inversions
+        and last_textual_inversion_model
+        and last_textual_inversion_model() is model
     ):
-        if model is not last_textual_inversion_model:
-            loaded_textual_inversion_tokens = []
-            last_textual_inversion_model = model
-        # print({"textual_inversions": textual_inversions})
-        # tokens_to_load = extract_tokens_from_list(textual_inversions)
-        # print({"tokens_loaded": loaded_textual_inversion_tokens})
-        # print({"tokens_to_load": tokens_to_load})
-        #
-        # for token in loaded_textual_inversion_tokens:
-        #     if token not in tokens_to_load:
-        #         print("[TextualInversion] Removing uneeded token: " + token)
-        #         del pipeline.tokenizer.get_vocab()[token]
-        #         # del pipeline.text_encoder.get_input_embeddings().weight.data[token]
-        #         pipeline.text_encoder.resize_token_embeddings(len(pipeline.tokenizer))
-        #
-        # loaded_textual_inversion_tokens = tokens_to_load
-
-        last_textual_inversions = textual_inversions_str
-        for textual_inversion in textual_inversions:
-            storage = Storage(textual_inversion, no_raise=True, status=status)
-            if storage:
-                storage_query_fname = storage.query.get("fname")
-                if storage_query_fname:
-                    fname = storage_query_fname[0]
-                else:
-                    fname = textual_inversion.split("/").pop()
-                path = os.path.join(MODELS_DIR, "textual_inversion--" + fname)
-                if not os.path.exists(path):
-                    await asyncio.to_thread(storage.download_file, path)
-                print("Load textual inversion " + path)
-                token = storage.query.get("token", None)
-                if token not in loaded_textual_inversion_tokens:
-                    model.load_textual_inversion(
-                        path, token=token, local_files_only=True
-                    )
-                    loaded_textual_inversion_tokens.append(token)
+        print("No changes to textual inversions since last call")
+        return
+
+    last_textual_inversions = textual_inversions_str
+    # Weak, so we don't keep an evicted model (and its memory) alive
+    last_textual_inversion_model = weakref.ref(model)
+
+    wanted = []
+    for textual_inversion in textual_inversions:
+        storage = Storage(textual_inversion, no_raise=True, status=status)
+        if storage:
+            storage_query_fname = storage.query.get("fname")
+            if storage_query_fname:
+                fname = storage_query_fname[0]
             else:
+                fname = textual_inversion.split("/").pop()
+            path = os.path.join(MODELS_DIR, "textual_inversion--" + fname)
+            token = storage.query.get("token", None)
+            if textual_inversion not in registry.embeddings.get(model_id, {}):
+                await artifact_cache.fetch_async(storage, path)
+
+            def load(model, path=path, token=token):
+                print("Load textual inversion " + path)
+                model.load_textual_inversion(path, token=token, local_files_only=True)
+
+        else:
+
+            def load(model, textual_inversion=textual_inversion):
                 print("Load textual inversion " + textual_inversion)
                 model.load_textual_inversion(textual_inversion)
-    else:
-        print("No changes to textual inversions since last call")
+
+        wanted.append((textual_inversion, load))
+
+    registry.update(model, model_id, wanted)
@@ -1,16 +1,124 @@
 import unittest
-from .textual_inversions import extract_tokens_from_list
+import numpy as np
+from .textual_inversions import TextualInversionRegistry
 
 
-class TextualInversionsTest(unittest.TestCase):
-    def test_extract_tokens_query_fname(self):
-        tis = ["https://civitai.com/api/download/models/106132#fname=4nj0lie.pt"]
-        tokens = extract_tokens_from_list(tis)
-        self.assertEqual(tokens[0], "4nj0lie")
+class FakeTensor:
+    def __init__(self, array):
+        self.array = array
+        self.device = "cpu"
+        self.dtype = array.dtype
 
-    def test_extract_tokens_query_token(self):
-        tis = [
-            "https://civitai.com/api/download/models/106132#fname=4nj0lie.pt&token=4nj0lie"
-        ]
-        tokens = extract_tokens_from_list(tis)
-        self.assertEqual(tokens[0], "4nj0lie")
+    @property
+    def data(self):
+        return self
+
+    def __getitem__(self, index):
+        return FakeTensor(self.array[index])
+
+    def __setitem__(self, index, value):
+        self.array[index] = value.array
+
+    def detach(self):
+        return self
+
+    def to(self, *args):
+        return self
+
+    def clone(self):
+        return FakeTensor(self.array.copy())
+
+
+class FakeEmbeddings:
+    def __init__(self, size):
+        self.weight = FakeTensor(np.zeros((size, 2)))
+
+
+class FakeTextEncoder:
+    def __init__(self, size):
+        self.embeddings = FakeEmbeddings(size)
+
+    def get_input_embeddings(self):
+        return self.embeddings
+
+    def resize_token_embeddings(self, size):
+        array = self.embeddings.weight.array[:size]
+        if size > len(array):
+            array = np.concatenate([array, np.zeros((size - len(array), 2))])
+        self.embeddings.weight = FakeTensor(array)
+
+
+class FakeTokenizer:
+    def __init__(self):
+        self.vocab = ["a", "b"]
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def add_tokens(self, tokens):
+        self.vocab += [token for token in tokens if token not in self.vocab]
+
+    def convert_ids_to_tokens(self, ids):
+        return [self.vocab[id] for id in ids]
+
+    def convert_tokens_to_ids(self, tokens):
+        return [self.vocab.index(token) for token in tokens]
+
+
+class FakeModel:
+    def __init__(self):
+        self.tokenizer = FakeTokenizer()
+        self.text_encoder = FakeTextEncoder(2)
+        self.loads = []
+
+    def load_textual_inversion(self, token, value):
+        self.loads.append(token)
+        self.tokenizer.add_tokens([token])
+        self.text_encoder.resize_token_embeddings(len(self.tokenizer))
+        self.text_encoder.embeddings.weight.array[-1] = value
+
+    def vector(self, token):
+        id = self.tokenizer.vocab.index(token)
+        return list(self.text_encoder.embeddings.weight.array[id])
+
+
+def ti(token, value):
+    return (token, lambda model: model.load_textual_inversion(token, value))
+
+
+class TextualInversionRegistryTest(unittest.TestCase):
+    def test_adds_and_removes_tokens(self):
+        registry = TextualInversionRegistry()
+        model = FakeModel()
+        registry.update(model, "model", [ti("cat", 1), ti("dog", 2)])
+        self.assertEqual(model.tokenizer.vocab, ["a", "b", "cat", "dog"])
+
+        registry.update(model, "model", [ti("dog", 2)])
+        self.assertEqual(model.tokenizer.vocab, ["a", "b", "dog"])
+        self.assertEqual(len(model.text_encoder.embeddings.weight.array), 3)
+        self.assertEqual(model.vector("dog"), [2, 2])
+        self.assertEqual(model.loads, ["cat", "dog"])
+
+        registry.update(model, "model", [])
+        self.assertEqual(model.tokenizer.vocab, ["a", "b"])
+
+    def test_reapplies_to_new_model_from_memory(self):
+        registry = TextualInversionRegistry()
+        registry.update(FakeModel(), "model", [ti("cat", 1)])
+        model = FakeModel()
+        registry.update(model, "model", [ti("cat", 1)])
+        self.assertEqual(model.loads, [])
+        self.assertEqual(model.vector("cat"), [1, 1])
+        self.assertEqual(registry.counters, {"loads": 1, "applies": 1, "resets": 0})
+
+    def test_appending_keeps_applied(self):
+        registry = TextualInversionRegistry()
+        model = FakeModel()
+        registry.update(model, "model", [ti("cat", 1)])
+        registry.update(model, "model", [ti("cat", 1), ti("dog", 2)])
+        self.assertEqual(registry.counters["resets"], 0)
+        self.assertEqual(model.loads, ["cat", "dog"])
+
+
+if __name__ == "__main__":
+    unittest.main()
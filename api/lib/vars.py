@@ -1,4 +1,5 @@
 import os
+import re
 
 RUNTIME_DOWNLOADS = os.getenv("RUNTIME_DOWNLOADS") == "1"
 USE_DREAMBOOTH = os.getenv("USE_DREAMBOOTH") == "1"
@@ -7,3 +8,103 @@ PIPELINE = os.environ.get("PIPELINE")
 HF_AUTH_TOKEN = os.getenv("HF_AUTH_TOKEN")
 HOME = os.path.expanduser("~")
 MODELS_DIR = os.path.join(HOME, ".cache", "diffusers-api")
+
+
+def parse_bytes(value, default=0):
+    """
+    Parses a human friendly byte size like "512M", "8GB" or "1.5g" into
+    an integer number of bytes.  Plain numbers are taken as bytes.
+    """
+    if value is None or value == "":
+        return default
+    match = re.match(r"^\s*([\d.]+)\s*([kmgt]?)i?b?\s*$", str(value), re.IGNORECASE)
+    if not match:
+        raise ValueError("Invalid byte size: " + str(value))
+    number, unit = match.groups()
+    multiplier = 1024 ** " kmgt".index(unit.lower() or " ")
+    return int(float(number) * multiplier)
+
+
+# Model residency: how many bytes of models to keep on the GPU and in
+# (pinned) CPU RAM.  0 keeps only the active model on the GPU, and nothing
+# in RAM, i.e. the old behaviour of reloading from disk on every switch.
+MODEL_CACHE_GPU_BYTES = parse_bytes(os.getenv("MODEL_CACHE_GPU_BYTES"))
+MODEL_CACHE_CPU_BYTES = parse_bytes(os.getenv("MODEL_CACHE_CPU_BYTES"))
+MODEL_CACHE_MAX_MODELS = int(os.getenv("MODEL_CACHE_MAX_MODELS") or 0)
+MODEL_CACHE_POLICY = os.getenv("MODEL_CACHE_POLICY") or "lru"
+MODEL_CACHE_PIN_MEMORY = os.getenv("MODEL_CACHE_PIN_MEMORY", "1") == "1"
+
+# Micro-batching of compatible txt2img requests, off unless BATCH_MAX_SIZE > 1
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE") or 1)
+BATCH_WINDOW_MS = int(os.getenv("BATCH_WINDOW_MS") or 50)
+
+# Request queue: max waiting jobs (0 for unlimited), and default seconds a
+# job may wait before it's dropped (0 for no limit, callInputs.QUEUE_TIMEOUT)
+QUEUE_MAX_DEPTH = int(os.getenv("QUEUE_MAX_DEPTH") or 0)
+QUEUE_TIMEOUT = float(os.getenv("QUEUE_TIMEOUT") or 0)
+QUEUE_CONCURRENCY = int(os.getenv("QUEUE_CONCURRENCY") or 1)
+
+# Output image encoding defaults, see lib/image_encoders.py
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT") or "png"
+OUTPUT_QUALITY = int(os.getenv("OUTPUT_QUALITY") or 90)
+PNG_COMPRESS_LEVEL = int(os.getenv("PNG_COMPRESS_LEVEL") or 6)
+OUTPUT_ENCODER_THREADS = int(os.getenv("OUTPUT_ENCODER_THREADS") or 4)
+
+# Max bytes of downloaded models, LoRAs, etc in MODELS_DIR before least
+# recently used entries are deleted (0 for unlimited).
+DISK_CACHE_BYTES = parse_bytes(os.getenv("DISK_CACHE_BYTES"))
+
+# LoRAs: bytes of parsed state dicts to keep in RAM, and max adapters to
+# keep loaded per model for fast switching.
+LORA_CACHE_BYTES = parse_bytes(os.getenv("LORA_CACHE_BYTES"), 1024**3)
+LORA_MAX_ADAPTERS = int(os.getenv("LORA_MAX_ADAPTERS") or 8)
+# Fuse a LoRA set into the model weights after this many consecutive
+# requests use it (0, the default, to never fuse).
+LORA_FUSE_AFTER = int(os.getenv("LORA_FUSE_AFTER") or 0)
+
+# Bytes of (device) memory for cached prompt embeddings (0, the default,
+# to disable)
+PROMPT_CACHE_BYTES = parse_bytes(os.getenv("PROMPT_CACHE_BYTES"))
+
+# Opt-in model optimizations applied after loading, comma separated:
+# channels_last, sdpa, compile (or "all").  See lib/optimize.py
+OPTIMIZE = os.getenv("OPTIMIZE") or ""
+COMPILE_MODE = os.getenv("COMPILE_MODE") or "default"
+# Time each call of compiled modules for $timings (syncs the GPU per call)
+COMPILE_TIMINGS = os.getenv("COMPILE_TIMINGS", "0") == "1"
+
+# Resolution buckets, e.g. "512x512,768x768,512x768".  txt2img requests are
+# generated at a bucket size ("pad": smallest that fits, then cropped;
+# "snap": closest, then resized), and each bucket is warmed up in init().
+SHAPE_BUCKETS = os.getenv("SHAPE_BUCKETS") or ""
+SHAPE_BUCKET_MODE = os.getenv("SHAPE_BUCKET_MODE") or "pad"
+SHAPE_WARMUP_STEPS = int(os.getenv("SHAPE_WARMUP_STEPS") or 2)
+
+# Models to download and warm up in the background at startup, a JSON array
+# of callInputs (or model ids).  See lib/preload.py
+PRELOAD = os.getenv("PRELOAD") or ""
+
+# Seconds between background refreshes of the GPU stats in /healthcheck
+HEALTH_INTERVAL = float(os.getenv("HEALTH_INTERVAL") or 10)
+
+# Seconds between status updates ({ type, progress }) on streaming responses
+STATUS_INTERVAL = float(os.getenv("STATUS_INTERVAL") or 1)
+
+# Webhook (SEND_URL) delivery: events per POST (more than 1 posts a JSON
+# array), ms to wait for more events before posting, max queued events
+# (progress events are coalesced / dropped first) and retries on failure.
+SEND_BATCH_MAX = int(os.getenv("SEND_BATCH_MAX") or 1)
+SEND_FLUSH_MS = float(os.getenv("SEND_FLUSH_MS") or 50)
+SEND_MAX_PENDING = int(os.getenv("SEND_MAX_PENDING") or 1000)
+SEND_RETRIES = int(os.getenv("SEND_RETRIES") or 3)
+
+# Min ms between "progress" events (with the `callback_steps` modelInput),
+# and the max width / height of latent previews (`preview_steps` callInput).
+PROGRESS_INTERVAL_MS = float(os.getenv("PROGRESS_INTERVAL_MS") or 250)
+PREVIEW_SIZE = int(os.getenv("PREVIEW_SIZE") or 128)
+
+# Results of seeded requests (same inputs, same images): bytes of encoded
+# images to keep in RAM, and an optional Storage URL (e.g. s3:///bucket/dir)
+# to persist them to.  Both empty / 0 disables the cache.
+RESULT_CACHE_BYTES = parse_bytes(os.getenv("RESULT_CACHE_BYTES"))
+RESULT_CACHE_URL = os.getenv("RESULT_CACHE_URL") or ""
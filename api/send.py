@@ -4,8 +4,9 @@ import datetime
 import time
 import requests
 import hashlib
-from requests_futures.sessions import FuturesSession
 from status import status as statusInstance
+from lib.event_sink import EventSink
+from lib.vars import SEND_BATCH_MAX, SEND_FLUSH_MS, SEND_MAX_PENDING, SEND_RETRIES
 
 print()
 environ = os.environ.copy()
@@ -28,7 +29,12 @@ SIGN_KEY = os.getenv("SIGN_KEY", "")
 if SIGN_KEY == "":
     SIGN_KEY = None
 
-futureSession = FuturesSession()
+event_sink = EventSink(
+    batch_max=SEND_BATCH_MAX,
+    flush_ms=SEND_FLUSH_MS,
+    max_pending=SEND_MAX_PENDING,
+    retries=SEND_RETRIES,
+)
 
 container_id = os.getenv("CONTAINER_ID")
 if not container_id:
@@ -106,7 +112,7 @@ async def send(type: str, status: str, payload: dict = {}, opts: dict = {}):
     print(datetime.datetime.now(), data)
 
     if send_url:
-        futureSession.post(send_url, json=data)
+        event_sink.put(send_url, data)
 
     response = opts.get("response")
     if response:
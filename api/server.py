@@ -3,17 +3,37 @@
 
 # Instead, edit the init() and inference() functions in app.py
 
+# Time the (slow) startup imports, reported below.
+from lib.import_timer import import_timer
+
+import_timer.install()
+
 from sanic import Sanic, response
 from sanic_ext import Extend
-import subprocess
 import app as user_src
 import traceback
 import os
 import json
+import asyncio
+from lib.job_queue import JobQueue, QueueFull, QueueTimeout
+from lib.responses import encode_response
+from lib.disk_cache import disk_cache
+from lib.preload import Preloader, parse_preload, residency_warning
+from lib.health import Health
+from lib.cancellation import cancel_registry
+from lib.result_cache import result_cache
+from lib.coalesce import Coalescer, coalesce_key
+from device import device_id, gpu_stats
+from send import event_sink
+from lib.vars import QUEUE_MAX_DEPTH, QUEUE_TIMEOUT, QUEUE_CONCURRENCY, BATCH_MAX_SIZE
+
+import_timer.uninstall()
 
 # We do the model load-to-GPU step on server startup
 # so the model object is available globally for reuse
-user_src.init()
+with import_timer.phase("init"):
+    user_src.init()
+print("Startup", import_timer.stats())
 
 # Create the http server app
 server = Sanic("my_app")
@@ -21,17 +41,79 @@ server.config.CORS_ORIGINS = os.getenv("CORS_ORIGINS") or "*"
 server.config.RESPONSE_TIMEOUT = 60 * 60  # 1 hour (training can be long)
 Extend(server)
 
+# Requests share global model state, so they run through a queue rather
+# than interleaving.  Compatible requests are started together for batching.
+job_queue = JobQueue(
+    max_depth=QUEUE_MAX_DEPTH,
+    concurrency=QUEUE_CONCURRENCY,
+    group_max=BATCH_MAX_SIZE,
+)
+# Identical seeded requests arriving while one is in flight share its result.
+coalescer = Coalescer()
+
+
+async def warm(call_inputs):
+    output = await job_queue.submit(
+        lambda: user_src.inference(
+            {"callInputs": {**call_inputs, "warmup": True}, "modelInputs": {}}, None
+        )
+    )
+    if output.get("$error", None):
+        raise Exception(output["$error"].get("message", output["$error"]))
+
+
+# Models in PRELOAD are downloaded and loaded in the background, while we
+# already answer healthchecks (with progress) and requests.
+preloader = Preloader(parse_preload(), user_src.prefetch, warm)
+preload_warning = residency_warning(preloader.entries)
+if preload_warning:
+    print("Warning: " + preload_warning)
+
+
+@server.after_server_start
+async def start_preload(app):
+    app.add_task(preloader.run())
+
+
+# Healthchecks verify that the environment is correct on Banana Serverless.
+# They're answered from cached state; GPU stats refresh in the background.
+health = Health(gpu=device_id == "cuda", gpu_stats=gpu_stats)
+health.add_check(
+    "model", lambda: user_src.model is not None or user_src.RUNTIME_DOWNLOADS
+)
+# Not ready until preloading is done, and never if every model failed
+health.add_check("preload", lambda: preloader.state == "done")
+health.add_check("queue", lambda: not job_queue.full())
+health.add_stats("queue", job_queue.stats)
+health.add_stats("disk", disk_cache.stats)
+health.add_refresh(disk_cache.measure)
+health.add_stats("preload", preloader.stats)
+health.add_stats("startup", import_timer.stats)
+health.add_stats("webhooks", event_sink.stats)
+health.add_stats("cancellations", cancel_registry.stats)
+health.add_stats("result_cache", result_cache.stats)
+health.add_stats("coalesced", coalescer.stats)
+
+
+@server.after_server_start
+async def start_health(app):
+    app.add_task(health.run())
+
 
-# Healthchecks verify that the environment is correct on Banana Serverless
 @server.route("/healthcheck", methods=["GET"])
 def healthcheck(request):
-    # dependency free way to check if GPU is visible
-    gpu = False
-    out = subprocess.run("nvidia-smi", shell=True)
-    if out.returncode == 0:  # success state on shell command
-        gpu = True
+    return response.json(health.report())
+
+
+@server.route("/healthcheck/live", methods=["GET"])
+def liveness(request):
+    return response.json(health.live())
+
 
-    return response.json({"state": "healthy", "gpu": gpu})
+@server.route("/healthcheck/ready", methods=["GET"])
+def readiness(request):
+    ready = health.ready()
+    return response.json(ready, status=200 if ready["ready"] else 503)
 
 
 # Inference POST handler at '/' is called for every http call from Banana
@@ -44,13 +126,87 @@ async def inference(request):
 
     call_inputs = all_inputs.get("callInputs", None)
     stream_events = call_inputs and call_inputs.get("streamEvents", 0) != 0
+    timeout = float((call_inputs or {}).get("QUEUE_TIMEOUT", QUEUE_TIMEOUT) or 0)
+
+    # Identical seeded requests are answered from the result cache, or
+    # run once if already in flight, see lib/coalesce.py
+    fingerprint = user_src.request_fingerprint(all_inputs)
+    key = output = None
+    if fingerprint:
+        key = coalesce_key(fingerprint, call_inputs, bool(stream_events))
+        output = await user_src.cached_result(
+            all_inputs, fingerprint, streaming=bool(stream_events)
+        )
+
+    # Shed load early, before we start streaming a response, but only for
+    # requests that would queue a job of their own.
+    if not output and not (key and coalescer.in_flight(key)):
+        if job_queue.full():
+            return response.json(
+                {
+                    "$error": {
+                        "code": "QUEUE_FULL",
+                        "message": "Too many queued requests, try again later",
+                        "queue": job_queue.stats(),
+                    }
+                },
+                status=429,
+            )
+        eta = job_queue.eta()
+        if timeout and eta and eta > timeout * 1000:
+            return response.json(
+                {
+                    "$error": {
+                        "code": "QUEUE_TIMEOUT",
+                        "message": f"Estimated wait of {eta}ms exceeds {timeout}s",
+                        "queue": job_queue.stats(),
+                    }
+                },
+                status=503,
+            )
 
     streaming_response = None
     if stream_events:
         streaming_response = await request.respond(content_type="application/x-ndjson")
 
+    # Cancelled by startRequestId (see /cancel below) or when the client
+    # disconnects, which makes Sanic cancel this handler.
+    cancel = cancel_registry.register((call_inputs or {}).get("startRequestId", None))
+
+    def run(streaming_response, cancel):
+        on_update = None
+        if streaming_response:
+
+            def on_update(position, eta):
+                data = {
+                    "type": "queue",
+                    "status": "waiting",
+                    "payload": {"position": position, "eta": eta},
+                }
+                asyncio.ensure_future(streaming_response.send(json.dumps(data) + "\n"))
+
+        return job_queue.submit(
+            lambda: user_src.inference(all_inputs, streaming_response, cancel),
+            group=user_src.batch_group(all_inputs, streaming_response),
+            timeout=timeout,
+            on_update=on_update,
+        )
+
+    status = 200
     try:
-        output = await user_src.inference(all_inputs, streaming_response)
+        if not output and key:
+            output = await coalescer.run(key, run, streaming_response, cancel)
+        elif not output:
+            output = await run(streaming_response, cancel)
+    except asyncio.CancelledError:
+        cancel.cancel("disconnected")
+        raise
+    except QueueFull as err:
+        status = 429
+        output = {"$error": {"code": "QUEUE_FULL", "message": str(err)}}
+    except QueueTimeout as err:
+        status = 503
+        output = {"$error": {"code": "QUEUE_TIMEOUT", "message": str(err)}}
     except Exception as err:
         print(err)
         output = {
@@ -62,10 +218,37 @@ async def inference(request):
             }
         }
 
+    finally:
+        cancel_registry.unregister(cancel)
+
     if stream_events:
         await streaming_response.send(json.dumps(output) + "\n")
     else:
-        return response.json(output)
+        # Raw image bytes instead of base64-in-JSON, if requested
+        encoded = encode_response(
+            output, (call_inputs or {}).get("response_format", "json")
+        )
+        if encoded:
+            body, content_type = encoded
+            return response.raw(body, content_type=content_type, status=status)
+        return response.json(output, status=status)
+
+
+@server.route("/cancel", methods=["POST"])
+def cancel(request):
+    start_request_id = (request.json or {}).get("startRequestId", None)
+    cancelled = cancel_registry.cancel(start_request_id)
+    if not cancelled:
+        return response.json(
+            {
+                "$error": {
+                    "code": "NOT_FOUND",
+                    "message": f'No running request with startRequestId "{start_request_id}"',
+                }
+            },
+            status=404,
+        )
+    return response.json({"cancelled": cancelled})
 
 
 if __name__ == "__main__":
@@ -1,8 +1,80 @@
 import os
 import re
+import queue
+import shutil
+import tarfile as _tarfile
+import threading
 import subprocess
 from abc import ABC, abstractmethod
 import xtarfile as tarfile
+import zstandard
+
+# Pipe downloads straight through decompression and extraction, rather than
+# saving the whole archive to disk first.
+STREAMING_EXTRACT = os.environ.get("STREAMING_EXTRACT", "1") == "1"
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+class PrefetchReader:
+    """
+    File-like object that reads `source` in a background thread, up to
+    `max_chunks` ahead, so that the network (producer) and decompression /
+    extraction (consumer) run concurrently.  Calls `on_progress(bytes_read)`.
+    """
+
+    def __init__(self, source, chunk_size=STREAM_CHUNK_SIZE, max_chunks=64):
+        self.source = source
+        self.chunk_size = chunk_size
+        self.queue = queue.Queue(maxsize=max_chunks)
+        self.buffer = memoryview(b"")
+        self.eof = False
+        self.error = None
+        self.bytes_read = 0
+        self.on_progress = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._produce, daemon=True)
+        self.thread.start()
+
+    def _produce(self):
+        try:
+            while not self.closed:
+                chunk = self.source.read(self.chunk_size)
+                if not chunk:
+                    break
+                self.queue.put(chunk)
+        except Exception as error:
+            self.error = error
+        self.queue.put(None)
+
+    def close(self):
+        self.closed = True
+        # Unblock the producer if it's waiting on a full queue
+        try:
+            while True:
+                self.queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def read(self, size=-1):
+        if size < 0:
+            return b"".join(iter(lambda: self.read(STREAM_CHUNK_SIZE), b""))
+
+        # Short reads are fine for tarfile and zstandard, and save copying.
+        if not self.buffer and not self.eof:
+            chunk = self.queue.get()
+            if chunk is None:
+                self.eof = True
+                if self.error:
+                    raise self.error
+            else:
+                self.buffer = memoryview(chunk)
+                self.bytes_read += len(chunk)
+                if self.on_progress:
+                    self.on_progress(self.bytes_read)
+
+        data = bytes(self.buffer[:size])
+        self.buffer = self.buffer[size:]
+        return data
 
 
 class BaseArchive(ABC):
@@ -56,6 +128,52 @@ class TarArchive(BaseArchive):
         self.updateStatus("extract", 1)
         return dir  # , base, ext, subext
 
+    def extract_stream(self, fileobj, dir, total=0):
+        """
+        Extracts from a (non-seekable) stream as it arrives, decompressing
+        .zst on the fly.  The archive itself is never written to disk.
+        """
+        if not dir:
+            base, ext, subext = self.splitext()
+            parent_dir = os.path.dirname(self.path)
+            dir = os.path.join(parent_dir, base)
+
+        self.updateStatus("download", 0)
+        # Extract to a temporary dir so a failed download never looks complete
+        partial_dir = dir + ".partial"
+        if os.path.isdir(partial_dir):
+            shutil.rmtree(partial_dir)
+        os.mkdir(partial_dir)
+
+        reader = PrefetchReader(fileobj)
+        if total:
+            reader.on_progress = lambda bytes_read: self.updateStatus(
+                "download", bytes_read / total
+            )
+
+        mode = "r|"
+        stream = reader
+        if re.search(r"\.zst$", self.path):
+            stream = zstandard.ZstdDecompressor().stream_reader(reader)
+        elif re.search(r"\.(gz|bz2|xz)$", self.path):
+            mode = "r|*"
+
+        print("Streaming extract to " + dir)
+        try:
+            with _tarfile.open(fileobj=stream, mode=mode) as tar:
+                tar.extractall(path=partial_dir)
+        except:
+            shutil.rmtree(partial_dir, ignore_errors=True)
+            raise
+        finally:
+            reader.close()
+        os.rename(partial_dir, dir)
+        subprocess.run(["ls", "-l", dir])
+
+        self.updateStatus("download", 1)
+        self.updateStatus("extract", 1)
+        return dir
+
 
 archiveClasses = [TarArchive]
 
@@ -90,10 +208,21 @@ class BaseStorage(ABC):
         return self.url.split("/").pop()
 
     @abstractmethod
-    def download_file(self, dest):
-        """Download the file to `dest`"""
+    def download_file(self, dest, resume=False):
+        """Download the file to `dest`, continuing a partial file if `resume`"""
         pass
 
+    def get_info(self):
+        """
+        Returns what we know about the remote file without downloading it,
+        e.g. { "size": bytes, "etag": "..." }, or {} if unknown.
+        """
+        return {}
+
+    # Storage classes that set this implement open_stream(), returning
+    # (fileobj, total_size) to read the file as a stream.
+    streamable = False
+
     def download_and_extract(self, fname, dir=None, dry_run=False):
         """
         Downloads the file, and if it's an archive, extract it too.  Returns
@@ -105,7 +234,12 @@ class BaseStorage(ABC):
 
         archive = Archive(fname, status=self.status)
         if archive:
-            # TODO, streaming pipeline
+            if STREAMING_EXTRACT and self.streamable and not dry_run:
+                fileobj, total = self.open_stream()
+                try:
+                    return archive.extract_stream(fileobj, dir, total)
+                finally:
+                    fileobj.close()
             self.download_file(fname)
             return archive.extract(dir)
         else:
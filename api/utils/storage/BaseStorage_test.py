@@ -1,5 +1,11 @@
+import io
+import os
+import tarfile
+import tempfile
 import unittest
+import zstandard
 from . import Storage, S3Storage, HTTPStorage
+from .BaseStorage import Archive, PrefetchReader
 
 
 class BaseStorageTest(unittest.TestCase):
@@ -20,3 +26,40 @@ class BaseStorageTest(unittest.TestCase):
             self.assertEqual(base, "file")
             self.assertEqual(ext, "tar")
             self.assertEqual(subext, "zst")
+
+
+class PrefetchReaderTest(unittest.TestCase):
+    def test_reads_everything(self):
+        data = os.urandom(100000)
+        reader = PrefetchReader(io.BytesIO(data), chunk_size=4096, max_chunks=2)
+        chunks = []
+        while True:
+            chunk = reader.read(1000)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        self.assertEqual(b"".join(chunks), data)
+        self.assertEqual(reader.bytes_read, len(data))
+
+
+class TarArchiveTest(unittest.TestCase):
+    def test_extract_stream_zst(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            src = os.path.join(tmp, "src")
+            os.mkdir(src)
+            with open(os.path.join(src, "model.bin"), "wb") as file:
+                file.write(b"weights" * 1000)
+
+            tar_buffer = io.BytesIO()
+            with tarfile.open(fileobj=tar_buffer, mode="w") as tar:
+                tar.add(src, arcname=".")
+            compressed = zstandard.ZstdCompressor().compress(tar_buffer.getvalue())
+
+            archive = Archive(os.path.join(tmp, "model.tar.zst"))
+            dir = os.path.join(tmp, "model")
+            result = archive.extract_stream(io.BytesIO(compressed), dir)
+
+            self.assertEqual(result, dir)
+            self.assertFalse(os.path.exists(dir + ".partial"))
+            with open(os.path.join(dir, "model.bin"), "rb") as file:
+                self.assertEqual(file.read(), b"weights" * 1000)
@@ -1,12 +1,23 @@
 import re
 import os
+import math
 import time
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 from .BaseStorage import BaseStorage
 import urllib.parse
 
 
+DOWNLOAD_CONNECTIONS = int(os.environ.get("DOWNLOAD_CONNECTIONS", 8))
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get("DOWNLOAD_CHUNK_SIZE", 1024 * 1024))
+DOWNLOAD_MIN_PART_SIZE = int(os.environ.get("DOWNLOAD_MIN_PART_SIZE", 16 * 1024**2))
+DOWNLOAD_RETRIES = int(os.environ.get("DOWNLOAD_RETRIES", 3))
+# Byte offsets must match what's on the wire, so no content-encoding.
+IDENTITY = {"Accept-Encoding": "identity"}
+
+
 def get_now():
     return round(time.time() * 1000)
 
@@ -22,32 +33,201 @@ class HTTPStorage(BaseStorage):
         self.url = parts[0]
         if len(parts) > 1:
             self.query = urllib.parse.parse_qs(parts[1])
+        self._info = None
 
     def upload_file(self, source, dest):
         raise RuntimeError("HTTP PUT not implemented yet")
 
-    def download_file(self, fname):
-        print(f"Downloading {self.url} to {fname}...")
+    streamable = True
+
+    def open_stream(self):
+        print(f"Streaming {self.url}...")
         resp = requests.get(self.url, stream=True)
-        total = int(resp.headers.get("content-length", 0))
-        content_disposition = resp.headers.get("content-disposition")
+        resp.raise_for_status()
+        resp.raw.decode_content = True
+        return resp.raw, int(resp.headers.get("content-length", 0))
+
+    def get_info(self):
+        if self._info is not None:
+            return self._info
+
+        self._info = {}
+        try:
+            head = requests.head(
+                self.url, allow_redirects=True, timeout=30, headers=IDENTITY
+            )
+            if head.ok:
+                self._info = {
+                    # Use the final URL after redirects for range requests
+                    "url": head.url,
+                    "size": int(head.headers.get("content-length", 0)),
+                    "etag": head.headers.get("etag", None),
+                    "accept_ranges": head.headers.get("accept-ranges", "") == "bytes",
+                }
+                self._filename_from_headers(head.headers)
+        except requests.RequestException as error:
+            print("HEAD request failed, falling back to a single stream", error)
+        return self._info
+
+    def download_file(self, fname, resume=False):
+        """
+        Downloads to `fname`.  With `resume`, an existing (partial) `fname` is
+        continued from where it stopped, if the server supports it.
+        """
+        print(f"Downloading {self.url} to {fname}...")
+        info = self.get_info()
+        url = info.get("url", self.url)
+        total = info.get("size", 0)
+        accept_ranges = info.get("accept_ranges", False)
+
+        offset = 0
+        if resume and os.path.isfile(fname):
+            offset = os.path.getsize(fname)
+            if not accept_ranges or (total and offset >= total):
+                offset = 0
+
+        if (
+            offset == 0
+            and accept_ranges
+            and DOWNLOAD_CONNECTIONS > 1
+            and total > DOWNLOAD_MIN_PART_SIZE
+        ):
+            self._download_parallel(url, fname, total)
+        else:
+            self._download_single(fname, offset, info.get("etag", None))
+
+    def _filename_from_headers(self, headers):
+        content_disposition = headers.get("content-disposition")
         if content_disposition:
             filename_search = re.search('filename="(.+)"', content_disposition)
             if filename_search:
                 self.filename = filename_search.group(1)
         else:
             print("Warning: content-disposition header is not found in the response.")
+
+    def _download_single(self, fname, offset=0, etag=None):
+        headers = {}
+        if offset:
+            print(f"Resuming from byte {offset}")
+            headers.update({"Range": f"bytes={offset}-", **IDENTITY})
+            if etag:
+                # Server sends the whole file (200) if it changed since.
+                headers.update({"If-Range": etag})
+        resp = requests.get(self.url, stream=True, headers=headers)
+        resp.raise_for_status()
+        if resp.status_code != 206:
+            offset = 0
+        total = offset + int(resp.headers.get("content-length", 0))
+        self._filename_from_headers(resp.headers)
         # Can also replace 'file' with a io.BytesIO object
-        with open(fname, "wb") as file, tqdm(
+        with open(fname, "ab" if offset else "wb") as file, tqdm(
             desc="Downloading",
             total=total,
+            initial=offset,
             unit="iB",
             unit_scale=True,
             unit_divisor=1024,
         ) as bar:
-            total_written = 0
-            for data in resp.iter_content(chunk_size=1024):
+            total_written = offset
+            for data in resp.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
                 size = file.write(data)
                 bar.update(size)
                 total_written += size
-                self.updateStatus("download", total_written / total)
+                if total:
+                    self.updateStatus("download", total_written / total)
+
+    def _download_parallel(self, url, fname, total):
+        """
+        Downloads `total` bytes over DOWNLOAD_CONNECTIONS parallel range
+        requests, each writing directly to its offset in a preallocated file.
+        Each part retries (resuming where it left off) up to DOWNLOAD_RETRIES.
+        """
+        connections = min(
+            DOWNLOAD_CONNECTIONS, math.ceil(total / DOWNLOAD_MIN_PART_SIZE)
+        )
+        part_size = math.ceil(total / connections)
+        parts = [
+            (start, min(start + part_size, total) - 1)
+            for start in range(0, total, part_size)
+        ]
+        print(f"Downloading in {len(parts)} parts of up to {part_size} bytes")
+
+        # Only appears at `fname` once complete, since a preallocated file
+        # with holes can't be resumed like a partial single stream download.
+        parts_fname = fname + ".parts"
+        with open(parts_fname, "wb") as file:
+            file.truncate(total)
+
+        lock = threading.Lock()
+        total_written = 0
+
+        with tqdm(
+            desc="Downloading",
+            total=total,
+            unit="iB",
+            unit_scale=True,
+            unit_divisor=1024,
+        ) as bar:
+
+            def progress(size):
+                nonlocal total_written
+                with lock:
+                    bar.update(size)
+                    total_written += size
+                    self.updateStatus("download", total_written / total)
+
+            fd = os.open(parts_fname, os.O_WRONLY)
+            # On the first failed part, the others stop at their next chunk.
+            stop = threading.Event()
+            executor = ThreadPoolExecutor(max_workers=len(parts))
+            try:
+                futures = [
+                    executor.submit(
+                        self._download_part, url, fd, start, end, progress, stop
+                    )
+                    for start, end in parts
+                ]
+                for future in as_completed(futures):
+                    future.result()
+            except:
+                stop.set()
+                executor.shutdown(wait=True, cancel_futures=True)
+                os.close(fd)
+                os.remove(parts_fname)
+                raise
+            executor.shutdown()
+            os.close(fd)
+            os.replace(parts_fname, fname)
+
+    def _download_part(self, url, fd, start, end, progress, stop=None):
+        stop = stop or threading.Event()
+        offset = start
+        attempt = 0
+        with requests.Session() as session:
+            while offset <= end and not stop.is_set():
+                try:
+                    resp = session.get(
+                        url,
+                        headers={"Range": f"bytes={offset}-{end}", **IDENTITY},
+                        stream=True,
+                        timeout=60,
+                    )
+                    if resp.status_code != 206:
+                        raise requests.HTTPError(
+                            f"Expected 206 for range request, got {resp.status_code}"
+                        )
+                    for data in resp.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        if stop.is_set():
+                            resp.close()
+                            return
+                        os.pwrite(fd, data, offset)
+                        offset += len(data)
+                        progress(len(data))
+                    if offset <= end:
+                        raise requests.ConnectionError("Connection closed early")
+                except requests.RequestException as error:
+                    attempt += 1
+                    if attempt > DOWNLOAD_RETRIES:
+                        raise
+                    print(f"Retrying bytes {offset}-{end} (attempt {attempt})", error)
+                    stop.wait(2**attempt)
@@ -0,0 +1,130 @@
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .HTTPStorage import HTTPStorage
+
+DATA = os.urandom(1024 * 1024 + 123)
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    accept_ranges = True
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def send_data_headers(self):
+        range_header = self.headers.get("Range")
+        if range_header and self.accept_ranges:
+            start, end = re.match(r"bytes=(\d+)-(\d*)", range_header).groups()
+            end = int(end) if end else len(DATA) - 1
+            body = DATA[int(start) : end + 1]
+            self.send_response(206)
+        else:
+            body = DATA
+            self.send_response(200)
+        if self.accept_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        return body
+
+    def do_HEAD(self):
+        self.send_data_headers()
+
+    def do_GET(self):
+        type(self).requests.append(self.headers.get("Range"))
+        self.wfile.write(self.send_data_headers())
+
+
+class NoRangeHandler(RangeHandler):
+    accept_ranges = False
+
+
+class FailingPartHandler(RangeHandler):
+    """The first part always fails, the others are slow."""
+
+    sent = 0
+
+    def do_GET(self):
+        range_header = self.headers.get("Range")
+        if range_header and range_header.startswith("bytes=0-"):
+            self.send_response(500)
+            self.end_headers()
+            return
+        body = self.send_data_headers()
+        try:
+            for i in range(0, len(body), 16 * 1024):
+                self.wfile.write(body[i : i + 16 * 1024])
+                type(self).sent += 16 * 1024
+                time.sleep(0.05)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class HTTPStorageDownloadTest(unittest.TestCase):
+    def serve(self, handler):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.shutdown)
+        return f"http://127.0.0.1:{server.server_port}/file.bin"
+
+    def download(self, url):
+        with tempfile.TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, "file.bin")
+            HTTPStorage(url).download_file(fname)
+            with open(fname, "rb") as file:
+                return file.read()
+
+    @mock.patch.object(
+        sys.modules[HTTPStorage.__module__], "DOWNLOAD_MIN_PART_SIZE", 256 * 1024
+    )
+    def test_parallel_ranges(self):
+        RangeHandler.requests = []
+        self.assertEqual(self.download(self.serve(RangeHandler)), DATA)
+        self.assertEqual(len(RangeHandler.requests), 5)
+
+    @mock.patch.object(
+        sys.modules[HTTPStorage.__module__], "DOWNLOAD_MIN_PART_SIZE", 256 * 1024
+    )
+    @mock.patch.object(sys.modules[HTTPStorage.__module__], "DOWNLOAD_RETRIES", 0)
+    @mock.patch.object(
+        sys.modules[HTTPStorage.__module__], "DOWNLOAD_CHUNK_SIZE", 16 * 1024
+    )
+    def test_failed_part_stops_others(self):
+        FailingPartHandler.sent = 0
+        url = self.serve(FailingPartHandler)
+        start = time.monotonic()
+        with self.assertRaises(Exception):
+            self.download(url)
+        # Each slow part would take ~0.8s to finish
+        self.assertLess(time.monotonic() - start, 0.7)
+        self.assertLess(FailingPartHandler.sent, len(DATA) // 2)
+
+    def test_single_stream_fallback(self):
+        NoRangeHandler.requests = []
+        self.assertEqual(self.download(self.serve(NoRangeHandler)), DATA)
+        self.assertEqual(NoRangeHandler.requests, [None])
+
+    def test_resume_partial(self):
+        RangeHandler.requests = []
+        url = self.serve(RangeHandler)
+        with tempfile.TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, "file.bin")
+            with open(fname, "wb") as file:
+                file.write(DATA[:1000])
+            HTTPStorage(url).download_file(fname, resume=True)
+            with open(fname, "rb") as file:
+                self.assertEqual(file.read(), DATA)
+        self.assertEqual(RangeHandler.requests, ["bytes=1000-"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -106,7 +106,13 @@ class S3Storage(BaseStorage):
 
         return {"$time": upload_total}
 
-    def download_file(self, dest):
+    def get_info(self):
+        object = self.s3resource().Object(self.bucket_name, self.path)
+        object.load()
+        return {"size": object.content_length, "etag": object.e_tag}
+
+    def download_file(self, dest, resume=False):
+        # boto3 handles parallel (multipart) downloads itself, but no resume.
         if not dest:
             dest = self.path.split("/").pop()
         print(f"Downloading {self.url} to {dest}...")
@@ -126,6 +132,13 @@ class S3Storage(BaseStorage):
 
             object.download_file(Filename=dest, Callback=callback)
 
+    streamable = True
+
+    def open_stream(self):
+        print(f"Streaming {self.url}...")
+        response = self.s3resource().Object(self.bucket_name, self.path).get()
+        return response["Body"], response["ContentLength"]
+
     def file_exists(self):
         # res = self.s3client().list_objects_v2(
         #    Bucket=self.bucket_name, Prefix=self.path, MaxKeys=1